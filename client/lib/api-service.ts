@@ -29,7 +29,8 @@ export class ApiService {
     sessionId: number,
     onChunkReceived: (chunk: string) => void,
     onDiagnosticComplete: (result: string) => void,
-    onError: (error: string) => void
+    onError: (error: string) => void,
+    onSimilarCases?: (cases: any[]) => void
   ): WebSocket | null {
     const token = getToken();
     console.log("Connecting WebSocket with session ID:", sessionId);
@@ -48,15 +49,28 @@ export class ApiService {
       console.log("Diagnostic WebSocket connection established");
     };
 
+    // The completion frame only carries the result id and hash, so the text is assembled here
+    let streamed = "";
+
     socket.onmessage = (event) => {
       try {
         const data = JSON.parse(event.data);
         console.log("WebSocket message received:", data);
 
         if (data.chunk) {
+          streamed += data.chunk;
           onChunkReceived(data.chunk);
         } else if (data.complete) {
-          onDiagnosticComplete(data.result);
+          onDiagnosticComplete(data.result ?? streamed);
+          streamed = "";
+        } else if (data.type === "stream_started") {
+          console.log("Diagnostic result started:", data.result_id);
+          streamed = "";
+        } else if (data.type === "similar_cases") {
+          onSimilarCases?.(data.cases);
+        } else if (data.type === "cancelled") {
+          console.log("Diagnostic cancelled:", data.result_id);
+          streamed = "";
         } else if (data.error) {
           console.error("WebSocket error in message:", data.error);
           onError(data.error);
@@ -100,6 +114,28 @@ export class ApiService {
     }
   }
 
+  // Stop the diagnosis being streamed on this socket and drop queued inputs
+  static cancelDiagnostic(socket: WebSocket): void {
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      socket.send(JSON.stringify({ cancel: true }));
+    } else {
+      console.error("WebSocket is not open");
+    }
+  }
+
+  // Continue a dropped diagnostic stream; offset is the number of characters already received
+  static resumeDiagnosticStream(
+    socket: WebSocket,
+    resultId: number,
+    offset: number
+  ): void {
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      socket.send(JSON.stringify({ resume: resultId, offset }));
+    } else {
+      console.error("WebSocket is not open");
+    }
+  }
+
   static async getPredictedParts(sessionId: string): Promise<any[]> {
     const token = getToken();
     const response = await fetch(`${BASE_URL}/sessions/${sessionId}`, {
@@ -117,10 +153,17 @@ export class ApiService {
     return data.parts || [];
   }
 
-  static async getDiagnosticSessions(): Promise<any[]> {
+  // One newest-first page of sessions; nextCursor is null on the last page
+  static async getDiagnosticSessionsPage(
+    cursor: number | null = null,
+    limit = 200
+  ): Promise<{ sessions: any[]; nextCursor: number | null }> {
     const token = getToken();
-    console.log("Token for sessions request:", token ? "Exists" : "Missing");
-    const response = await fetch(`${BASE_URL}/sessions`, {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (cursor !== null) {
+      params.set("cursor", String(cursor));
+    }
+    const response = await fetch(`${BASE_URL}/sessions?${params}`, {
       method: "GET",
       headers: {
         Authorization: `Bearer ${token}`,
@@ -136,6 +179,66 @@ export class ApiService {
       throw new Error("Failed to fetch diagnostic sessions");
     }
 
+    const nextCursor = response.headers.get("X-Next-Cursor");
+    return {
+      sessions: await response.json(),
+      nextCursor: nextCursor !== null ? Number(nextCursor) : null,
+    };
+  }
+
+  // Every session, following X-Next-Cursor until the last page
+  static async getDiagnosticSessions(): Promise<any[]> {
+    const sessions: any[] = [];
+    let cursor: number | null = null;
+    do {
+      const page: { sessions: any[]; nextCursor: number | null } =
+        await this.getDiagnosticSessionsPage(cursor);
+      sessions.push(...page.sessions);
+      cursor = page.nextCursor;
+    } while (cursor !== null);
+    return sessions;
+  }
+
+  // Full-text search over past sessions; nextOffset is null on the last page
+  static async searchSessions(
+    query: string,
+    offset = 0
+  ): Promise<{ results: any[]; nextOffset: number | null }> {
+    const token = getToken();
+    const params = new URLSearchParams({ q: query, offset: String(offset) });
+    const response = await fetch(`${BASE_URL}/search?${params}`, {
+      method: "GET",
+      headers: {
+        Authorization: `Bearer ${token}`,
+      },
+    });
+
+    if (!response.ok) {
+      throw new Error("Failed to search sessions");
+    }
+
+    const nextOffset = response.headers.get("X-Next-Offset");
+    return {
+      results: await response.json(),
+      nextOffset: nextOffset !== null ? Number(nextOffset) : null,
+    };
+  }
+
+  // Past cases most like the given symptoms, best first
+  static async getSimilarCases(query: string, k = 5): Promise<any[]> {
+    const token = getToken();
+    const params = new URLSearchParams({ q: query, k: String(k) });
+    const response = await fetch(`${BASE_URL}/similar-cases?${params}`, {
+      method: "GET",
+      headers: {
+        Authorization: `Bearer ${token}`,
+      },
+    });
+
+    if (!response.ok) {
+      throw new Error("Failed to fetch similar cases");
+    }
+
     return await response.json();
   }
 
@@ -1,15 +1,19 @@
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
-from sqlalchemy.orm import Session
+import asyncio
+import os
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
 
 from app.database import get_db
 from app.models import User
 from app.schemas import TokenData
+from app.services.diagnostic_cache import LRUCache
 
 # Configuration
 SECRET_KEY = "YOUR_SECRET_KEY_HERE"  # In production, use a secure random key
@@ -30,12 +34,47 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# bcrypt runs on a small dedicated pool so hashing never blocks the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_password_ops_pending = 0
+
+async def _run_password_op(func, *args):
+    # Reject instead of queueing without bound when the pool is saturated
+    global _password_ops_pending
+    if _password_ops_pending >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication is busy, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    _password_ops_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        _password_ops_pending -= 1
+
+# Verify password off the event loop
+async def verify_password_async(plain_password, hashed_password):
+    return await _run_password_op(verify_password, plain_password, hashed_password)
+
+# Hash password off the event loop
+async def get_password_hash_async(password):
+    return await _run_password_op(get_password_hash, password)
+
+# Look up a user by email
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(User).where(User.email == email))
+    return result.scalars().first()
+
 # Authenticate user
-def authenticate_user(db: Session, email: str, password: str):
-    user = db.query(User).filter(User.email == email).first()
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = await get_user_by_email(db, email)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return False
     return user
 
@@ -53,31 +92,38 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     
     return encoded_jwt
 
-# Get current user
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
+# Cached user lookups: short TTL so deleted or changed users drop out quickly
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "1024"))
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+
+class AuthenticatedUser:
+    """Detached snapshot of the user fields request handlers read; safe to share between requests."""
+    __slots__ = ("id", "email", "created_at")
+
+    def __init__(self, id: int, email: str, created_at: datetime):
+        self.id = id
+        self.email = email
+        self.created_at = created_at
+
+    @classmethod
+    def from_user(cls, user: User) -> "AuthenticatedUser":
+        return cls(user.id, user.email, user.created_at)
+
+# Keyed by (subject, token); expiry is checked by jwt.decode before every lookup
+user_cache = LRUCache(AUTH_USER_CACHE_SIZE, AUTH_USER_CACHE_TTL)
+
+# Invalidation hook: call after a user's email, password or account is changed or removed
+def invalidate_user(email: Optional[str] = None, user_id: Optional[int] = None):
+    user_cache.discard_where(
+        lambda key, user: (email is not None and user.email == email) or (user_id is not None and user.id == user_id)
     )
-    
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        token_data = TokenData(email=email)
-    except JWTError:
-        raise credentials_exception
-    
-    user = db.query(User).filter(User.email == token_data.email).first()
-    if user is None:
-        raise credentials_exception
-    
-    return user
+
+# Get current user
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    return await get_current_user_from_token(token, db)
 
 # Get current user from token without using Depends
-def get_current_user_from_token(token: str, db: Session):
+async def get_current_user_from_token(token: str, db: AsyncSession):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -93,8 +139,22 @@ def get_current_user_from_token(token: str, db: Session):
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.email == token_data.email).first()
+    cache_key = (token_data.email, token)
+    user = user_cache.get(cache_key)
+    if user is not None:
+        return user
+    
+    # Tokens carrying a user_id claim resolve by primary key
+    user_id = payload.get("user_id")
+    if user_id is not None:
+        user = await db.get(User, user_id)
+        if user is not None and user.email != token_data.email:
+            user = None
+    else:
+        user = await get_user_by_email(db, token_data.email)
     if user is None:
         raise credentials_exception
     
+    user = AuthenticatedUser.from_user(user)
+    user_cache.set(cache_key, user)
     return user
@@ -0,0 +1,146 @@
+from typing import List, Optional
+
+from sqlalchemy import Float, String, Text, and_, cast, literal, null, or_, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Session as DiagnosticSession, DiagnosticResult, PartPrediction, RepairSummary
+
+# Page sizes for GET /sessions
+SESSIONS_PAGE_SIZE = 50
+SESSIONS_MAX_PAGE_SIZE = 200
+
+
+async def list_sessions_page(
+    db: AsyncSession,
+    user_id: int,
+    limit: int = SESSIONS_PAGE_SIZE,
+    cursor: Optional[int] = None,
+    prefix: Optional[str] = None
+) -> List:
+    """
+    Keyset page of a user's sessions, newest first, ordered by (created_at, id).
+
+    cursor is the id of the last session on the previous page; its
+    created_at is read in the same statement so the comparison happens on
+    stored values. Only the listed columns are selected, no ORM objects
+    are built. prefix filters on the start of input_text, case-insensitively.
+    """
+    stmt = select(
+        DiagnosticSession.id,
+        DiagnosticSession.input_text,
+        DiagnosticSession.created_at
+    ).where(DiagnosticSession.user_id == user_id)
+
+    if cursor is not None:
+        anchor_created_at = select(DiagnosticSession.created_at).where(
+            DiagnosticSession.id == cursor,
+            DiagnosticSession.user_id == user_id
+        ).scalar_subquery()
+        stmt = stmt.where(or_(
+            DiagnosticSession.created_at < anchor_created_at,
+            and_(DiagnosticSession.created_at == anchor_created_at, DiagnosticSession.id < cursor)
+        ))
+
+    if prefix:
+        stmt = stmt.where(DiagnosticSession.input_text.istartswith(prefix, autoescape=True))
+
+    stmt = stmt.order_by(DiagnosticSession.created_at.desc(), DiagnosticSession.id.desc()).limit(limit)
+    return (await db.execute(stmt)).all()
+
+
+async def get_session_graph(
+    db: AsyncSession,
+    session_id: int,
+    user_id: int,
+    include_output: bool = True
+) -> Optional[dict]:
+    """
+    Load a session with its diagnostic results, parts and summary in one round trip.
+
+    The four tables are combined with UNION ALL into rows of
+    (kind, id, text_a, text_b, number, label, created_at); ownership is
+    enforced in every branch. Returns None if the session does not exist
+    or belongs to another user. With include_output=False the potentially
+    large output_text bodies are never selected.
+    """
+    owned_session = select(DiagnosticSession.id).where(
+        DiagnosticSession.id == session_id,
+        DiagnosticSession.user_id == user_id
+    ).scalar_subquery()
+
+    no_text = cast(null(), Text)
+    no_number = cast(null(), Float)
+    no_label = cast(null(), String)
+
+    graph = union_all(
+        select(
+            literal("session", String).label("kind"),
+            DiagnosticSession.id.label("id"),
+            DiagnosticSession.input_text.label("text_a"),
+            no_text.label("text_b"),
+            no_number.label("number"),
+            no_label.label("label"),
+            DiagnosticSession.created_at.label("created_at"),
+        ).where(DiagnosticSession.id == owned_session),
+        select(
+            literal("result", String),
+            DiagnosticResult.id,
+            DiagnosticResult.input_message,
+            DiagnosticResult.output_text if include_output else no_text,
+            no_number,
+            DiagnosticResult.status,
+            DiagnosticResult.created_at,
+        ).where(DiagnosticResult.session_id == owned_session),
+        select(
+            literal("part", String),
+            PartPrediction.id,
+            PartPrediction.part_name,
+            no_text,
+            PartPrediction.confidence_score,
+            PartPrediction.price_estimate,
+            PartPrediction.created_at,
+        ).where(PartPrediction.session_id == owned_session),
+        select(
+            literal("summary", String),
+            RepairSummary.id,
+            RepairSummary.summary_text,
+            no_text,
+            no_number,
+            no_label,
+            RepairSummary.created_at,
+        ).where(RepairSummary.session_id == owned_session),
+    ).subquery()
+
+    rows = (await db.execute(select(graph).order_by(graph.c.id))).all()
+
+    session_row = None
+    diagnostic_results, parts, summaries = [], [], []
+    for row in rows:
+        if row.kind == "session":
+            session_row = row
+        elif row.kind == "result":
+            result = {"id": row.id, "input_message": row.text_a, "status": row.label}
+            if include_output:
+                result["output_text"] = row.text_b
+            diagnostic_results.append(result)
+        elif row.kind == "part":
+            parts.append({
+                "id": row.id,
+                "name": row.text_a,
+                "confidence": row.number,
+                "price": row.label
+            })
+        else:
+            summaries.append(row.text_a)
+
+    if session_row is None:
+        return None
+
+    return {
+        "session_id": session_row.id,
+        "input_text": session_row.text_a,
+        "diagnostic_results": diagnostic_results,
+        "parts": parts,
+        "summary": summaries[0] if summaries else None,
+        "created_at": session_row.created_at.isoformat()
+    }
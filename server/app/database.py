@@ -1,12 +1,33 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
+import threading
+import time
+
+from app.metrics import instrument_engine
 
 # Database URL from environment variable or default to SQLite for development
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./detect_auto.db")
 
-# Create SQLAlchemy engine
+# Map a sync driver URL to its async counterpart (asyncpg for Postgres, aiosqlite for SQLite)
+def to_async_url(url: str) -> str:
+    if url.startswith("postgresql+psycopg2://"):
+        return "postgresql+asyncpg://" + url[len("postgresql+psycopg2://"):]
+    if url.startswith("postgresql://"):
+        return "postgresql+asyncpg://" + url[len("postgresql://"):]
+    if url.startswith("postgres://"):
+        return "postgresql+asyncpg://" + url[len("postgres://"):]
+    if url.startswith("sqlite:///"):
+        return "sqlite+aiosqlite:///" + url[len("sqlite:///"):]
+    return url
+
+# Async URL used by the request handlers; can be overridden explicitly
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(DATABASE_URL))
+
+# Create SQLAlchemy engine (sync, used for table creation, migrations and scripts)
 engine = create_engine(
     DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
 )
@@ -14,13 +35,121 @@ engine = create_engine(
 # Create sessionmaker
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Connection pool settings (ignored for SQLite, which does not use a queue pool)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+
+class PoolMetrics:
+    """Checkout counters for the async engine's connection pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.timeouts = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_checkout(self):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def record_checkin(self):
+        with self._lock:
+            self.checkins += 1
+            self.in_use = max(0, self.in_use - 1)
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self, pool=None) -> dict:
+        with self._lock:
+            data = {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(self.wait_total / self.wait_count * 1000, 3) if self.wait_count else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+        if pool is not None:
+            data["pool_class"] = type(pool).__name__
+            data["status"] = pool.status()
+            if isinstance(pool, AsyncAdaptedQueuePool):
+                data.update({
+                    "size": pool.size(),
+                    "checked_out": pool.checkedout(),
+                    "overflow": pool.overflow(),
+                    "max_overflow": DB_MAX_OVERFLOW,
+                    "timeout": DB_POOL_TIMEOUT,
+                })
+        return data
+
+pool_metrics = PoolMetrics()
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long callers wait for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_metrics.record_wait(time.perf_counter() - started)
+        return connection
+
+def _async_engine_options(url: str) -> dict:
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if url.startswith("sqlite"):
+        options["connect_args"] = {"check_same_thread": False}
+    else:
+        options.update({
+            "poolclass": InstrumentedQueuePool,
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+        })
+    return options
+
+# Create async engine used by the API so queries don't block the event loop
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_async_engine_options(ASYNC_DATABASE_URL))
+
+@event.listens_for(async_engine.sync_engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_metrics.record_checkout()
+
+@event.listens_for(async_engine.sync_engine, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    pool_metrics.record_checkin()
+
+# Statement counts and timings, per request and in total, for /metrics
+instrument_engine(async_engine.sync_engine)
+
+# Objects stay usable after commit; lazy loads are not available on async sessions
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
 # Create base class for models
 Base = declarative_base()
 
 # Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,82 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# Logging configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+# Emit one in N per-chunk debug events
+LOG_CHUNK_SAMPLE_EVERY = max(1, int(os.getenv("LOG_CHUNK_SAMPLE_EVERY", "50")))
+
+_STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; extra= fields are included as top-level keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class Sampler:
+    """
+    Cheap gate for per-chunk debug events.
+
+    Returns False without touching the counter unless the logger is
+    enabled for DEBUG, so the hot path costs one level check when debug
+    logging is off.
+    """
+
+    def __init__(self, logger: logging.Logger, every: int = LOG_CHUNK_SAMPLE_EVERY):
+        self.logger = logger
+        self.every = every
+        self._count = 0
+
+    def __call__(self) -> bool:
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return False
+        self._count += 1
+        return self._count % self.every == 1 or self.every == 1
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """
+    Route the "app" loggers through a queue so records are formatted and
+    written on a background thread instead of the event loop.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if fmt == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(level)
+    app_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    app_logger.propagate = False
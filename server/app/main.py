@@ -1,27 +1,45 @@
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Response, WebSocket, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional, Dict, Any, Union
 import json
 import asyncio
+import logging
 import uvicorn
-# Logging replaced with print statements
 
-from app.models import User, Session as DiagnosticSession, DiagnosticResult, PartPrediction, RepairNote, RepairSummary
-from app.database import get_db, engine, Base
+from app.logging_config import configure_logging
+from app.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, registry
+from app.models import User, Session as DiagnosticSession
+from app.crud import get_session_graph, list_sessions_page, SESSIONS_PAGE_SIZE, SESSIONS_MAX_PAGE_SIZE
+from app.database import get_db, engine, Base, AsyncSessionLocal, async_engine, pool_metrics
+from app.search_index import search_sessions
 from app.schemas import (
     UserCreate, UserResponse, SessionCreate, SessionResponse, 
     DiagnosticResultCreate, PartPredictionCreate, RepairNoteCreate, 
-    RepairSummaryCreate, RepairSummaryResponse, Token, TokenData
+    RepairSummaryCreate, RepairSummaryResponse, Token, TokenData, JobResponse
 )
 from app.auth import (
-    authenticate_user, create_access_token, get_password_hash, 
-    get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user_from_token
-)
-from app.services.ai_service import (
-    generate_diagnostic, predict_parts, generate_repair_summary
+    authenticate_user, create_access_token, get_password_hash_async, 
+    get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user_from_token, user_cache
 )
+from app.services.connections import connection_manager
+from app.services.conversation import conversation_context
+from app.services.diagnostic_cache import diagnostic_cache
+from app.services.diagnostic_results import fail_stale_results
+from app.services.diagnostic_socket import DiagnosticSocket
+from app.services.jobs import job_queue
+from app.services.llm_scheduler import llm_scheduler, UpstreamError
+from app.services.orders import predict_session_parts, summarize_session_order
+from app.services.similar_cases import SIMILAR_TOP_K, similar_cases
+from app.services.streaming import flush_policy_from_params
+
+configure_logging()
+logger = logging.getLogger("app.main")
 
 # Create tables
 Base.metadata.create_all(bind=engine)
@@ -35,30 +53,114 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Next-Offset"],
 )
 
-# WebSocket connections
-active_connections = {}
+# Per-route latency, status and DB statements, exported on /metrics
+app.add_middleware(MetricsMiddleware)
+
+def _hit_ratio(hits: int, misses: int) -> float:
+    return hits / (hits + misses) if hits + misses else 0.0
+
+# Gauges read from existing state at scrape time, so hot paths pay nothing for them
+registry.callback("websocket_connections", "Open WebSocket connections on this worker", connection_manager.connection_count)
+registry.callback(
+    "cache_hits_total", "Cache hits",
+    lambda: {
+        ("diagnostic",): diagnostic_cache.hits,
+        ("auth_user",): user_cache.hits,
+        ("conversation",): conversation_context.cache.hits,
+    }, ("cache",), kind="counter")
+registry.callback(
+    "cache_misses_total", "Cache misses",
+    lambda: {
+        ("diagnostic",): diagnostic_cache.misses,
+        ("auth_user",): user_cache.misses,
+        ("conversation",): conversation_context.cache.misses,
+    }, ("cache",), kind="counter")
+registry.callback(
+    "cache_hit_ratio", "Cache hit ratio since start",
+    lambda: {
+        ("diagnostic",): _hit_ratio(diagnostic_cache.hits, diagnostic_cache.misses),
+        ("auth_user",): _hit_ratio(user_cache.hits, user_cache.misses),
+        ("conversation",): _hit_ratio(conversation_context.cache.hits, conversation_context.cache.misses),
+    }, ("cache",))
+registry.callback(
+    "llm_scheduler_queue_depth", "Upstream model calls waiting for admission",
+    lambda: {(name,): depth for name, depth in llm_scheduler.metrics.queued.items()}, ("priority",))
+registry.callback("llm_scheduler_in_flight", "Upstream model calls in flight", lambda: llm_scheduler.in_flight)
+registry.callback("db_pool_connections_in_use", "Database connections checked out", lambda: pool_metrics.in_use)
+registry.callback("job_queue_depth", "Background jobs waiting for a worker", lambda: job_queue.queue.qsize())
+registry.callback(
+    "similar_case_index_rows", "Cases in the similar case index",
+    lambda: {("base",): similar_cases.stats()["base_rows"], ("delta",): similar_cases.stats()["delta_rows"]},
+    ("segment",))
+
+@app.on_event("startup")
+async def start_background_services():
+    await connection_manager.start()
+    await fail_stale_results()
+    await job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_background_services():
+    await job_queue.stop()
+    await connection_manager.stop()
+
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus text format; scrape this endpoint
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/metrics/db-pool")
+async def get_db_pool_metrics():
+    # Pool checkout wait times and in-use counts for sizing DB_POOL_SIZE / DB_MAX_OVERFLOW
+    return pool_metrics.snapshot(async_engine.pool)
+
+@app.get("/metrics/diagnostic-cache")
+async def get_diagnostic_cache_metrics():
+    # Hit ratio and upstream latency saved by the diagnostic response cache
+    return diagnostic_cache.stats()
+
+@app.get("/metrics/llm-scheduler")
+async def get_llm_scheduler_metrics():
+    # Queue depth, admission wait and retries for upstream model calls
+    return llm_scheduler.stats()
+
+@app.get("/metrics/similar-cases")
+async def get_similar_case_metrics():
+    # Size of the similar case index segments and whether a rebuild is running
+    return similar_cases.stats()
+
+@app.exception_handler(UpstreamError)
+async def upstream_error_handler(request, exc: UpstreamError):
+    # The model provider is rate limiting or down even after retries
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "5"}
+    )
 
 @app.post("/auth/register", response_model=UserResponse)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
     # Check if user already exists
-    db_user = db.query(User).filter(User.email == user_data.email).first()
+    result = await db.execute(select(User).where(User.email == user_data.email))
+    db_user = result.scalars().first()
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create new user
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash_async(user_data.password)
     db_user = User(email=user_data.email, hashed_password=hashed_password)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     return db_user
 
 @app.post("/auth/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -66,7 +168,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    access_token = create_access_token(data={"sub": user.email})
+    access_token = create_access_token(data={"sub": user.email, "user_id": user.id})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/auth/me", response_model=UserResponse)
@@ -77,28 +179,33 @@ async def get_me(current_user: User = Depends(get_current_user)):
 async def create_session(
     session_data: SessionCreate, 
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     db_session = DiagnosticSession(
         user_id=current_user.id,
         input_text=session_data.input_text
     )
     db.add(db_session)
-    db.commit()
-    db.refresh(db_session)
+    await db.commit()
+    await db.refresh(db_session)
     
     return db_session
 
 
 @app.get("/sessions")
 async def get_diagnostic_sessions(
+    response: Response,
+    limit: int = Query(SESSIONS_PAGE_SIZE, ge=1, le=SESSIONS_MAX_PAGE_SIZE),
+    cursor: Optional[int] = None,
+    q: Optional[str] = None,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    # Fetch all diagnostic sessions for the current user
-    sessions = db.query(DiagnosticSession).filter(
-        DiagnosticSession.user_id == current_user.id
-    ).order_by(DiagnosticSession.created_at.desc()).all()
+    # Newest-first page of the user's sessions; pass X-Next-Cursor back as ?cursor= for the next page
+    sessions = await list_sessions_page(db, current_user.id, limit=limit, cursor=cursor, prefix=q)
+    
+    if len(sessions) == limit:
+        response.headers["X-Next-Cursor"] = str(sessions[-1].id)
     
     return [{
         "session_id": session.id,
@@ -109,57 +216,56 @@ async def get_diagnostic_sessions(
 @app.get("/sessions/{session_id}")
 async def get_diagnostic_session(
     session_id: int,
+    include_output: bool = True,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    # Fetch specific diagnostic session for the current user
-    session = db.query(DiagnosticSession).filter(
-        DiagnosticSession.id == session_id,
-        DiagnosticSession.user_id == current_user.id
-    ).first()
+    # Fetch the session, its results, parts and summary in a single query
+    session_graph = await get_session_graph(db, session_id, current_user.id, include_output=include_output)
     
-    if not session:
+    if not session_graph:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    # Fetch all diagnostic results for this session
-    diagnostic_results = db.query(DiagnosticResult).filter(
-        DiagnosticResult.session_id == session_id
-    ).all()
-    
-    # Fetch parts predictions
-    parts = db.query(PartPrediction).filter(
-        PartPrediction.session_id == session_id
-    ).all()
+    return session_graph
+
+@app.get("/search")
+async def search_diagnostic_history(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(SESSIONS_PAGE_SIZE, ge=1, le=SESSIONS_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # Full-text search over the user's sessions, best match first; pass X-Next-Offset back as ?offset=
+    try:
+        results, more = await search_sessions(db, current_user.id, q, limit=limit, offset=offset)
+    except NotImplementedError as e:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=str(e))
+    except (OperationalError, ProgrammingError) as e:
+        logger.warning("Search failed: %s", e)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Search index unavailable")
     
-    # Fetch repair summary
-    summary = db.query(RepairSummary).filter(
-        RepairSummary.session_id == session_id
-    ).first()
+    if more:
+        response.headers["X-Next-Offset"] = str(offset + limit)
     
-    return {
-        "session_id": session.id,
-        "input_text": session.input_text,
-        "diagnostic_results": [
-            {
-                "input_message": result.input_message,  
-                "output_text": result.output_text
-            } for result in diagnostic_results
-        ] if diagnostic_results else [],
-        "parts": [{
-            "id": part.id,
-            "name": part.part_name,
-            "confidence": part.confidence_score,
-            "price": part.price_estimate
-        } for part in parts],
-        "summary": summary.summary_text if summary else None,
-        "created_at": session.created_at.isoformat()
-    }
+    return [{**result, "created_at": result["created_at"].isoformat()} for result in results]
+
+@app.get("/similar-cases")
+async def get_similar_cases(
+    q: str = Query(..., min_length=1, max_length=2000),
+    k: int = Query(SIMILAR_TOP_K, ge=1, le=50),
+    exclude_session: Optional[int] = None,
+    current_user: User = Depends(get_current_user)
+):
+    # Past repairs most like the described symptoms, best first
+    return await similar_cases.similar_to(q, current_user.id, k=k, exclude_session=exclude_session)
 
 @app.post("/diagnostic/start")
 async def start_diagnostic_session(
     input_data: dict,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # Create a new diagnostic session
     session = DiagnosticSession(
@@ -167,8 +273,8 @@ async def start_diagnostic_session(
         input_text=input_data.get('input', '')
     )
     db.add(session)
-    db.commit()
-    db.refresh(session)
+    await db.commit()
+    await db.refresh(session)
     
     return {
         "session_id": session.id,
@@ -181,145 +287,54 @@ async def start_diagnostic_session(
 async def diagnostic_websocket(
     websocket: WebSocket, 
     session_id: int, 
-    token: Optional[str] = None,
-    db: Session = Depends(get_db)
+    token: Optional[str] = None
 ):
     # Validate token from query parameters
-    print(f"Token: {token}")
     token = token or websocket.query_params.get('token')
-    print(f"Token: {token}")
     if not token:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="No authentication token")
         return
     
     try:
-        # Validate token and get user
-        user = get_current_user_from_token(token, db)
-        
-        # Check if session exists and belongs to user
-        session = db.query(DiagnosticSession).filter(
-            DiagnosticSession.id == session_id,
-            DiagnosticSession.user_id == user.id
-        ).first()
+        # Per-connection chunking, e.g. ?flush=time&flush_ms=30 or ?flush=token
+        flush_policy = flush_policy_from_params(websocket.query_params)
         
-        if not session:
-            # Create new session if not exists
-            session = DiagnosticSession(user_id=user.id)
-            db.add(session)
-            db.commit()
-            db.refresh(session)
+        # DB sessions are checked out per step, never for the socket's lifetime
+        async with AsyncSessionLocal() as db:
+            # Validate token and get user
+            user = await get_current_user_from_token(token, db)
+            
+            # Check if session exists and belongs to user
+            result = await db.execute(
+                select(DiagnosticSession).where(
+                    DiagnosticSession.id == session_id,
+                    DiagnosticSession.user_id == user.id
+                )
+            )
+            session = result.scalars().first()
+            
+            if not session:
+                # Create new session if not exists
+                session = DiagnosticSession(user_id=user.id)
+                db.add(session)
+                await db.commit()
+                await db.refresh(session)
         
         # Accept WebSocket connection AFTER validation
-        print("Accepting WebSocket connection")
         await websocket.accept()
-        print("WebSocket accepted")
-        # Add to active connections
-        if user.id not in active_connections:
-            active_connections[user.id] = set()
-        active_connections[user.id].add(websocket)
+        logger.info("WebSocket accepted for session %s (user %s)", session.id, user.id)
         
         # Send initial session information
         await websocket.send_text(json.dumps({"session_id": session.id}))
         
-        # Handle messages
-        print("Handling messages")
-        while True:
-            try:
-                print("Receiving message")
-                data = await websocket.receive_text()
-                print(f"Received message: {data}")
-                message = json.loads(data)
-                
-                if "input" in message:
-                    user_input = message["input"]
-                    
-                    # Update session input
-                    session.input_text = user_input
-                    db.commit()
-                    
-                    # Generate diagnostic in chunks
-                    try:
-                        print(f"Starting diagnostic generation for session {session_id}")
-                        print(f"User input: {user_input}")
-
-                        # Collect chunks for final result
-                        full_result_chunks = []
-                        chunk_count = 0
-                        
-                        print("Calling generate_diagnostic...")
-                        diagnostic_generator = generate_diagnostic(user_input)
-                        print("Diagnostic generator created")
-                        
-                        try:
-                            async for chunk in diagnostic_generator:
-                                print(f"Chunk received: {chunk}")
-                                if chunk:  # Only send non-empty chunks
-                                    print(f"Processing chunk {chunk_count}: {len(chunk)} characters")
-                                    full_result_chunks.append(chunk)
-                                    try:
-                                        await websocket.send_text(json.dumps({"chunk": chunk}))
-                                        chunk_count += 1
-                                    except Exception as send_error:
-                                        print(f"Error sending chunk: {send_error}")
-                        except Exception as generator_error:
-                            print(f"Generator error: {generator_error}")
-                        
-                        # Combine chunks into full result
-                        full_result = ''.join(full_result_chunks)
-                        print(f"Total chunks received: {chunk_count}, Full result length: {len(full_result)} characters")
-                        
-                        # Save final diagnostic result
-                        try:
-                            diagnostic_result = DiagnosticResult(
-                                session_id=session.id,
-                                input_message=user_input,  # Store input message
-                                output_text=full_result
-                            )
-                            db.add(diagnostic_result)
-                            db.commit()
-                            print(f"Diagnostic result saved for session {session_id}")
-                        except Exception as db_error:
-                            print(f"Database save error: {db_error}")
-                        
-                        # Send completion message
-                        try:
-                            await websocket.send_text(json.dumps({"complete": True, "result": full_result}))
-                            print(f"Diagnostic generation complete for session {session_id}")
-                        except Exception as completion_error:
-                            print(f"Error sending completion message: {completion_error}")
-                    except Exception as gen_error:
-                        print(f"Diagnostic generation error for session {session_id}: {gen_error}")
-                        try:
-                            await websocket.send_text(json.dumps({"error": f"Diagnostic generation failed: {str(gen_error)}"}))
-                        except Exception as send_error:
-                            print(f"Error sending error message: {send_error}")
-                else:
-                    await websocket.send_text(json.dumps({"error": "Invalid message format"}))
-            
-            except json.JSONDecodeError as json_error:
-                print(f"WebSocket: Invalid JSON - {json_error}")
-                try:
-                    await websocket.send_text(json.dumps({"error": "Invalid JSON format"}))
-                except Exception as send_error:
-                    print(f"Error sending invalid JSON error: {send_error}")
-            
-            except WebSocketDisconnect:
-                print(f"WebSocket disconnected for session {session_id}")
-                break
-            
-            except Exception as unexpected_error:
-                print(f"Unexpected WebSocket error: {unexpected_error}")
-                try:
-                    await websocket.send_text(json.dumps({"error": f"Unexpected error: {str(unexpected_error)}"}))
-                except Exception as send_error:
-                    print(f"Error sending unexpected error message: {send_error}")
-                break
-            except Exception as e:
-                print(f"WebSocket message handling error: {e}")
-                await websocket.send_text(json.dumps({"error": str(e)}))
+        # Reader and writer run as separate tasks, so cancel, new inputs and disconnects are seen mid-stream.
+        # Pushed events go through the same writer as the socket's own frames.
+        connection = DiagnosticSocket(websocket, user.id, session.id, flush_policy)
+        connection_manager.connect(user.id, connection)
+        await connection.run()
     
     except Exception as e:
-        print(f"WebSocket global error: {str(e)}")
+        logger.warning("WebSocket global error: %s", e)
         try:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e))
         except:
@@ -327,110 +342,58 @@ async def diagnostic_websocket(
     finally:
         # Cleanup
         try:
-            if 'user' in locals() and user.id in active_connections and 'websocket' in locals():
-                active_connections[user.id].discard(websocket)
+            if 'connection' in locals():
+                connection_manager.disconnect(user.id, connection)
         except:
             pass
 
 @app.post("/predict-parts")
 async def predict_parts_endpoint(
     session_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    background: bool = False,
+    force: bool = False,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
 ):
-    # Get session and diagnostic result
-    session = db.query(DiagnosticSession).filter(
-        DiagnosticSession.id == session_id,
-        DiagnosticSession.user_id == current_user.id
-    ).first()
-    
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    diagnostic_result = db.query(DiagnosticResult).filter(
-        DiagnosticResult.session_id == session_id
-    ).first()
-    
-    if not diagnostic_result:
-        raise HTTPException(status_code=404, detail="Diagnostic result not found")
-    
-    # Predict parts
-    parts = await predict_parts(diagnostic_result.output_text)
-    
-    # Save predictions to database
-    db_parts = []
-    for part in parts:
-        db_part = PartPrediction(
-            session_id=session_id,
-            part_name=part["name"],
-            confidence_score=part["confidence"],
-            price_estimate=part["price"]
+    # A repeat prediction returns the stored parts; force=true asks the model again
+    # background=true queues the prediction and returns the job immediately (202)
+    if background:
+        job = await job_queue.submit(
+            current_user.id, "predict_parts", session_id, {"force": True} if force else None, client_key=idempotency_key
         )
-        db.add(db_part)
-        db_parts.append(db_part)
-    
-    db.commit()
-    
-    # Return parts with database IDs
-    for i, part in enumerate(parts):
-        part["id"] = db_parts[i].id
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(job))
     
-    return parts
+    return await predict_session_parts(current_user.id, session_id, force)
 
 @app.post("/summarize-order", response_model=RepairSummaryResponse)
 async def summarize_order(
     session_id: int,
     notes: Optional[str] = None,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    background: bool = False,
+    force: bool = False,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
 ):
-    # Get session, diagnostic result and parts
-    session = db.query(DiagnosticSession).filter(
-        DiagnosticSession.id == session_id,
-        DiagnosticSession.user_id == current_user.id
-    ).first()
-    
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    diagnostic_result = db.query(DiagnosticResult).filter(
-        DiagnosticResult.session_id == session_id
-    ).first()
-    
-    if not diagnostic_result:
-        raise HTTPException(status_code=404, detail="Diagnostic result not found")
-    
-    parts = db.query(PartPrediction).filter(
-        PartPrediction.session_id == session_id
-    ).all()
-    
-    # Save notes if provided
-    if notes:
-        repair_note = RepairNote(
-            session_id=session_id,
-            note_text=notes
+    # A repeat summary of the same inputs returns the stored one; force=true regenerates it
+    # background=true queues the summary and returns the job immediately (202)
+    if background:
+        params = {"notes": notes, "force": True} if force else {"notes": notes}
+        job = await job_queue.submit(
+            current_user.id, "summarize_order", session_id, params, client_key=idempotency_key
         )
-        db.add(repair_note)
-        db.commit()
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(job))
     
-    # Generate summary
-    parts_list = [part.part_name for part in parts]
-    summary_text = await generate_repair_summary(
-        diagnostic_result.output_text,
-        parts_list,
-        notes
-    )
-    
-    # Save summary
-    summary = RepairSummary(
-        session_id=session_id,
-        summary_text=summary_text
-    )
-    db.add(summary)
-    db.commit()
-    db.refresh(summary)
-    
-    return summary
+    return await summarize_session_order(current_user.id, session_id, notes, force)
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    job = await job_queue.get(job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,340 @@
+import contextvars
+import time
+from array import array
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Latency buckets in seconds, from sub-millisecond DB statements to long generations
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values) -> object:
+        """
+        Return the series for these label values, creating it on first use.
+
+        Hot paths should call this once and keep the child, so recording a
+        value is a plain method call with no lookups or allocations.
+        """
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        return self._children[()]
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    """Monotonic total."""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, child in list(self._children.items()):
+            lines.append(f"{self.name}{_label_text(self.labelnames, key)} {_format_value(child.value)}")
+        return lines
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down."""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, child in list(self._children.items()):
+            lines.append(f"{self.name}{_label_text(self.labelnames, key)} {_format_value(child.value)}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """
+    Gauge or counter read from existing state when scraped.
+
+    Used for values the app already tracks (open sockets, cache hit
+    counts), so the hot path pays nothing. The callback returns a number
+    or a dict of label-value tuples to numbers.
+    """
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], object],
+                 labelnames: Iterable[str] = (), kind: str = "gauge"):
+        self.callback = callback
+        self.kind = kind
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return None
+
+    def render(self) -> List[str]:
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = self.header()
+        for key, value in values.items():
+            lines.append(f"{self.name}{_label_text(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "total")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One slot per bound plus +Inf, allocated once
+        self.counts = array("Q", bytes(8 * (len(bounds) + 1)))
+        self.total = array("d", [0.0])
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total[0] += value
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; buckets are pre-allocated per series and cumulated only when scraped."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                labels = _label_text(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Named metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name: str):
+        self._metrics.pop(name, None)
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, callback: Callable[[], object],
+                 labelnames: Iterable[str] = (), kind: str = "gauge") -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, callback, labelnames, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# HTTP requests, labelled by route template rather than raw path to keep series bounded
+http_request_seconds = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+
+# Database work attributed to the request that issued it
+db_queries = registry.counter("db_queries_total", "SQL statements executed")
+db_query_seconds = registry.counter("db_query_seconds_total", "Time spent executing SQL statements")
+db_queries_per_request = registry.histogram(
+    "db_queries_per_request", "SQL statements per HTTP request", ("route",), COUNT_BUCKETS)
+db_seconds_per_request = registry.histogram(
+    "db_query_seconds_per_request", "SQL time per HTTP request", ("route",))
+
+
+class RequestDBStats:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+current_db_stats: contextvars.ContextVar[Optional[RequestDBStats]] = contextvars.ContextVar(
+    "current_db_stats", default=None)
+
+
+def instrument_engine(sync_engine):
+    """Count statements and their time, globally and for the current request."""
+    from sqlalchemy import event
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        db_queries.inc()
+        db_query_seconds.inc(elapsed)
+        stats = current_db_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-route latency, status and DB usage.
+
+    Runs in the request's own task (unlike BaseHTTPMiddleware), so the
+    context variable holding DB stats is visible to engine events fired
+    by the handler. WebSocket and lifespan scopes pass straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[object, str] = {}
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self._routes.get(endpoint)
+        if route is None:
+            route = "unmatched"
+            for candidate in scope["app"].routes:
+                if getattr(candidate, "endpoint", None) is endpoint:
+                    route = candidate.path
+                    break
+            self._routes[endpoint] = route
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        stats = RequestDBStats()
+        token = current_db_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_db_stats.reset(token)
+            route = self._route(scope)
+            method = scope["method"]
+            http_request_seconds.labels(method, route).observe(elapsed)
+            http_requests.labels(method, route, status_holder[0]).inc()
+            db_queries_per_request.labels(route).observe(stats.queries)
+            db_seconds_per_request.labels(route).observe(stats.seconds)
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Text, Boolean
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Text, Boolean, Index, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
+from app.search_index import install_search_index
 
 class User(Base):
     __tablename__ = "users"
@@ -26,6 +27,11 @@ class Session(Base):
     part_predictions = relationship("PartPrediction", back_populates="session")
     repair_notes = relationship("RepairNote", back_populates="session")
     repair_summaries = relationship("RepairSummary", back_populates="session")
+    
+    # Serves the newest-first keyset pagination in GET /sessions
+    __table_args__ = (
+        Index("ix_sessions_user_id_created_at", user_id, created_at.desc(), id.desc()),
+    )
 
 class DiagnosticResult(Base):
     __tablename__ = "diagnostic_results"
@@ -34,28 +40,45 @@ class DiagnosticResult(Base):
     session_id = Column(Integer, ForeignKey("sessions.id"))
     input_message = Column(Text)  # Added input_message field
     output_text = Column(Text)
+    # While "streaming", output_text grows in checkpoints; "complete"/"failed" rows are final
+    status = Column(String, default="complete", server_default="complete")
+    output_length = Column(Integer, nullable=True)
+    output_hash = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Bumped by every checkpoint, so a streaming row that stopped changing has lost its writer
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
     session = relationship("Session", back_populates="diagnostic_results")
+    
+    __table_args__ = (
+        Index("ix_diagnostic_results_session_id_created_at", session_id, created_at),
+    )
 
 class PartPrediction(Base):
     __tablename__ = "part_predictions"
     
     id = Column(Integer, primary_key=True, index=True)
+    # Indexed by ix_part_predictions_session_id_input_hash below
     session_id = Column(Integer, ForeignKey("sessions.id"))
     part_name = Column(String)
     confidence_score = Column(Float)
     selected = Column(Boolean, default=True)
     price_estimate = Column(String, nullable=True)
+    # Hash of the prompt that produced the row, so a repeat prediction is served from the table
+    input_hash = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     session = relationship("Session", back_populates="part_predictions")
+    
+    __table_args__ = (
+        Index("ix_part_predictions_session_id_input_hash", session_id, input_hash),
+    )
 
 class RepairNote(Base):
     __tablename__ = "repair_notes"
     
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(Integer, ForeignKey("sessions.id"))
+    session_id = Column(Integer, ForeignKey("sessions.id"), index=True)
     note_text = Column(Text)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
@@ -67,6 +90,34 @@ class RepairSummary(Base):
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(Integer, ForeignKey("sessions.id"))
     summary_text = Column(Text)
+    # Hash of the prompt that produced the row, so a repeat summary is served from the table
+    input_hash = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     session = relationship("Session", back_populates="repair_summaries")
+    
+    __table_args__ = (
+        Index("ix_repair_summaries_session_id_created_at", session_id, created_at),
+        Index("ix_repair_summaries_session_id_input_hash", session_id, input_hash),
+    )
+
+class Job(Base):
+    __tablename__ = "jobs"
+    
+    id = Column(String, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    session_id = Column(Integer, ForeignKey("sessions.id"))
+    kind = Column(String)
+    idempotency_key = Column(String, unique=True, index=True)
+    params = Column(Text, nullable=True)
+    status = Column(String, default="queued")
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    # Process that queued the job, and its last sign of life while the job is queued or running
+    owner = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+# The full-text index over these tables is created and backfilled along with them
+event.listen(Base.metadata, "after_create", lambda target, connection, **kw: install_search_index(connection))
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Any, Optional, List
 from datetime import datetime
 
 # User schemas
@@ -101,3 +101,14 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     email: Optional[str] = None
+
+# Job schemas
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    session_id: int
+    status: str
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
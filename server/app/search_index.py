@@ -0,0 +1,321 @@
+"""
+Full-text index over diagnostic history.
+
+Each session is one search document with four fields: the session input,
+its completed diagnostic results (input and output), its predicted part
+names and its repair summaries. Matching a whole session means a query
+like "P0420 civic" finds the job even when the code is in the diagnosis
+and the car is in the input.
+
+The index lives in the database and is kept in sync by triggers on the
+four source tables, so every write path (API, jobs, scripts) updates it
+in the same transaction:
+
+- SQLite: an FTS5 table (porter stemming), rowid = session id, ranked with bm25.
+- Postgres: a table with a weighted, generated tsvector column and a GIN
+  index, ranked with ts_rank_cd.
+
+Diagnostic results are indexed once they are final, not on every
+streaming checkpoint. The index is created (and backfilled) together with
+the tables, and by migration e2c4a7b91f36. To rebuild it from scratch:
+
+    python -m app.search_index
+"""
+import logging
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import DateTime, Float, Integer, Text, column, text
+
+logger = logging.getLogger("app.search_index")
+
+# Relevance of a match in each field: session input, parts, diagnostic results, summaries
+FIELD_WEIGHTS = {"input_text": 4.0, "parts": 2.0, "results": 1.0, "summary": 1.0}
+HIGHLIGHT_START, HIGHLIGHT_END = "<mark>", "</mark>"
+SNIPPET_WORDS = 16
+
+FIELDS = ("input_text", "results", "parts", "summary")
+
+# Documents for the sessions matching {where}
+_SQLITE_INSERT = """
+    INSERT INTO search_documents (rowid, input_text, results, parts, summary)
+    SELECT s.id, s.input_text,
+        (SELECT group_concat(coalesce(r.input_message, '') || char(10) || coalesce(r.output_text, ''), char(10) || char(10))
+         FROM diagnostic_results r WHERE r.session_id = s.id AND coalesce(r.status, 'complete') = 'complete'),
+        (SELECT group_concat(p.part_name, char(10)) FROM part_predictions p WHERE p.session_id = s.id),
+        (SELECT group_concat(m.summary_text, char(10) || char(10)) FROM repair_summaries m WHERE m.session_id = s.id)
+    FROM sessions s WHERE {where}
+"""
+
+
+def _sqlite_refresh(session_id: str) -> str:
+    """Trigger body statements that recompute one session's document."""
+    return (f"DELETE FROM search_documents WHERE rowid = {session_id}; "
+            + _SQLITE_INSERT.format(where=f"s.id = {session_id}") + "; ")
+
+
+# (name, event, table, WHEN condition, session id expressions to refresh)
+_SQLITE_TRIGGERS = [
+    ("search_sessions_insert", "AFTER INSERT", "sessions", None, ("new.id",)),
+    ("search_sessions_update", "AFTER UPDATE OF input_text", "sessions", None, ("new.id",)),
+    ("search_results_insert", "AFTER INSERT", "diagnostic_results",
+     "coalesce(new.status, 'complete') != 'streaming'", ("new.session_id",)),
+    ("search_results_update", "AFTER UPDATE OF input_message, output_text, status", "diagnostic_results",
+     "coalesce(new.status, 'complete') != 'streaming'", ("new.session_id",)),
+    ("search_results_delete", "AFTER DELETE", "diagnostic_results", None, ("old.session_id",)),
+    ("search_parts_insert", "AFTER INSERT", "part_predictions", None, ("new.session_id",)),
+    ("search_parts_update", "AFTER UPDATE OF part_name, session_id", "part_predictions", None,
+     ("old.session_id", "new.session_id")),
+    ("search_parts_delete", "AFTER DELETE", "part_predictions", None, ("old.session_id",)),
+    ("search_summaries_insert", "AFTER INSERT", "repair_summaries", None, ("new.session_id",)),
+    ("search_summaries_update", "AFTER UPDATE OF summary_text", "repair_summaries", None, ("new.session_id",)),
+    ("search_summaries_delete", "AFTER DELETE", "repair_summaries", None, ("old.session_id",)),
+]
+
+
+def _sqlite_ddl() -> List[str]:
+    statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_documents USING fts5("
+        "input_text, results, parts, summary, tokenize = 'porter unicode61')",
+        "CREATE TRIGGER IF NOT EXISTS search_sessions_delete AFTER DELETE ON sessions "
+        "BEGIN DELETE FROM search_documents WHERE rowid = old.id; END",
+    ]
+    for name, when, table, condition, ids in _SQLITE_TRIGGERS:
+        body = "".join(_sqlite_refresh(session_id) for session_id in ids)
+        guard = f" WHEN {condition}" if condition else ""
+        statements.append(f"CREATE TRIGGER IF NOT EXISTS {name} {when} ON {table}{guard} BEGIN {body} END")
+    return statements
+
+
+_POSTGRES_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS search_documents (
+        session_id integer PRIMARY KEY,
+        input_text text,
+        results text,
+        parts text,
+        summary text,
+        document tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(input_text, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(parts, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(results, '')), 'C') ||
+            setweight(to_tsvector('english', coalesce(summary, '')), 'D')
+        ) STORED
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_search_documents_document ON search_documents USING GIN (document)",
+    """
+    CREATE OR REPLACE FUNCTION search_documents_refresh(target integer) RETURNS void AS $$
+        INSERT INTO search_documents (session_id, input_text, results, parts, summary)
+        SELECT s.id, s.input_text,
+            (SELECT string_agg(concat_ws(E'\\n', r.input_message, r.output_text), E'\\n\\n' ORDER BY r.id)
+             FROM diagnostic_results r WHERE r.session_id = s.id AND coalesce(r.status, 'complete') = 'complete'),
+            (SELECT string_agg(p.part_name, E'\\n' ORDER BY p.id) FROM part_predictions p WHERE p.session_id = s.id),
+            (SELECT string_agg(m.summary_text, E'\\n\\n' ORDER BY m.id) FROM repair_summaries m WHERE m.session_id = s.id)
+        FROM sessions s WHERE s.id = target
+        ON CONFLICT (session_id) DO UPDATE SET
+            input_text = EXCLUDED.input_text,
+            results = EXCLUDED.results,
+            parts = EXCLUDED.parts,
+            summary = EXCLUDED.summary
+    $$ LANGUAGE sql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION search_documents_sync() RETURNS trigger AS $$
+    BEGIN
+        IF TG_TABLE_NAME = 'sessions' THEN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM search_documents WHERE session_id = OLD.id;
+            ELSE
+                PERFORM search_documents_refresh(NEW.id);
+            END IF;
+        ELSE
+            IF TG_OP <> 'INSERT' THEN
+                PERFORM search_documents_refresh(OLD.session_id);
+            END IF;
+            IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.session_id IS DISTINCT FROM OLD.session_id) THEN
+                PERFORM search_documents_refresh(NEW.session_id);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+]
+
+# (name, events, table, WHEN condition)
+_POSTGRES_TRIGGERS = [
+    ("search_sync", "INSERT OR UPDATE OF input_text OR DELETE", "sessions", None),
+    ("search_sync_insert", "INSERT", "diagnostic_results", "NEW.status IS DISTINCT FROM 'streaming'"),
+    ("search_sync_update", "UPDATE OF input_message, output_text, status", "diagnostic_results",
+     "NEW.status IS DISTINCT FROM 'streaming'"),
+    ("search_sync_delete", "DELETE", "diagnostic_results", None),
+    ("search_sync", "INSERT OR UPDATE OF part_name, session_id OR DELETE", "part_predictions", None),
+    ("search_sync", "INSERT OR UPDATE OF summary_text OR DELETE", "repair_summaries", None),
+]
+
+
+def _postgres_ddl() -> List[str]:
+    statements = list(_POSTGRES_DDL)
+    for name, events, table, condition in _POSTGRES_TRIGGERS:
+        guard = f" WHEN ({condition})" if condition else ""
+        statements.append(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+        statements.append(
+            f"CREATE TRIGGER {name} AFTER {events} ON {table} FOR EACH ROW{guard} "
+            "EXECUTE FUNCTION search_documents_sync()"
+        )
+    return statements
+
+
+def _backfill(dialect: str) -> str:
+    """Index every session that has no document yet."""
+    if dialect == "sqlite":
+        return _SQLITE_INSERT.format(where="s.id NOT IN (SELECT rowid FROM search_documents)")
+    return (
+        "SELECT search_documents_refresh(s.id) FROM sessions s "
+        "WHERE NOT EXISTS (SELECT 1 FROM search_documents d WHERE d.session_id = s.id)"
+    )
+
+
+def ddl_statements(dialect: str) -> List[str]:
+    """Statements that create the index, its triggers and backfill it. Safe to run again."""
+    if dialect == "sqlite":
+        return _sqlite_ddl() + [_backfill(dialect)]
+    if dialect == "postgresql":
+        return _postgres_ddl() + [_backfill(dialect)]
+    return []
+
+
+def drop_statements(dialect: str) -> List[str]:
+    if dialect == "sqlite":
+        names = ["search_sessions_delete"] + [name for name, *_ in _SQLITE_TRIGGERS]
+        return [f"DROP TRIGGER IF EXISTS {name}" for name in names] + ["DROP TABLE IF EXISTS search_documents"]
+    if dialect == "postgresql":
+        return [f"DROP TRIGGER IF EXISTS {name} ON {table}" for name, _, table, _ in _POSTGRES_TRIGGERS] + [
+            "DROP FUNCTION IF EXISTS search_documents_sync()",
+            "DROP FUNCTION IF EXISTS search_documents_refresh(integer)",
+            "DROP TABLE IF EXISTS search_documents",
+        ]
+    return []
+
+
+def _exists(connection) -> bool:
+    if connection.dialect.name == "sqlite":
+        query = "SELECT 1 FROM sqlite_master WHERE name = 'search_documents'"
+    else:
+        query = "SELECT to_regclass('search_documents')"
+    return connection.execute(text(query)).scalar() is not None
+
+
+def install_search_index(connection):
+    """Create and backfill the index on a sync connection if it is missing."""
+    dialect = connection.dialect.name
+    statements = ddl_statements(dialect)
+    if not statements or _exists(connection):
+        return
+    try:
+        with connection.begin_nested():
+            for statement in statements:
+                connection.exec_driver_sql(statement)
+    except Exception as e:
+        # e.g. an SQLite build without FTS5; search answers 503 until the index exists
+        logger.warning("Full-text search index not installed: %s", e)
+
+
+def rebuild_search_index(connection):
+    """Drop and recreate the index and reindex every session."""
+    for statement in drop_statements(connection.dialect.name) + ddl_statements(connection.dialect.name):
+        connection.exec_driver_sql(statement)
+
+
+# Words and codes in a free-text query; everything else (FTS5 operators, quotes) is dropped
+_TERMS = re.compile(r"\w+")
+
+
+def _fts5_query(query: str) -> Optional[str]:
+    terms = _TERMS.findall(query)
+    if not terms:
+        return None
+    # Every term is required. The last one also matches as a prefix while typing; prefixes
+    # are not stemmed, so the whole word is kept as an alternative
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] = f'({quoted[-1]} OR {quoted[-1]}*)'
+    return " AND ".join(quoted)
+
+
+_RESULT_COLUMNS = (
+    column("session_id", Integer),
+    column("input_text", Text),
+    column("created_at", DateTime(timezone=True)),
+    column("score", Float),
+)
+
+
+async def search_sessions(db, user_id: int, query: str, limit: int, offset: int = 0) -> Tuple[List[dict], bool]:
+    """
+    Rank a user's sessions against a free-text query.
+
+    Returns one page of results, best first, and whether more follow.
+    Snippets are built only for the returned page.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        match = _fts5_query(query)
+        if match is None:
+            return [], False
+        weights = ", ".join(str(FIELD_WEIGHTS[field]) for field in FIELDS)
+        rows = (await db.execute(text(f"""
+            SELECT s.id AS session_id, s.input_text, s.created_at, -bm25(search_documents, {weights}) AS score
+            FROM search_documents JOIN sessions s ON s.id = search_documents.rowid
+            WHERE search_documents MATCH :match AND s.user_id = :user_id
+            ORDER BY score DESC, s.id DESC
+            LIMIT :limit OFFSET :offset
+        """).columns(*_RESULT_COLUMNS), {"match": match, "user_id": user_id, "limit": limit + 1, "offset": offset})).all()
+        page = rows[:limit]
+        snippets = {}
+        if page:
+            ids = ", ".join(str(row.session_id) for row in page)
+            result = await db.execute(text(f"""
+                SELECT rowid, snippet(search_documents, -1, :start, :end, '…', {SNIPPET_WORDS})
+                FROM search_documents WHERE search_documents MATCH :match AND rowid IN ({ids})
+            """), {"match": match, "start": HIGHLIGHT_START, "end": HIGHLIGHT_END})
+            snippets = dict(result.all())
+    elif dialect == "postgresql":
+        # websearch_to_tsquery accepts any user input: quoted phrases, "or", -excluded words
+        rows = (await db.execute(text("""
+            SELECT s.id AS session_id, s.input_text, s.created_at,
+                   ts_rank_cd(d.document, websearch_to_tsquery('english', :query)) AS score
+            FROM search_documents d JOIN sessions s ON s.id = d.session_id
+            WHERE d.document @@ websearch_to_tsquery('english', :query) AND s.user_id = :user_id
+            ORDER BY score DESC, s.id DESC
+            LIMIT :limit OFFSET :offset
+        """).columns(*_RESULT_COLUMNS), {"query": query, "user_id": user_id, "limit": limit + 1, "offset": offset})).all()
+        page = rows[:limit]
+        snippets = {}
+        if page:
+            options = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MaxWords={SNIPPET_WORDS}, MinWords=5, MaxFragments=2"
+            result = await db.execute(text("""
+                SELECT session_id, ts_headline('english',
+                    concat_ws(E'\\n', input_text, parts, results, summary),
+                    websearch_to_tsquery('english', :query), :options)
+                FROM search_documents WHERE session_id = ANY(:ids)
+            """), {"query": query, "options": options, "ids": [row.session_id for row in page]})
+            snippets = dict(result.all())
+    else:
+        raise NotImplementedError(f"Full-text search is not available on {dialect}")
+
+    return [{
+        "session_id": row.session_id,
+        "input_text": row.input_text,
+        "created_at": row.created_at,
+        "score": row.score,
+        "snippet": snippets.get(row.session_id),
+    } for row in page], len(rows) > limit
+
+
+if __name__ == "__main__":
+    from app.database import engine
+
+    with engine.begin() as connection:
+        rebuild_search_index(connection)
+    print("Rebuilt the search index")
@@ -1,16 +1,43 @@
-import openai
 import json
-import os
 import asyncio
-from typing import List, Dict, Any, AsyncGenerator
-# Logging replaced with print statements
+import logging
+import time
+from typing import List, Dict, Any, AsyncGenerator, Optional
 
-# Configure OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY", "your-api-key-here")
+from app.metrics import registry
+from app.services.diagnostic_cache import diagnostic_cache, cache_key
+from app.services.dtc_index import DTC_PREAMBLE, format_facts, format_preamble, resolve_codes
+from app.services.llm_providers import get_llm_provider
+from app.services.llm_scheduler import (
+    llm_scheduler, estimate_tokens, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+)
+from app.services.parts_parser import PartsArrayParser, validate_part
+from app.services.similar_cases import SIMILAR_PROMPT_CASES, format_cases
+from app.services.single_flight import SingleFlight, StreamFanout, request_key
+from app.services.streaming import FlushPolicy, apply_flush_policy, default_flush_policy, split_tokens
+
+logger = logging.getLogger("app.services.ai_service")
+
+# Coalesce identical in-flight upstream requests
+diagnostic_flights = StreamFanout()
+completion_flights = SingleFlight()
+
+# Generation timings by source; series are resolved once so the chunk loop only calls observe()
+diagnostic_first_chunk_seconds = registry.histogram(
+    "diagnostic_time_to_first_chunk_seconds", "Time from request to first diagnostic chunk", ("source",))
+diagnostic_generation_seconds = registry.histogram(
+    "diagnostic_generation_seconds", "Time to produce a complete diagnostic", ("source",))
+_first_chunk_timers = {source: diagnostic_first_chunk_seconds.labels(source) for source in ("cache", "upstream")}
+_generation_timers = {source: diagnostic_generation_seconds.labels(source) for source in ("cache", "upstream")}
+parts_repairs = registry.counter(
+    "parts_prediction_repairs_total", "Repair retries for part predictions that failed validation", ("outcome",))
 
 async def generate_diagnostic(
     symptoms: str, 
-    stream: bool = True
+    stream: bool = True,
+    flush_policy: Optional[FlushPolicy] = None,
+    history: Optional[List[Dict[str, str]]] = None,
+    similar: Optional[List[Dict[str, Any]]] = None
 ) -> AsyncGenerator[str, None]:
     """
     Generate a diagnostic result based on car symptoms or OBD codes.
@@ -18,19 +45,39 @@ async def generate_diagnostic(
     Args:
         symptoms: The symptoms or OBD codes described by the user
         stream: Whether to stream the response or return the full text
+        flush_policy: How streamed tokens are grouped into chunks (default: 10-byte threshold)
+        history: Earlier turns of the conversation as chat messages, oldest first
+        similar: Similar past cases (see similar_cases) to ground the answer in
         
     Returns:
         If stream=True, yields chunks of the response
         If stream=False, returns the full response text
     """
-    print(f"Starting diagnostic generation for symptoms: {symptoms}")
-    print(f"Streaming mode: {stream}")
+    logger.debug("Starting diagnostic generation (stream=%s): %.100s", stream, symptoms)
+    started = time.perf_counter()
+    
+    # Trouble codes are resolved from the local index: their meaning is streamed at once,
+    # and the model gets them as facts to build on rather than restate
+    codes = resolve_codes(symptoms)
+    preamble = format_preamble(codes) if DTC_PREAMBLE else ""
+    facts = format_facts(codes)
+    reference = f"""
+    Reference data for these codes (already shown to the user; do not repeat it):
+    {facts}
+    """ if facts else ""
+    # Past repairs for similar reports, from the asking user's history
+    prompt_cases = similar[:SIMILAR_PROMPT_CASES] if similar and SIMILAR_PROMPT_CASES > 0 else []
+    cases = format_cases(prompt_cases) if prompt_cases else ""
+    grounding = f"""
+    Similar past cases from this shop, for context (they may not apply):
+    {cases}
+    """ if cases else ""
     
     prompt = f"""
     You are an expert automotive diagnostic AI. Analyze the following symptoms or OBD codes and provide a detailed diagnosis:
     
     {symptoms}
-    
+    {reference}{grounding}
     Provide a thorough analysis including:
     1. Likely causes of the issue
     2. Severity level
@@ -38,103 +85,105 @@ async def generate_diagnostic(
     4. Potential complications if left unaddressed
     """
     
-    try:
-        # Validate OpenAI API key
-        if not openai.api_key:
-            error_msg = "OpenAI API key is not set"
-            print(f"[CRITICAL] {error_msg}")
-            yield error_msg
+    # Serve repeated symptoms/codes from the cache through the same chunked path.
+    # Follow-up turns depend on the conversation, so only first turns use the cache.
+    # A grounded answer is keyed by the ids of its cases too, so it is served again only
+    # for the same set of cases, whoever asks and whatever their order or scores
+    history = history or []
+    case_ids = [case["result_id"] for case in prompt_cases] if grounding else []
+    if history:
+        key = request_key("diagnostic", symptoms, history, sorted(case_ids))
+    else:
+        key = cache_key(symptoms, cases=case_ids)
+    cached = await diagnostic_cache.get(key) if diagnostic_cache.enabled and not history else None
+    source = "cache" if cached is not None else "upstream"
+    first_chunk_timer, generation_timer = _first_chunk_timers[source], _generation_timers[source]
+    if cached is not None:
+        logger.debug("Diagnostic cache hit")
+        if not stream:
+            generation_timer.observe(time.perf_counter() - started)
+            yield preamble + cached
             return
-        
-        print(f"[DEBUG] Preparing to call OpenAI API with prompt: {prompt[:100]}...")
-        if stream:
-            print("[DEBUG] Initiating streaming response")
-            try:
-                response = await openai.ChatCompletion.acreate(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "You are an expert automotive diagnostic AI."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    stream=True
-                )
-            except Exception as init_error:
-                print(f"[ERROR] Failed to initialize OpenAI API call: {init_error}")
-                yield f"API initialization error: {init_error}"
-                return
-            
-            print("[DEBUG] Streaming response started")
-            current_chunk = ""
-            chunk_count = 0
-            try:
-                async for chunk in response:
-                    try:
-                        if "content" in chunk.choices[0].delta:
-                            content = chunk.choices[0].delta.content
-                            current_chunk += content
-                            # Yield when we have a meaningful chunk
-                            if len(current_chunk) > 10:
-                                print(f"[DEBUG] Yielding chunk {chunk_count}: {len(current_chunk)} characters")
-                                yield current_chunk
-                                chunk_count += 1
-                                current_chunk = ""
-                    except Exception as chunk_error:
-                        print(f"[ERROR] Error processing individual chunk: {chunk_error}")
-                
-                # Yield any remaining content
-                if current_chunk:
-                    print(f"[DEBUG] Yielding final chunk: {len(current_chunk)} characters")
-                    yield current_chunk
-                
-                print(f"[DEBUG] Total chunks yielded: {chunk_count}")
-            except Exception as stream_error:
-                print(f"[ERROR] Error during streaming response: {stream_error}")
-                yield f"Streaming error: {stream_error}"
-        else:
-            print("[DEBUG] Generating full response")
-            try:
-                response = await openai.ChatCompletion.acreate(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "You are an expert automotive diagnostic AI."},
-                        {"role": "user", "content": prompt}
-                    ]
-                )
-                
-                full_result = response.choices[0].message.content
-                print(f"[DEBUG] Full response generated: {len(full_result)} characters")
-                yield full_result
-            except Exception as full_response_error:
-                print(f"[ERROR] Failed to generate full response: {full_response_error}")
-                yield f"Response generation error: {full_response_error}"
-    
-    except openai.error.APIError as e:
-        error_msg = f"[ERROR] OpenAI API error: {e}"
-        print(error_msg)
-        yield error_msg
-    except openai.error.AuthenticationError as e:
-        error_msg = f"[ERROR] Authentication error with OpenAI: {e}"
-        print(error_msg)
-        yield error_msg
-    except openai.error.RateLimitError as e:
-        error_msg = f"[ERROR] Rate limit exceeded: {e}"
-        print(error_msg)
-        yield error_msg
-    except Exception as e:
-        error_msg = f"[ERROR] Unexpected error in diagnostic generation: {e}"
-        print(error_msg, exc_info=True)
-        yield error_msg
+        tokens = _replay_tokens(cached)
+    else:
+        # Identical concurrent requests share one upstream completion; late joiners replay what's been streamed
+        tokens = diagnostic_flights.stream(f"{key}:{stream}", lambda: _diagnostic_upstream(prompt, stream, key, history))
+        if not stream:
+            async for result in tokens:
+                generation_timer.observe(time.perf_counter() - started)
+                yield preamble + result
+            return
+    
+    first = True
+    if preamble:
+        first_chunk_timer.observe(time.perf_counter() - started)
+        first = False
+        yield preamble
+    async for chunk in apply_flush_policy(tokens, flush_policy or default_flush_policy()):
+        if first:
+            first_chunk_timer.observe(time.perf_counter() - started)
+            first = False
+        yield chunk
+    generation_timer.observe(time.perf_counter() - started)
 
-async def predict_parts(diagnostic_result: str) -> List[Dict[str, Any]]:
+async def _replay_tokens(text: str) -> AsyncGenerator[str, None]:
+    for token in split_tokens(text):
+        yield token
+
+async def _diagnostic_upstream(prompt: str, stream: bool, key: str, history: List[Dict[str, str]]) -> AsyncGenerator[str, None]:
     """
-    Predict necessary parts based on a diagnostic result.
+    Run the upstream completion for generate_diagnostic and cache a complete answer.
     
-    Args:
-        diagnostic_result: The diagnostic result text
-        
-    Returns:
-        A list of dictionaries containing part information
+    Raises UpstreamError when the provider cannot answer after retries, so
+    callers never mistake an error message for diagnosis text.
     """
+    started = time.perf_counter()
+    messages = [
+        {"role": "system", "content": "You are an expert automotive diagnostic AI."},
+        *history,
+        {"role": "user", "content": prompt}
+    ]
+    
+    provider = get_llm_provider()
+    
+    logger.debug("Calling %s provider (stream=%s) with prompt: %.100s...", provider.name, stream, prompt)
+    if stream:
+        # Streaming diagnostics are interactive and jump ahead of queued batch calls
+        response = llm_scheduler.stream(
+            lambda: provider.stream_chat(messages),
+            priority=PRIORITY_INTERACTIVE,
+            estimated_tokens=estimate_tokens(messages),
+            label="generate_diagnostic"
+        )
+        
+        # Yield every token; callers group them into frames with a flush policy
+        produced = []
+        try:
+            async for content in response:
+                produced.append(content)
+                yield content
+        finally:
+            # Free the scheduler slot as soon as the consumer stops, not at garbage collection
+            await response.aclose()
+        
+        logger.debug("Total tokens yielded: %d", len(produced))
+        if produced and not history:
+            await diagnostic_cache.set(key, "".join(produced), time.perf_counter() - started)
+    else:
+        response = await llm_scheduler.complete(
+            lambda: provider.chat(messages),
+            priority=PRIORITY_INTERACTIVE,
+            estimated_tokens=estimate_tokens(messages),
+            label="generate_diagnostic"
+        )
+        
+        full_result = response.text
+        logger.debug("Full response generated: %d characters", len(full_result))
+        if not history:
+            await diagnostic_cache.set(key, full_result, time.perf_counter() - started)
+        yield full_result
+
+def _parts_messages(diagnostic_result: str) -> List[Dict[str, str]]:
     prompt = f"""
     Based on the following car diagnostic result, predict the most likely parts that need to be replaced or repaired.
     For each part, provide a name, confidence level (as a decimal between 0 and 1), and estimated price range.
@@ -142,50 +191,151 @@ async def predict_parts(diagnostic_result: str) -> List[Dict[str, Any]]:
     Diagnostic Result:
     {diagnostic_result}
     
-    Format your response as a JSON array with objects containing:
+    Format your response as a JSON object with a "parts" array of objects containing:
     - id (string)
     - name (string)
     - confidence (number between 0-1)
     - price (string with price range)
     """
     
-    response = await openai.ChatCompletion.acreate(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are an automotive parts prediction AI."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-    
+    return [
+        {"role": "system", "content": "You are an automotive parts prediction AI."},
+        {"role": "user", "content": prompt}
+    ]
+
+class _PartsCollector:
+    """Validates parsed parts, numbers them and remembers what needs a repair."""
+
+    def __init__(self):
+        self.count = 0
+        self.names = set()
+        self.problems: List[str] = []
+
+    def accept(self, item: Any, repairing: bool = False) -> Optional[Dict[str, Any]]:
+        part, error = validate_part(item)
+        if part is None:
+            if not repairing:
+                self.problems.append(f"{json.dumps(item)}: {error}")
+            return None
+        # A repair may repeat parts that were already fine
+        if part["name"].casefold() in self.names:
+            return None
+        self.names.add(part["name"].casefold())
+        self.count += 1
+        part.setdefault("id", f"part_{self.count}")
+        return part
+
+    def check(self, parser: PartsArrayParser):
+        self.problems.extend(f"{raw}: not valid JSON" for raw in parser.malformed)
+        if not parser.found:
+            self.problems.append('the answer has no "parts" array')
+        elif not parser.closed:
+            unfinished = parser.unfinished
+            self.problems.append(
+                f"the answer stopped before the parts array was closed, cutting off: {unfinished}"
+                if unfinished else "the answer stopped before the parts array was closed"
+            )
+
+async def _repair_parts(messages: List[Dict[str, str]], answer: str, problems: List[str]) -> List[Any]:
+    """One targeted retry: show the model what was rejected and ask only for those parts again."""
+    repair_messages = messages + [
+        {"role": "assistant", "content": answer},
+        {"role": "user", "content": (
+            "Some of the parts in your answer could not be used:\n"
+            + "\n".join(f"- {problem}" for problem in problems)
+            + '\n\nReturn a JSON object with a "parts" array holding corrected versions of only these parts, '
+            "with the same fields. Leave out parts that were accepted."
+        )}
+    ]
+    provider = get_llm_provider()
     try:
-        parts = (response.choices[0].message.content).replace("```json", "").replace("```", "")
-        parts = json.loads(parts)
-    except json.JSONDecodeError:
-        print(f"Error parsing parts: {response.choices[0].message.content}")
+        response = await llm_scheduler.complete(
+            lambda: provider.chat_json(repair_messages),
+            priority=PRIORITY_BATCH,
+            estimated_tokens=estimate_tokens(repair_messages),
+            label="repair_parts"
+        )
+    except Exception as e:
+        logger.warning("Parts repair failed: %s", e)
+        parts_repairs.labels("failed").inc()
         return []
-    print(f"Parts: {parts}")
-    # Add unique IDs if not present
-    for i, part in enumerate(parts):
-        if "id" not in part:
-            part["id"] = f"part_{i+1}"
-    return parts
+    parser = PartsArrayParser()
+    items = parser.feed(response.text)
+    parts_repairs.labels("repaired" if items else "failed").inc()
+    return items
 
-async def generate_repair_summary(
-    diagnostic_result: str,
-    parts: List[str],
-    notes: str = None
-) -> str:
+async def stream_parts(diagnostic_result: str) -> AsyncGenerator[Dict[str, Any], None]:
     """
-    Generate a customer-friendly repair summary.
+    Predict parts from a diagnostic result, yielding each one as soon as it has streamed in.
+    
+    Parts are validated as they arrive. Rejected or cut-off parts get one
+    repair call at the end, and whatever it fixes is yielded after the rest.
+    """
+    messages = _parts_messages(diagnostic_result)
+    provider = get_llm_provider()
+    parser = PartsArrayParser()
+    collector = _PartsCollector()
+    
+    response = llm_scheduler.stream(
+        lambda: provider.stream_chat_json(messages),
+        priority=PRIORITY_BATCH,
+        estimated_tokens=estimate_tokens(messages),
+        label="predict_parts"
+    )
+    try:
+        async for content in response:
+            for item in parser.feed(content):
+                part = collector.accept(item)
+                if part is not None:
+                    yield part
+    finally:
+        await response.aclose()
+    
+    collector.check(parser)
+    if collector.problems:
+        logger.info("Repairing %d rejected parts: %s", len(collector.problems), collector.problems)
+        for item in await _repair_parts(messages, parser.text, collector.problems):
+            part = collector.accept(item, repairing=True)
+            if part is not None:
+                yield part
+
+async def predict_parts(diagnostic_result: str) -> List[Dict[str, Any]]:
+    """
+    Predict necessary parts based on a diagnostic result.
     
     Args:
         diagnostic_result: The diagnostic result text
-        parts: List of part names that need replacement
-        notes: Additional notes from the technician
         
     Returns:
-        A formatted repair summary
+        A list of dictionaries containing part information
     """
+    messages = _parts_messages(diagnostic_result)
+    provider = get_llm_provider()
+    
+    # Identical concurrent requests share one upstream completion
+    response = await completion_flights.do(
+        request_key("predict_parts", provider.name, provider.model, messages),
+        lambda: llm_scheduler.complete(
+            lambda: provider.chat_json(messages),
+            priority=PRIORITY_BATCH,
+            estimated_tokens=estimate_tokens(messages),
+            label="predict_parts"
+        )
+    )
+    
+    # Same parsing and validation as the streamed path, so one bad part no longer discards the rest
+    parser = PartsArrayParser()
+    collector = _PartsCollector()
+    parts = [part for part in map(collector.accept, parser.feed(response.text)) if part is not None]
+    collector.check(parser)
+    if collector.problems:
+        logger.info("Repairing %d rejected parts: %s", len(collector.problems), collector.problems)
+        repaired = await _repair_parts(messages, response.text, collector.problems)
+        parts.extend(part for part in (collector.accept(item, repairing=True) for item in repaired) if part is not None)
+    logger.debug("Parts: %s", parts)
+    return parts
+
+def _summary_messages(diagnostic_result: str, parts: List[str], notes: Optional[str]) -> List[Dict[str, str]]:
     parts_text = ", ".join(parts) if parts else "No parts identified for replacement"
     notes_text = notes if notes else "No additional notes provided"
     
@@ -209,12 +359,51 @@ async def generate_repair_summary(
     5. Be professional but easy to understand for non-technical customers
     """
     
-    response = await openai.ChatCompletion.acreate(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are an automotive repair communication specialist."},
-            {"role": "user", "content": prompt}
-        ]
+    return [
+        {"role": "system", "content": "You are an automotive repair communication specialist."},
+        {"role": "user", "content": prompt}
+    ]
+
+# Content addresses of stored results: the same prompt to the same model gives the same hash,
+# and any change to the inputs, the prompt template or the model gives a new one
+def parts_input_hash(diagnostic_result: str) -> str:
+    provider = get_llm_provider()
+    return request_key("predict_parts", provider.name, provider.model, _parts_messages(diagnostic_result))
+
+def summary_input_hash(diagnostic_result: str, parts: List[str], notes: Optional[str] = None) -> str:
+    provider = get_llm_provider()
+    return request_key("generate_repair_summary", provider.name, provider.model,
+                       _summary_messages(diagnostic_result, parts, notes))
+
+async def generate_repair_summary(
+    diagnostic_result: str,
+    parts: List[str],
+    notes: str = None
+) -> str:
+    """
+    Generate a customer-friendly repair summary.
+    
+    Args:
+        diagnostic_result: The diagnostic result text
+        parts: List of part names that need replacement
+        notes: Additional notes from the technician
+        
+    Returns:
+        A formatted repair summary
+    """
+    messages = _summary_messages(diagnostic_result, parts, notes)
+    
+    provider = get_llm_provider()
+    
+    # Identical concurrent requests share one upstream completion
+    response = await completion_flights.do(
+        request_key("generate_repair_summary", provider.name, provider.model, messages),
+        lambda: llm_scheduler.complete(
+            lambda: provider.chat(messages),
+            priority=PRIORITY_BATCH,
+            estimated_tokens=estimate_tokens(messages),
+            label="generate_repair_summary"
+        )
     )
     
-    return response.choices[0].message.content
+    return response.text
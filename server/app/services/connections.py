@@ -0,0 +1,169 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from app.metrics import registry
+
+logger = logging.getLogger("app.services.connections")
+
+# "memory" for a single process, or a postgresql:// URL to fan out across workers with LISTEN/NOTIFY
+BROKER_URL = os.getenv("BROKER_URL", "memory")
+BROKER_CHANNEL = os.getenv("BROKER_CHANNEL", "detect_auto_events")
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+PG_NOTIFY_MAX_BYTES = 7900
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+events_dropped = registry.counter(
+    "websocket_events_dropped_total", "Pushed events dropped because a client's send queue was full")
+
+
+class Broker:
+    """Delivers published events to every subscribed process, including the publisher."""
+
+    async def start(self, handler: Handler):
+        self.handler = handler
+
+    async def publish(self, event: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def stop(self):
+        pass
+
+
+class InMemoryBroker(Broker):
+    """Single-process broker: publishing is local delivery."""
+
+    async def publish(self, event: Dict[str, Any]):
+        await self.handler(event)
+
+
+class PostgresBroker(Broker):
+    """
+    Multi-worker broker over Postgres LISTEN/NOTIFY.
+
+    Every worker LISTENs on one channel; events are JSON payloads. Events
+    too large for NOTIFY are delivered to this worker only.
+    """
+
+    def __init__(self, url: str, channel: str = BROKER_CHANNEL):
+        # asyncpg takes a plain libpq URL
+        self.url = url.replace("postgresql+asyncpg://", "postgresql://").replace("postgresql+psycopg2://", "postgresql://")
+        self.channel = channel
+        self.listen_conn = None
+        self.publish_conn = None
+        self.publish_lock = asyncio.Lock()
+
+    async def start(self, handler: Handler):
+        import asyncpg
+
+        await super().start(handler)
+        self.listen_conn = await asyncpg.connect(self.url)
+        self.publish_conn = await asyncpg.connect(self.url)
+        await self.listen_conn.add_listener(self.channel, self._on_notify)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.warning("Dropping malformed broker payload on %s", channel)
+            return
+        asyncio.ensure_future(self.handler(event))
+
+    async def publish(self, event: Dict[str, Any]):
+        payload = json.dumps(event)
+        if len(payload.encode("utf-8")) > PG_NOTIFY_MAX_BYTES:
+            logger.warning("Broker event %s too large for NOTIFY; delivering locally", event["message"].get("type"))
+            await self.handler(event)
+            return
+        async with self.publish_lock:
+            await self.publish_conn.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+
+    async def stop(self):
+        if self.listen_conn is not None:
+            await self.listen_conn.remove_listener(self.channel, self._on_notify)
+            await self.listen_conn.close()
+        if self.publish_conn is not None:
+            await self.publish_conn.close()
+
+
+def create_broker(url: str = BROKER_URL) -> Broker:
+    if not url or url == "memory":
+        return InMemoryBroker()
+    if url.startswith("postgres"):
+        return PostgresBroker(url)
+    raise ValueError(f"Unsupported BROKER_URL: {url}")
+
+
+class ConnectionManager:
+    """
+    Registry of this worker's open WebSockets, keyed by user id.
+
+    send_to_user publishes through the broker; every worker then delivers
+    the message to the sockets it holds for that user, so events reach
+    all of a user's clients without sticky sessions.
+
+    A registered connection is anything with a non-blocking push(text)
+    that returns False when it has no room. Delivery never waits on a
+    client, so a stalled one cannot hold up the sender; its events are
+    dropped instead.
+    """
+
+    def __init__(self, broker: Optional[Broker] = None):
+        self.broker = broker or create_broker()
+        self.worker_id = uuid.uuid4().hex
+        self.connections: Dict[int, Set[Any]] = {}
+        self.started = False
+
+    async def start(self):
+        if not self.started:
+            await self.broker.start(self._deliver)
+            self.started = True
+
+    async def stop(self):
+        if self.started:
+            await self.broker.stop()
+            self.started = False
+
+    def connect(self, user_id: int, connection: Any):
+        self.connections.setdefault(user_id, set()).add(connection)
+
+    def disconnect(self, user_id: int, connection: Any):
+        sockets = self.connections.get(user_id)
+        if sockets is None:
+            return
+        sockets.discard(connection)
+        if not sockets:
+            del self.connections[user_id]
+
+    def connection_count(self) -> int:
+        return sum(len(sockets) for sockets in self.connections.values())
+
+    async def send_to_user(self, user_id: int, message: Dict[str, Any]):
+        event = {"user_id": user_id, "origin": self.worker_id, "message": message}
+        if not self.started:
+            await self._deliver(event)
+            return
+        try:
+            await self.broker.publish(event)
+        except Exception as e:
+            logger.warning("Broker publish failed, delivering locally: %s", e)
+            await self._deliver(event)
+
+    async def _deliver(self, event: Dict[str, Any]):
+        sockets = self.connections.get(event.get("user_id"))
+        if not sockets:
+            return
+        text = json.dumps(event["message"])
+        for connection in list(sockets):
+            if not connection.push(text):
+                events_dropped.inc()
+                logger.debug("Dropped %s event for user %s: send queue full",
+                             event["message"].get("type"), event["user_id"])
+
+
+connection_manager = ConnectionManager()
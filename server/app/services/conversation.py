@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
+from app.models import DiagnosticResult
+from app.services.diagnostic_cache import LRUCache
+from app.services.diagnostic_results import STATUS_COMPLETE, STATUS_STREAMING
+from app.services.llm_providers import LLM_MODEL, get_llm_provider
+from app.services.llm_scheduler import llm_scheduler, estimate_tokens, PRIORITY_BATCH
+
+logger = logging.getLogger("app.services.conversation")
+
+# Tokens of earlier turns (and their summary) sent with each diagnostic prompt
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+# Turns that no longer fit are dropped ("truncate") or folded into a rolling summary ("summarize")
+CONTEXT_STRATEGY = os.getenv("CONTEXT_STRATEGY", "truncate")
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "300"))
+
+# Tokenized history per session, so a turn only reads rows added since the last one
+CONTEXT_CACHE_SIZE = int(os.getenv("CONTEXT_CACHE_SIZE", "1000"))
+CONTEXT_CACHE_TTL = float(os.getenv("CONTEXT_CACHE_TTL", "1800"))
+
+STRATEGIES = ("truncate", "summarize")
+
+# Role and separator tokens the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Word and punctuation pieces; long words cost roughly one token per four characters
+_PIECES = re.compile(r"\w+|[^\w\s]")
+
+Messages = List[Dict[str, str]]
+
+
+def _load_encoding():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(LLM_MODEL)
+    except Exception:
+        try:
+            return tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning("tiktoken encoding unavailable, approximating token counts: %s", e)
+            return None
+
+
+_encoding = _load_encoding()
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in text: exact with tiktoken installed, otherwise a close approximation."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return sum((len(piece) + 3) // 4 for piece in _PIECES.findall(text))
+
+
+class Turn:
+    """One completed exchange, tokenized once when it enters the cache."""
+
+    __slots__ = ("result_id", "messages", "tokens")
+
+    def __init__(self, result_id: int, user_text: str, assistant_text: str):
+        self.result_id = result_id
+        self.messages = [
+            {"role": "user", "content": user_text},
+            {"role": "assistant", "content": assistant_text},
+        ]
+        self.tokens = count_tokens(user_text) + count_tokens(assistant_text) + 2 * MESSAGE_OVERHEAD_TOKENS
+
+
+class SessionContext:
+    __slots__ = ("last_id", "pending", "turns", "summary", "summary_tokens", "summarizing", "lock")
+
+    def __init__(self):
+        # Highest result id read so far, and rows below it still streaming; later turns are read incrementally
+        self.last_id = 0
+        self.pending: Set[int] = set()
+        self.turns: List[Turn] = []
+        self.summary: Optional[str] = None
+        self.summary_tokens = 0
+        self.summarizing: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+
+
+class ConversationContext:
+    """
+    Earlier turns of a diagnostic session, as chat messages within a token budget.
+
+    Each session's completed results are read and tokenized once and kept
+    in an LRU; later turns only fetch rows newer than the last one seen, so
+    results written by other workers are picked up too. The newest turns
+    that fit the budget are sent. Older ones are dropped, or with the
+    "summarize" strategy folded into a rolling summary by a background
+    batch-priority call; until it lands the turn is simply truncated.
+    Rows still streaming are skipped, and added in order once they are final.
+    """
+
+    def __init__(self, max_tokens: int = CONTEXT_MAX_TOKENS, strategy: str = CONTEXT_STRATEGY,
+                 cache_size: int = CONTEXT_CACHE_SIZE, cache_ttl: float = CONTEXT_CACHE_TTL):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unsupported CONTEXT_STRATEGY: {strategy}")
+        self.max_tokens = max_tokens
+        self.strategy = strategy
+        self.cache = LRUCache(cache_size, cache_ttl)
+        self._tasks = set()
+
+    async def messages_for(self, session_id: int) -> Messages:
+        """Chat messages for the session's earlier turns, oldest first."""
+        if self.max_tokens <= 0:
+            return []
+        context = self.cache.get(session_id)
+        if context is None:
+            context = SessionContext()
+            self.cache.set(session_id, context)
+        async with context.lock:
+            await self._refresh(session_id, context)
+            return self._assemble(context)
+
+    async def _refresh(self, session_id: int, context: SessionContext):
+        seen = DiagnosticResult.id > context.last_id
+        if context.pending:
+            seen = seen | DiagnosticResult.id.in_(context.pending)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(
+                    DiagnosticResult.id,
+                    DiagnosticResult.status,
+                    DiagnosticResult.input_message,
+                    DiagnosticResult.output_text,
+                )
+                .where(
+                    DiagnosticResult.session_id == session_id,
+                    seen
+                )
+                .order_by(DiagnosticResult.id)
+            )
+            rows = result.all()
+        for row in rows:
+            context.last_id = max(context.last_id, row.id)
+            if row.status == STATUS_STREAMING:
+                context.pending.add(row.id)
+                continue
+            context.pending.discard(row.id)
+            if row.status == STATUS_COMPLETE and row.output_text:
+                # A turn that finished late goes before any newer ones
+                position = len(context.turns)
+                while position and context.turns[position - 1].result_id > row.id:
+                    position -= 1
+                context.turns.insert(position, Turn(row.id, row.input_message or "", row.output_text))
+
+    def _assemble(self, context: SessionContext) -> Messages:
+        budget = self.max_tokens - context.summary_tokens
+        used = kept = 0
+        for turn in reversed(context.turns):
+            if used + turn.tokens > budget:
+                break
+            used += turn.tokens
+            kept += 1
+        dropped = context.turns[:len(context.turns) - kept]
+        if dropped:
+            if self.strategy == "summarize" and context.summarizing is None:
+                context.summarizing = asyncio.ensure_future(self._summarize(context, dropped))
+                self._tasks.add(context.summarizing)
+                context.summarizing.add_done_callback(self._tasks.discard)
+            elif self.strategy == "truncate":
+                # Older turns can never fit again, so stop holding them
+                del context.turns[:len(dropped)]
+
+        messages = []
+        if context.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{context.summary}"})
+        for turn in context.turns[len(context.turns) - kept:]:
+            messages.extend(turn.messages)
+        return messages
+
+    async def _summarize(self, context: SessionContext, turns: List[Turn]):
+        transcript = "\n\n".join(
+            f"{message['role'].capitalize()}: {message['content']}" for turn in turns for message in turn.messages
+        )
+        previous = f"Summary so far:\n{context.summary}\n\n" if context.summary else ""
+        messages = [
+            {"role": "system", "content": "You summarize automotive diagnostic conversations for later turns."},
+            {"role": "user", "content": (
+                f"{previous}Conversation:\n{transcript}\n\n"
+                f"Update the summary in at most {CONTEXT_SUMMARY_MAX_TOKENS} tokens. Keep the vehicle, "
+                "reported symptoms, trouble codes, likely causes and anything already ruled out."
+            )},
+        ]
+        provider = get_llm_provider()
+        summary = None
+        try:
+            response = await llm_scheduler.complete(
+                lambda: provider.chat(messages),
+                priority=PRIORITY_BATCH,
+                estimated_tokens=estimate_tokens(messages),
+                label="summarize_context"
+            )
+            summary = response.text.strip()
+        except Exception as e:
+            logger.warning("Context summary failed, truncating instead: %s", e)
+        async with context.lock:
+            if summary:
+                context.summary = summary
+                context.summary_tokens = count_tokens(summary) + MESSAGE_OVERHEAD_TOKENS
+            last_id = turns[-1].result_id
+            context.turns = [turn for turn in context.turns if turn.result_id > last_id]
+            context.summarizing = None
+
+
+conversation_context = ConversationContext()
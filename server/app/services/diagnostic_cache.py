@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+# Cache configuration
+DIAGNOSTIC_CACHE_SIZE = int(os.getenv("DIAGNOSTIC_CACHE_SIZE", "512"))
+DIAGNOSTIC_CACHE_TTL = float(os.getenv("DIAGNOSTIC_CACHE_TTL", "86400"))
+DIAGNOSTIC_CACHE_PATH = os.getenv("DIAGNOSTIC_CACHE_PATH")  # optional shared SQLite tier
+
+# Standard OBD-II trouble codes: P/C/B/U + 4 hex digits (e.g. P0300, U0100)
+OBD_CODE_PATTERN = re.compile(r"\b([PCBU][0-3][0-9A-F]{3})\b", re.IGNORECASE)
+
+
+def extract_obd_codes(text: str) -> List[str]:
+    """Return the unique OBD codes in text, uppercased and sorted."""
+    return sorted({code.upper() for code in OBD_CODE_PATTERN.findall(text or "")})
+
+
+def normalize_symptoms(text: str) -> Tuple[List[str], str]:
+    """
+    Split input into its OBD codes and the remaining free text.
+
+    Codes are uppercased, de-duplicated and sorted; the free text is
+    lowercased with punctuation and repeated whitespace collapsed, so
+    "P0420 p0300  Rough idle." and "p0300, P0420 rough idle" match.
+    """
+    codes = extract_obd_codes(text)
+    remainder = OBD_CODE_PATTERN.sub(" ", text or "").lower()
+    remainder = re.sub(r"[^\w\s]", " ", remainder)
+    remainder = " ".join(remainder.split())
+    return codes, remainder
+
+
+def cache_key(text: str, namespace: str = "diagnostic", cases: Sequence[int] = ()) -> str:
+    codes, remainder = normalize_symptoms(text)
+    fields = {"ns": namespace, "codes": codes, "text": remainder}
+    if cases:
+        # A grounded answer also depends on which past cases were in its prompt, in any order
+        fields["cases"] = sorted(set(cases))
+    payload = json.dumps(fields, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Size-bounded in-memory LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard_where(self, predicate):
+        """Remove every entry for which predicate(key, value) is true."""
+        with self._lock:
+            for key in [k for k, (_, value) in self._entries.items() if predicate(k, value)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheTier:
+    """Shared on-disk tier so cached answers survive restarts and are shared across workers."""
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS diagnostic_cache ("
+                "key TEXT PRIMARY KEY, output_text TEXT NOT NULL, "
+                "generation_seconds REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key: str):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT output_text, generation_seconds, expires_at FROM diagnostic_cache WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None or row[2] < time.time():
+            return None
+        return row[0], row[1]
+
+    def set(self, key: str, output_text: str, generation_seconds: float):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO diagnostic_cache VALUES (?, ?, ?, ?)",
+                (key, output_text, generation_seconds, time.time() + self.ttl),
+            )
+
+
+class DiagnosticCache:
+    """
+    Two-tier cache for generated diagnostics.
+
+    Values are (output_text, generation_seconds); the generation time is
+    kept so each hit can report how much upstream latency it saved.
+    """
+
+    def __init__(self, max_entries: int = DIAGNOSTIC_CACHE_SIZE, ttl: float = DIAGNOSTIC_CACHE_TTL,
+                 path: Optional[str] = DIAGNOSTIC_CACHE_PATH):
+        self.memory = LRUCache(max_entries, ttl)
+        self.disk = SQLiteCacheTier(path, ttl) if path else None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory.max_entries > 0 or self.disk is not None
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        from_disk = False
+        if value is None and self.disk is not None:
+            value = await asyncio.to_thread(self.disk.get, key)
+            if value is not None:
+                from_disk = True
+                self.memory.set(key, value)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += from_disk
+            self.saved_seconds += value[1]
+        return value[0]
+
+    async def set(self, key: str, output_text: str, generation_seconds: float):
+        self.memory.set(key, (output_text, generation_seconds))
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, output_text, generation_seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.memory),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "saved_latency_seconds": round(self.saved_seconds, 3),
+                "disk_tier": self.disk is not None,
+            }
+
+
+diagnostic_cache = DiagnosticCache()
@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, AsyncGenerator, Dict, Optional
+
+from sqlalchemy import func, select, update
+
+from app.database import AsyncSessionLocal
+from app.models import DiagnosticResult, Session as DiagnosticSession
+
+logger = logging.getLogger("app.services.diagnostic_results")
+
+# Streamed output is appended to its result row once this many characters are pending,
+# or once the oldest pending chunk has waited DIAGNOSTIC_CHECKPOINT_INTERVAL seconds
+DIAGNOSTIC_CHECKPOINT_CHARS = int(os.getenv("DIAGNOSTIC_CHECKPOINT_CHARS", "2048"))
+DIAGNOSTIC_CHECKPOINT_INTERVAL = float(os.getenv("DIAGNOSTIC_CHECKPOINT_INTERVAL", "1.0"))
+
+# Resumed streams poll a row that is still being written, and give up after this long without new text
+DIAGNOSTIC_RESUME_POLL_INTERVAL = float(os.getenv("DIAGNOSTIC_RESUME_POLL_INTERVAL", "0.25"))
+DIAGNOSTIC_RESUME_TIMEOUT = float(os.getenv("DIAGNOSTIC_RESUME_TIMEOUT", "30"))
+
+# Seconds a streaming row may go without a checkpoint before startup treats its stream as dead
+DIAGNOSTIC_STALE_SECONDS = float(os.getenv("DIAGNOSTIC_STALE_SECONDS", "600"))
+
+STATUS_STREAMING = "streaming"
+STATUS_COMPLETE = "complete"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+
+class ResultCheckpointer:
+    """
+    Writes a streaming diagnostic to its result row in batches.
+
+    The row is inserted before the first chunk so the client learns its id
+    up front. Chunks are buffered and each checkpoint appends the batch
+    with one UPDATE (output_text = output_text || batch), so the full text
+    is never held in memory and a client that drops can re-read everything
+    up to the last checkpoint. Length and SHA-256 of the whole output are
+    kept incrementally. A failed checkpoint keeps its batch for the next one.
+    """
+
+    def __init__(self, session_id: int, input_message: str,
+                 checkpoint_chars: int = DIAGNOSTIC_CHECKPOINT_CHARS,
+                 checkpoint_interval: float = DIAGNOSTIC_CHECKPOINT_INTERVAL):
+        self.session_id = session_id
+        self.input_message = input_message
+        self.checkpoint_chars = checkpoint_chars
+        self.checkpoint_interval = checkpoint_interval
+        self.result_id: Optional[int] = None
+        self.length = 0
+        self.checkpoints = 0
+        self._sha = hashlib.sha256()
+        self._pending = []
+        self._pending_chars = 0
+        self._pending_since: Optional[float] = None
+
+    @property
+    def hash(self) -> str:
+        return self._sha.hexdigest()
+
+    async def start(self) -> int:
+        async with AsyncSessionLocal() as db:
+            row = DiagnosticResult(
+                session_id=self.session_id,
+                input_message=self.input_message,
+                output_text="",
+                output_length=0,
+                status=STATUS_STREAMING
+            )
+            db.add(row)
+            await db.commit()
+            self.result_id = row.id
+        return self.result_id
+
+    async def append(self, chunk: str):
+        now = time.monotonic()
+        if self._pending_since is None:
+            self._pending_since = now
+        self._pending.append(chunk)
+        self._pending_chars += len(chunk)
+        self.length += len(chunk)
+        self._sha.update(chunk.encode("utf-8"))
+        if self._pending_chars >= self.checkpoint_chars or now - self._pending_since >= self.checkpoint_interval:
+            await self.checkpoint()
+
+    async def checkpoint(self, **values) -> bool:
+        """Append pending text (plus any extra column values) to the row. Returns False if the write failed."""
+        if not self._pending and not values:
+            return True
+        if self._pending:
+            values["output_text"] = DiagnosticResult.output_text + "".join(self._pending)
+        values["output_length"] = self.length
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(DiagnosticResult)
+                    .where(DiagnosticResult.id == self.result_id)
+                    .values(**values)
+                )
+                await db.commit()
+        except Exception as e:
+            logger.warning("Checkpoint of diagnostic result %s failed: %s", self.result_id, e)
+            return False
+        self._pending = []
+        self._pending_chars = 0
+        self._pending_since = None
+        self.checkpoints += 1
+        return True
+
+    async def finish(self, status: str = STATUS_COMPLETE) -> bool:
+        """Write the last batch and mark the row final; the hash is stored only for complete output."""
+        return await self.checkpoint(
+            status=status,
+            output_hash=self.hash if status == STATUS_COMPLETE else None
+        )
+
+
+async def fail_stale_results() -> int:
+    """
+    Mark streaming rows whose writer stopped checkpointing as failed.
+
+    A process that dies mid-stream leaves its row streaming forever. Rows
+    checkpointed within DIAGNOSTIC_STALE_SECONDS may belong to a live
+    sibling worker and are left alone. Returns the number of rows failed.
+    """
+    now = datetime.now(timezone.utc)
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(DiagnosticResult.id, DiagnosticResult.updated_at, DiagnosticResult.created_at)
+            .where(DiagnosticResult.status == STATUS_STREAMING)
+        )).all()
+        stale = [row.id for row in rows if age_seconds(row.updated_at or row.created_at, now) > DIAGNOSTIC_STALE_SECONDS]
+        if stale:
+            await db.execute(
+                update(DiagnosticResult)
+                .where(DiagnosticResult.id.in_(stale), DiagnosticResult.status == STATUS_STREAMING)
+                .values(status=STATUS_FAILED)
+            )
+            await db.commit()
+    if stale:
+        logger.warning("Marked %d interrupted diagnostic streams as failed", len(stale))
+    return len(stale)
+
+
+def age_seconds(timestamp: Optional[datetime], now: datetime) -> float:
+    if timestamp is None:
+        return float("inf")
+    # SQLite hands back naive UTC timestamps
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (now - timestamp).total_seconds()
+
+
+async def _read_from(user_id: int, result_id: int, offset: int):
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(
+                DiagnosticResult.status,
+                DiagnosticResult.output_length,
+                DiagnosticResult.output_hash,
+                func.substr(DiagnosticResult.output_text, offset + 1).label("tail"),
+            )
+            .join(DiagnosticSession, DiagnosticSession.id == DiagnosticResult.session_id)
+            .where(
+                DiagnosticResult.id == result_id,
+                DiagnosticSession.user_id == user_id
+            )
+        )
+        return result.first()
+
+
+async def follow_result(user_id: int, result_id: int, offset: int = 0) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Replay a stored diagnostic from a character offset, as WebSocket frames.
+
+    Only the text after offset is read. If the row is still streaming, new
+    checkpoints are polled and forwarded until it is final. Ends with a
+    completion frame (result id, hash, length) or an error frame.
+    """
+    idle_since = time.monotonic()
+    while True:
+        row = await _read_from(user_id, result_id, offset)
+        if row is None:
+            yield {"error": "Diagnostic result not found", "result_id": result_id}
+            return
+        if row.tail:
+            offset += len(row.tail)
+            idle_since = time.monotonic()
+            yield {"chunk": row.tail}
+        if row.status == STATUS_COMPLETE:
+            yield {"complete": True, "result_id": result_id, "hash": row.output_hash, "length": row.output_length}
+            return
+        if row.status in (STATUS_FAILED, STATUS_CANCELLED):
+            yield {"error": f"Diagnostic generation {row.status}", "result_id": result_id, "offset": offset}
+            return
+        if time.monotonic() - idle_since >= DIAGNOSTIC_RESUME_TIMEOUT:
+            yield {"error": "Diagnostic stream stalled", "result_id": result_id, "offset": offset}
+            return
+        await asyncio.sleep(DIAGNOSTIC_RESUME_POLL_INTERVAL)
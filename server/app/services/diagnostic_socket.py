@@ -0,0 +1,310 @@
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+from sqlalchemy import update
+
+from app.database import AsyncSessionLocal
+from app.logging_config import Sampler
+from app.metrics import registry
+from app.models import Session as DiagnosticSession
+from app.services.ai_service import generate_diagnostic
+from app.services.connections import connection_manager
+from app.services.conversation import conversation_context
+from app.services.diagnostic_results import (
+    ResultCheckpointer, STATUS_CANCELLED, STATUS_FAILED, follow_result
+)
+from app.services.llm_scheduler import UpstreamError
+from app.services.similar_cases import similar_cases
+from app.services.streaming import FlushPolicy
+
+logger = logging.getLogger("app.services.diagnostic_socket")
+chunk_log_sample = Sampler(logger)
+
+# What an input does while a diagnosis is streaming: wait its turn ("queue") or cancel the running one ("supersede")
+WS_INPUT_MODE = os.getenv("WS_INPUT_MODE", "queue")
+WS_MAX_QUEUED_INPUTS = int(os.getenv("WS_MAX_QUEUED_INPUTS", "4"))
+# Frames buffered per socket before the generation waits for a slow client
+WS_SEND_QUEUE_MAX = int(os.getenv("WS_SEND_QUEUE_MAX", "256"))
+# Seconds a generation keeps checkpointing after its client disconnects, so a reconnect can resume it; 0 stops it at once
+WS_DISCONNECT_GRACE = float(os.getenv("WS_DISCONNECT_GRACE", "0"))
+
+INPUT_MODES = ("queue", "supersede")
+
+diagnostics_cancelled = registry.counter(
+    "diagnostic_streams_cancelled_total", "Diagnostic generations stopped before completion", ("reason",))
+
+# Generations whose client went away, kept alive for WS_DISCONNECT_GRACE: result id -> (user id, task, timer)
+_detached: Dict[int, Tuple[int, asyncio.Task, asyncio.TimerHandle]] = {}
+
+
+def _adopt(user_id: int, result_id: int) -> Optional[asyncio.Task]:
+    """Keep a detached generation running because its owner resumed it."""
+    entry = _detached.get(result_id)
+    if entry is None or entry[0] != user_id:
+        return None
+    del _detached[result_id]
+    entry[2].cancel()
+    return entry[1]
+
+
+class DiagnosticSocket:
+    """
+    One /ws/diagnostics connection, split into reader and writer tasks.
+
+    The reader keeps receiving while a diagnosis streams, so cancel
+    requests, new inputs and disconnects are seen immediately. Every
+    outbound frame goes through a bounded queue drained by the writer.
+    Generations run one at a time in their own task; a new input waits in
+    a short queue or supersedes the running one. When either task ends the
+    connection is torn down and the running generation is cancelled,
+    which closes the upstream stream.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: int, session_id: int,
+                 flush_policy: FlushPolicy, input_mode: str = WS_INPUT_MODE):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.session_id = session_id
+        self.flush_policy = flush_policy
+        self.input_mode = input_mode
+        self.outbound: asyncio.Queue = asyncio.Queue(WS_SEND_QUEUE_MAX)
+        self.inputs: Deque[str] = deque()
+        self.generation: Optional[asyncio.Task] = None
+        self.result_id: Optional[int] = None
+        self.cancel_reason = "client"
+        # Generations resumed from another connection, by result id
+        self.adopted: Dict[int, asyncio.Task] = {}
+        self.followers = set()
+        self.closed = False
+
+    async def send(self, frame: Dict[str, Any]):
+        if not self.closed:
+            await self.outbound.put(json.dumps(frame))
+
+    def push(self, text: str) -> bool:
+        """Queue an event pushed to this user by connection_manager, without waiting for room."""
+        if self.closed:
+            return True
+        try:
+            self.outbound.put_nowait(text)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def run(self):
+        reader = asyncio.ensure_future(self._reader())
+        writer = asyncio.ensure_future(self._writer())
+        try:
+            await asyncio.wait({reader, writer}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.closed = True
+            self.inputs.clear()
+            for task in (reader, writer, *self.followers):
+                task.cancel()
+            self._abandon()
+            await asyncio.gather(reader, writer, return_exceptions=True)
+
+    async def _writer(self):
+        while True:
+            text = await self.outbound.get()
+            try:
+                await self.websocket.send_text(text)
+            except Exception as e:
+                logger.info("Send failed on session %s, closing: %s", self.session_id, e)
+                return
+
+    async def _reader(self):
+        while True:
+            try:
+                data = await self.websocket.receive_text()
+            except WebSocketDisconnect:
+                logger.info("WebSocket disconnected for session %s", self.session_id)
+                return
+            logger.debug("Received message on session %s: %d bytes", self.session_id, len(data))
+            try:
+                message = json.loads(data)
+            except json.JSONDecodeError as json_error:
+                logger.info("WebSocket: Invalid JSON - %s", json_error)
+                await self.send({"error": "Invalid JSON format"})
+                continue
+
+            if not isinstance(message, dict):
+                await self.send({"error": "Invalid message format"})
+            elif "cancel" in message:
+                await self.cancel()
+            elif "input" in message:
+                await self.submit(message["input"], message.get("mode", self.input_mode))
+            elif "resume" in message:
+                await self.resume(message)
+            else:
+                await self.send({"error": "Invalid message format"})
+
+    async def submit(self, user_input: str, mode: str):
+        if mode not in INPUT_MODES:
+            await self.send({"error": f"Unknown input mode '{mode}'"})
+            return
+        if self.generation is None or self.generation.done():
+            self._start(user_input)
+        elif mode == "supersede":
+            # The cancelled generation starts this input as it finishes
+            self.inputs.clear()
+            self.inputs.append(user_input)
+            self.cancel_reason = "superseded"
+            self.generation.cancel()
+        elif len(self.inputs) >= WS_MAX_QUEUED_INPUTS:
+            await self.send({"error": "Too many queued inputs"})
+        else:
+            self.inputs.append(user_input)
+            await self.send({"type": "input_queued", "position": len(self.inputs)})
+
+    async def cancel(self):
+        """Stop the running generation (and any resumed one) and drop queued inputs."""
+        self.inputs.clear()
+        running = [task for task in (self.generation, *self.adopted.values()) if task is not None and not task.done()]
+        if not running:
+            await self.send({"type": "cancelled", "result_id": None})
+            return
+        self.cancel_reason = "client"
+        for task in running:
+            task.cancel()
+
+    async def resume(self, message: Dict[str, Any]):
+        try:
+            result_id = int(message["resume"])
+            offset = max(0, int(message.get("offset", 0)))
+        except (TypeError, ValueError):
+            await self.send({"error": "Invalid resume request"})
+            return
+        task = _adopt(self.user_id, result_id)
+        if task is not None:
+            self.adopted[result_id] = task
+            task.add_done_callback(lambda _: self.adopted.pop(result_id, None))
+        follower = asyncio.ensure_future(self._follow(result_id, offset))
+        self.followers.add(follower)
+        follower.add_done_callback(self.followers.discard)
+
+    async def _follow(self, result_id: int, offset: int):
+        async for frame in follow_result(self.user_id, result_id, offset):
+            await self.send(frame)
+
+    def _start(self, user_input: str):
+        self.cancel_reason = "client"
+        self.result_id = None
+        self.generation = asyncio.ensure_future(self._generate(user_input))
+        self.generation.add_done_callback(self._next)
+
+    def _next(self, task: asyncio.Task):
+        if not self.closed and self.inputs:
+            self._start(self.inputs.popleft())
+
+    def _abandon(self):
+        """Stop or detach generations once the client is gone."""
+        self.cancel_reason = "disconnect"
+        running = dict(self.adopted)
+        if self.generation is not None and self.result_id is not None:
+            running[self.result_id] = self.generation
+        elif self.generation is not None:
+            running[None] = self.generation
+        for result_id, task in running.items():
+            if task.done():
+                continue
+            if WS_DISCONNECT_GRACE > 0 and result_id is not None:
+                timer = asyncio.get_running_loop().call_later(WS_DISCONNECT_GRACE, task.cancel)
+                _detached[result_id] = (self.user_id, task, timer)
+                task.add_done_callback(lambda _, result_id=result_id: _detached.pop(result_id, None))
+            else:
+                task.cancel()
+
+    async def _similar_cases(self, user_input: str):
+        try:
+            return await similar_cases.similar_to(user_input, self.user_id, exclude_session=self.session_id)
+        except Exception as e:
+            logger.warning("Similar case lookup failed for session %s: %s", self.session_id, e)
+            return []
+
+    async def _generate(self, user_input: str):
+        checkpointer = ResultCheckpointer(self.session_id, user_input)
+        try:
+            # Update session input
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(DiagnosticSession)
+                    .where(DiagnosticSession.id == self.session_id)
+                    .values(input_text=user_input)
+                )
+                await db.commit()
+
+            # Earlier turns of this session, within the context token budget
+            history = await conversation_context.messages_for(self.session_id)
+            logger.info("Starting diagnostic generation for session %s with %d context messages",
+                        self.session_id, len(history))
+            # The result row exists before the first chunk, so a dropped client can resume by id
+            self.result_id = result_id = await checkpointer.start()
+            await self.send({"type": "stream_started", "result_id": result_id})
+
+            # Past cases like this one, shown at once and used to ground the prompt
+            similar = await self._similar_cases(user_input)
+            if similar:
+                await self.send({"type": "similar_cases", "result_id": result_id, "cases": similar})
+
+            chunk_count = 0
+            stream = generate_diagnostic(user_input, flush_policy=self.flush_policy, history=history, similar=similar)
+            try:
+                async for chunk in stream:
+                    if chunk:  # Only send non-empty chunks
+                        if chunk_log_sample():
+                            logger.debug("Sending chunk %d for session %s: %d characters", chunk_count, self.session_id, len(chunk))
+                        await self.send({"chunk": chunk})
+                        chunk_count += 1
+                        await checkpointer.append(chunk)
+            except UpstreamError:
+                # Report provider failures as errors, not as a (partial) diagnosis
+                raise
+            except asyncio.CancelledError:
+                raise
+            except Exception as generator_error:
+                logger.exception("Generator error: %s", generator_error)
+            finally:
+                # Leave the upstream stream now, not when the generator is collected
+                await stream.aclose()
+
+            logger.info("Session %s: sent %d chunks, %d characters in %d checkpoints",
+                        self.session_id, chunk_count, checkpointer.length, checkpointer.checkpoints + 1)
+
+            # Write the last batch and mark the result complete
+            if not await checkpointer.finish():
+                raise RuntimeError("Could not save diagnostic result")
+            similar_cases.add_result(result_id)
+
+            # Send completion message; the text was already streamed and is stored under result_id
+            await self.send({
+                "complete": True,
+                "result_id": result_id,
+                "hash": checkpointer.hash,
+                "length": checkpointer.length
+            })
+
+            # Let the user's other clients, on any worker, know a new result exists
+            await connection_manager.send_to_user(self.user_id, {
+                "type": "diagnostic_complete",
+                "session_id": self.session_id,
+                "result_id": result_id
+            })
+        except asyncio.CancelledError:
+            reason = self.cancel_reason
+            logger.info("Diagnostic generation for session %s cancelled (%s)", self.session_id, reason)
+            diagnostics_cancelled.labels(reason).inc()
+            if checkpointer.result_id is not None:
+                await checkpointer.finish(STATUS_CANCELLED)
+            await self.send({"type": "cancelled", "result_id": checkpointer.result_id})
+            raise
+        except Exception as gen_error:
+            logger.exception("Diagnostic generation error for session %s: %s", self.session_id, gen_error)
+            if checkpointer.result_id is not None:
+                await checkpointer.finish(STATUS_FAILED)
+            await self.send({"error": f"Diagnostic generation failed: {str(gen_error)}"})
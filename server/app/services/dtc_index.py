@@ -0,0 +1,239 @@
+"""
+Local OBD-II trouble code index.
+
+The editable source is a TSV (code, description, causes separated by
+semicolons). It is compiled into a compact binary file that is
+memory-mapped and binary-searched, so a lookup parses nothing and the
+OS pages in only what is touched:
+
+    b"DTC1" | count:u32 | sorted 5-byte codes | (offset:u32, length:u16) per code | UTF-8 records
+
+Each record is the description, 0x1F, then causes joined by 0x1E. The
+index is built on first use when missing or older than the source, or
+ahead of time with:
+
+    python -m app.services.dtc_index
+"""
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from typing import List, Optional
+
+from app.services.diagnostic_cache import extract_obd_codes
+
+logger = logging.getLogger("app.services.dtc_index")
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+# Trouble code index: TSV source and the compiled, memory-mapped file built from it
+DTC_INDEX_ENABLED = os.getenv("DTC_INDEX_ENABLED", "1") == "1"
+DTC_SOURCE_PATH = os.getenv("DTC_SOURCE_PATH", os.path.join(DATA_DIR, "dtc_codes.tsv"))
+DTC_INDEX_PATH = os.getenv("DTC_INDEX_PATH", os.path.join(DATA_DIR, "dtc_codes.idx"))
+# Codes resolved per input; more than this is usually a pasted scan report
+DTC_MAX_CODES = int(os.getenv("DTC_MAX_CODES", "8"))
+# Stream the code reference before the model's first token
+DTC_PREAMBLE = os.getenv("DTC_PREAMBLE", "1") == "1"
+
+MAGIC = b"DTC1"
+HEADER = struct.Struct("<4sI")
+CODE_SIZE = 5
+ENTRY = struct.Struct("<IH")
+FIELD_SEP = "\x1f"
+CAUSE_SEP = "\x1e"
+
+SYSTEMS = {"P": "Powertrain", "C": "Chassis", "B": "Body", "U": "Network"}
+
+# SAE subsystem of generic powertrain codes, by third character
+POWERTRAIN_SUBSYSTEMS = {
+    "0": "Fuel and air metering, auxiliary emission controls",
+    "1": "Fuel and air metering",
+    "2": "Fuel and air metering (injector circuit)",
+    "3": "Ignition system or misfire",
+    "4": "Auxiliary emission controls",
+    "5": "Vehicle speed, idle control and auxiliary inputs",
+    "6": "Computer and output circuits",
+    "7": "Transmission",
+    "8": "Transmission",
+    "9": "Transmission",
+}
+
+
+class DTCInfo:
+    """What the index knows about one code; description is None for codes not in the table."""
+
+    __slots__ = ("code", "description", "causes", "system", "subsystem", "manufacturer_specific")
+
+    def __init__(self, code: str, description: Optional[str] = None, causes: Optional[List[str]] = None):
+        self.code = code
+        self.description = description
+        self.causes = causes or []
+        self.system = SYSTEMS.get(code[0], "Unknown")
+        # P1/P3 (mostly) and B1/B2, C1/C2, U1/U2 codes are defined by the manufacturer
+        self.manufacturer_specific = code[1] in ("13" if code[0] == "P" else "12")
+        self.subsystem = POWERTRAIN_SUBSYSTEMS.get(code[2]) if code[0] == "P" and code[1] in "02" else None
+
+    @property
+    def known(self) -> bool:
+        return self.description is not None
+
+
+def read_source(path: str) -> List[tuple]:
+    entries = {}
+    with open(path, encoding="utf-8") as source:
+        for line_number, line in enumerate(source, 1):
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            if len(fields) != 3 or not extract_obd_codes(fields[0]) or len(fields[0]) != CODE_SIZE:
+                raise ValueError(f"{path}:{line_number}: expected code<TAB>description<TAB>causes")
+            code, description, causes = fields
+            entries[code.upper()] = (description.strip(), [c.strip() for c in causes.split(";") if c.strip()])
+    return sorted((code, description, causes) for code, (description, causes) in entries.items())
+
+
+def build_index(source_path: str = DTC_SOURCE_PATH, index_path: str = DTC_INDEX_PATH) -> int:
+    """Compile the TSV source into the binary index. Returns the number of codes."""
+    entries = read_source(source_path)
+    codes, table, records = bytearray(), bytearray(), bytearray()
+    for code, description, causes in entries:
+        record = (description + FIELD_SEP + CAUSE_SEP.join(causes)).encode("utf-8")
+        codes += code.encode("ascii")
+        table += ENTRY.pack(len(records), len(record))
+        records += record
+
+    # Write beside the target and rename, so readers never map a half-written file
+    directory = os.path.dirname(os.path.abspath(index_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(HEADER.pack(MAGIC, len(entries)))
+            out.write(codes)
+            out.write(table)
+            out.write(records)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(entries)
+
+
+class DTCIndex:
+    """Read-only view of a compiled index file."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as index_file:
+            self._map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a DTC index")
+        self._codes = HEADER.size
+        self._table = self._codes + self.count * CODE_SIZE
+        self._records = self._table + self.count * ENTRY.size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _find(self, key: bytes) -> int:
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = self._codes + middle * CODE_SIZE
+            if self._map[start:start + CODE_SIZE] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            start = self._codes + low * CODE_SIZE
+            if self._map[start:start + CODE_SIZE] == key:
+                return low
+        return -1
+
+    def lookup(self, code: str) -> DTCInfo:
+        code = code.upper()
+        position = self._find(code.encode("ascii"))
+        if position < 0:
+            return DTCInfo(code)
+        offset, length = ENTRY.unpack_from(self._map, self._table + position * ENTRY.size)
+        start = self._records + offset
+        description, _, causes = self._map[start:start + length].decode("utf-8").partition(FIELD_SEP)
+        return DTCInfo(code, description, causes.split(CAUSE_SEP) if causes else [])
+
+    def close(self):
+        self._map.close()
+
+
+_index: Optional[DTCIndex] = None
+_index_failed = False
+_index_lock = threading.Lock()
+
+
+def _stale(source_path: str, index_path: str) -> bool:
+    try:
+        return os.path.getmtime(index_path) < os.path.getmtime(source_path)
+    except FileNotFoundError:
+        return True
+
+
+def get_dtc_index() -> Optional[DTCIndex]:
+    """The shared index, built and mapped on first use. None if disabled or unavailable."""
+    global _index, _index_failed
+    if _index is not None or _index_failed or not DTC_INDEX_ENABLED:
+        return _index
+    with _index_lock:
+        if _index is None and not _index_failed:
+            try:
+                if _stale(DTC_SOURCE_PATH, DTC_INDEX_PATH):
+                    count = build_index(DTC_SOURCE_PATH, DTC_INDEX_PATH)
+                    logger.info("Built DTC index with %d codes at %s", count, DTC_INDEX_PATH)
+                _index = DTCIndex(DTC_INDEX_PATH)
+            except (OSError, ValueError) as e:
+                logger.warning("DTC index unavailable: %s", e)
+                _index_failed = True
+    return _index
+
+
+def resolve_codes(text: str, limit: int = DTC_MAX_CODES) -> List[DTCInfo]:
+    """Trouble codes mentioned in text, with whatever the index knows about each."""
+    index = get_dtc_index()
+    if index is None:
+        return []
+    return [index.lookup(code) for code in extract_obd_codes(text)[:limit]]
+
+
+def _heading(info: DTCInfo) -> str:
+    area = info.subsystem or info.system
+    if info.manufacturer_specific:
+        area += ", manufacturer-specific"
+    description = info.description if info.known else "not in the generic code table"
+    return f"{info.code}: {description} ({area})"
+
+
+def format_preamble(infos: List[DTCInfo]) -> str:
+    """Deterministic "what these codes mean" text streamed ahead of the model's answer."""
+    lines = []
+    for info in infos:
+        lines.append(_heading(info))
+        if info.causes:
+            lines.append("  Common causes: " + "; ".join(info.causes))
+    return "Code reference:\n" + "\n".join(lines) + "\n\n" if lines else ""
+
+
+def format_facts(infos: List[DTCInfo]) -> str:
+    """Structured facts for the prompt, so the model builds on them instead of restating them."""
+    if not infos:
+        return ""
+    lines = []
+    for info in infos:
+        lines.append(f"- {_heading(info)}")
+        if info.causes:
+            lines.append(f"  Common causes: {'; '.join(info.causes)}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    print(f"Indexed {build_index()} codes into {DTC_INDEX_PATH}")
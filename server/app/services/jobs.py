@@ -0,0 +1,268 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.database import AsyncSessionLocal
+from app.models import Job, Session as DiagnosticSession
+from app.services.connections import connection_manager
+from app.services.diagnostic_results import age_seconds
+from app.services.orders import (
+    parts_input_hash_for, predict_session_parts, summarize_session_order, summary_input_hash_for
+)
+
+logger = logging.getLogger("app.services.jobs")
+
+# Job queue configuration
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "1000"))
+# Seconds between heartbeats on the jobs this process has queued or running
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "15"))
+# Seconds without a heartbeat after which a queued or running job's process is presumed gone
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+JobHandler = Callable[[int, int, Dict[str, Any]], Awaitable[Any]]
+
+JOB_HANDLERS: Dict[str, JobHandler] = {
+    "predict_parts": lambda user_id, session_id, params: predict_session_parts(
+        user_id, session_id, params.get("force", False)),
+    "summarize_order": lambda user_id, session_id, params: summarize_session_order(
+        user_id, session_id, params.get("notes"), params.get("force", False)),
+}
+
+# What each kind of job is generated from; part of the default idempotency key, so a
+# finished job is only handed back while its inputs are unchanged
+JOB_INPUT_HASHES: Dict[str, Callable[[int, int, Dict[str, Any]], Awaitable[str]]] = {
+    "predict_parts": lambda user_id, session_id, params: parts_input_hash_for(user_id, session_id),
+    "summarize_order": lambda user_id, session_id, params: summary_input_hash_for(
+        user_id, session_id, params.get("notes")),
+}
+
+
+def job_to_dict(job: Job) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "session_id": job.session_id,
+        "status": job.status,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def idempotency_key_for(user_id: int, kind: str, session_id: int, params: Dict[str, Any], client_key: Optional[str],
+                        input_hash: Optional[str] = None) -> str:
+    # A client-supplied key wins; otherwise identical submissions on unchanged inputs map to the same job
+    payload = json.dumps([user_id, kind, session_id, client_key or [params, input_hash]], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _reusable(job: Job) -> bool:
+    """Whether a resubmission should get this job back instead of running it again."""
+    if job.status == "succeeded":
+        return True
+    return job.status in ACTIVE_STATUSES and not _abandoned(job, _now())
+
+
+def _abandoned(job: Job, now: datetime) -> bool:
+    # The queue is in memory, so a job whose process stopped heartbeating never finishes
+    return age_seconds(job.heartbeat_at or job.updated_at, now) > JOB_STALE_SECONDS
+
+
+class JobQueue:
+    """
+    Bounded in-process worker pool for slow LLM-backed operations.
+
+    Jobs are persisted in the jobs table so status can be read from any
+    worker; submissions are idempotent on their key, so client retries
+    return the existing job instead of paying for another upstream call.
+
+    Each process stamps the jobs it queues with its owner id and
+    heartbeats them while they are queued or running. A job whose
+    heartbeat has gone stale belongs to a process that stopped; it is
+    marked failed, and like any failed job it is re-queued when
+    resubmitted. Jobs a live sibling worker holds are left alone.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queued: int = JOB_QUEUE_MAX):
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+        self.tasks: List[asyncio.Task] = []
+        self.owner = uuid.uuid4().hex
+
+    async def start(self):
+        if not self.tasks:
+            await self._fail_abandoned()
+            self.tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+            self.tasks.append(asyncio.ensure_future(self._heartbeat()))
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(Job)
+                        .where(Job.owner == self.owner, Job.status.in_(ACTIVE_STATUSES))
+                        .values(heartbeat_at=_now())
+                        .execution_options(synchronize_session=False)
+                    )
+                    await db.commit()
+                await self._fail_abandoned()
+            except Exception:
+                logger.exception("Job heartbeat failed")
+
+    async def _fail_abandoned(self):
+        """Mark queued or running jobs whose process stopped heartbeating as failed, so a retry runs them again."""
+        now = _now()
+        async with AsyncSessionLocal() as db:
+            jobs = (await db.execute(
+                select(Job).where(Job.status.in_(ACTIVE_STATUSES), or_(Job.owner.is_(None), Job.owner != self.owner))
+            )).scalars().all()
+            abandoned = [job for job in jobs if _abandoned(job, now)]
+            for job in abandoned:
+                job.status = "failed"
+                job.error = "Interrupted: the worker running it stopped"
+            await db.commit()
+        if abandoned:
+            logger.warning("Marked %d abandoned jobs as failed", len(abandoned))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def submit(
+        self,
+        user_id: int,
+        kind: str,
+        session_id: int,
+        params: Optional[Dict[str, Any]] = None,
+        client_key: Optional[str] = None
+    ) -> Dict[str, Any]:
+        params = params or {}
+        if params.get("force") and client_key is None:
+            # A forced regeneration is never a retry of an earlier job
+            client_key = uuid.uuid4().hex
+
+        async with AsyncSessionLocal() as db:
+            owned = await db.execute(
+                select(DiagnosticSession.id).where(
+                    DiagnosticSession.id == session_id,
+                    DiagnosticSession.user_id == user_id
+                )
+            )
+            if owned.scalar() is None:
+                raise HTTPException(status_code=404, detail="Session not found")
+
+            input_hash = await JOB_INPUT_HASHES[kind](user_id, session_id, params) if client_key is None else None
+            key = idempotency_key_for(user_id, kind, session_id, params, client_key, input_hash)
+            job = (await db.execute(select(Job).where(Job.idempotency_key == key))).scalars().first()
+            if job is not None and _reusable(job):
+                return job_to_dict(job)
+
+            if job is None:
+                job = Job(
+                    id=uuid.uuid4().hex,
+                    user_id=user_id,
+                    session_id=session_id,
+                    kind=kind,
+                    idempotency_key=key,
+                    params=json.dumps(params),
+                    status="queued",
+                    owner=self.owner,
+                    heartbeat_at=_now()
+                )
+                db.add(job)
+            else:
+                job.status = "queued"
+                job.error = None
+                job.owner = self.owner
+                job.heartbeat_at = _now()
+
+            if self.queue.full():
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Job queue is full, please retry shortly",
+                    headers={"Retry-After": "5"},
+                )
+            try:
+                await db.commit()
+            except IntegrityError:
+                # A concurrent retry created the job first
+                await db.rollback()
+                job = (await db.execute(select(Job).where(Job.idempotency_key == key))).scalars().first()
+                return job_to_dict(job)
+            await db.refresh(job)
+
+        self.queue.put_nowait(job.id)
+        return job_to_dict(job)
+
+    async def get(self, job_id: str, user_id: int) -> Optional[Dict[str, Any]]:
+        async with AsyncSessionLocal() as db:
+            job = (await db.execute(
+                select(Job).where(Job.id == job_id, Job.user_id == user_id)
+            )).scalars().first()
+            return job_to_dict(job) if job else None
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                logger.exception("Job %s crashed", job_id)
+            finally:
+                self.queue.task_done()
+
+    async def _set_status(self, job_id: str, **values) -> Job:
+        async with AsyncSessionLocal() as db:
+            job = await db.get(Job, job_id)
+            for name, value in values.items():
+                setattr(job, name, value)
+            await db.commit()
+            await db.refresh(job)
+            return job
+
+    async def _run(self, job_id: str):
+        job = await self._set_status(job_id, status="running", heartbeat_at=_now())
+        handler = JOB_HANDLERS[job.kind]
+        try:
+            result = await handler(job.user_id, job.session_id, json.loads(job.params or "{}"))
+        except HTTPException as e:
+            job = await self._set_status(job_id, status="failed", error=str(e.detail))
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job_id, job.kind)
+            job = await self._set_status(job_id, status="failed", error=str(e))
+        else:
+            job = await self._set_status(job_id, status="succeeded", result=json.dumps(jsonable_encoder(result)))
+
+        await connection_manager.send_to_user(job.user_id, {
+            "type": "job",
+            "job_id": job.id,
+            "kind": job.kind,
+            "session_id": job.session_id,
+            "status": job.status,
+            "error": job.error
+        })
+
+
+job_queue = JobQueue()
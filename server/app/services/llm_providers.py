@@ -0,0 +1,259 @@
+import asyncio
+import json
+import os
+import random
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import openai
+
+# Which backend answers model calls: "openai", or "stub" for offline runs and load tests
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+
+# Stub backend behaviour
+LLM_STUB_LATENCY = float(os.getenv("LLM_STUB_LATENCY", "0.2"))
+LLM_STUB_TOKENS_PER_SECOND = float(os.getenv("LLM_STUB_TOKENS_PER_SECOND", "50"))
+LLM_STUB_ERROR_RATE = float(os.getenv("LLM_STUB_ERROR_RATE", "0"))
+LLM_STUB_SEED = int(os.getenv("LLM_STUB_SEED", "0"))
+
+Messages = List[Dict[str, str]]
+
+
+class ProviderError(Exception):
+    """A failed model call, normalized across backends so the scheduler can decide on retries."""
+
+    def __init__(self, message: str, http_status: Optional[int] = None,
+                 retry_after: Optional[float] = None, retryable: Optional[bool] = None):
+        super().__init__(message)
+        self.http_status = http_status
+        self.retry_after = retry_after
+        self.retryable = retryable
+
+
+class ChatResult:
+    """Text of a non-streaming completion and the tokens it used, if the backend reports them."""
+
+    __slots__ = ("text", "total_tokens")
+
+    def __init__(self, text: str, total_tokens: Optional[int] = None):
+        self.text = text
+        self.total_tokens = total_tokens
+
+    def json(self) -> Any:
+        """Parse the text as JSON, tolerating a Markdown code fence. Raises ValueError."""
+        return json.loads(self.text.replace("```json", "").replace("```", ""))
+
+
+class LLMProvider:
+    """
+    Chat backend used by ai_service.
+
+    stream_chat opens the stream before returning, so connection and rate
+    limit errors surface from the await (where they can be retried) and
+    the returned iterator yields text deltas.
+    """
+
+    name = "base"
+
+    def __init__(self, model: str = LLM_MODEL):
+        self.model = model
+
+    async def stream_chat(self, messages: Messages) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    async def chat(self, messages: Messages) -> ChatResult:
+        raise NotImplementedError
+
+    async def chat_json(self, messages: Messages) -> ChatResult:
+        """Like chat, but the backend is asked to answer with a single JSON object."""
+        raise NotImplementedError
+
+    async def stream_chat_json(self, messages: Messages) -> AsyncIterator[str]:
+        """Like stream_chat, but the backend is asked to answer with a single JSON object."""
+        raise NotImplementedError
+
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI chat completions through the openai 0.27 client."""
+
+    name = "openai"
+
+    RETRYABLE_ERRORS = (
+        openai.error.RateLimitError,
+        openai.error.ServiceUnavailableError,
+        openai.error.Timeout,
+        openai.error.APIConnectionError,
+        openai.error.TryAgain,
+    )
+
+    def __init__(self, model: str = LLM_MODEL, api_key: Optional[str] = None):
+        super().__init__(model)
+        openai.api_key = api_key or os.getenv("OPENAI_API_KEY", "your-api-key-here")
+
+    def _translate(self, error: Exception) -> ProviderError:
+        headers = getattr(error, "headers", None) or {}
+        try:
+            retry_after = float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            retry_after = None
+        retryable = True if isinstance(error, self.RETRYABLE_ERRORS) else None
+        return ProviderError(str(error), getattr(error, "http_status", None), retry_after, retryable)
+
+    async def _create(self, messages: Messages, **options):
+        if not openai.api_key:
+            raise ProviderError("OpenAI API key is not set", retryable=False)
+        try:
+            return await openai.ChatCompletion.acreate(model=self.model, messages=messages, **options)
+        except openai.error.OpenAIError as e:
+            raise self._translate(e) from e
+
+    async def stream_chat(self, messages: Messages) -> AsyncIterator[str]:
+        response = await self._create(messages, stream=True)
+        return self._deltas(response)
+
+    async def stream_chat_json(self, messages: Messages) -> AsyncIterator[str]:
+        response = await self._create(messages, stream=True, response_format={"type": "json_object"})
+        return self._deltas(response)
+
+    async def _deltas(self, response) -> AsyncIterator[str]:
+        try:
+            async for chunk in response:
+                delta = chunk.choices[0].delta
+                if "content" in delta and delta.content:
+                    yield delta.content
+        except openai.error.OpenAIError as e:
+            raise self._translate(e) from e
+
+    async def chat(self, messages: Messages, **options) -> ChatResult:
+        response = await self._create(messages, **options)
+        usage = getattr(response, "usage", None)
+        return ChatResult(response.choices[0].message.content, getattr(usage, "total_tokens", None))
+
+    async def chat_json(self, messages: Messages) -> ChatResult:
+        return await self.chat(messages, response_format={"type": "json_object"})
+
+
+STUB_DIAGNOSIS = (
+    "1. Likely causes: a failing ignition coil or worn spark plug on the affected cylinder, "
+    "a clogged fuel injector, or a vacuum leak at the intake manifold gasket.\n"
+    "2. Severity level: moderate. The engine can be driven short distances, but a persistent "
+    "misfire overheats the catalytic converter.\n"
+    "3. Recommended next steps: read freeze-frame data, swap the coil with a neighbouring "
+    "cylinder to see if the misfire follows it, inspect the plug gap and electrode wear, and "
+    "smoke-test the intake for leaks.\n"
+    "4. Potential complications if left unaddressed: catalytic converter damage, poor fuel "
+    "economy, failed emissions inspection and rough running that worsens under load."
+)
+
+STUB_SUMMARY = (
+    "Your vehicle's engine is misfiring, which means one cylinder is not burning fuel properly. "
+    "We recommend replacing the ignition coil and spark plugs on the affected cylinder. These "
+    "repairs restore smooth running, protect the catalytic converter from heat damage and bring "
+    "fuel economy back to normal. Our technician's notes are included with this estimate."
+)
+
+# Canned answers keyed by a word in the system prompt
+STUB_RESPONSES = {"diagnostic": STUB_DIAGNOSIS, "repair": STUB_SUMMARY}
+
+STUB_PARTS = {
+    "parts": [
+        {"id": "part_1", "name": "Ignition Coil", "confidence": 0.82, "price": "$60-$150"},
+        {"id": "part_2", "name": "Spark Plug Set", "confidence": 0.74, "price": "$20-$80"},
+        {"id": "part_3", "name": "Fuel Injector", "confidence": 0.41, "price": "$80-$250"},
+    ]
+}
+
+
+class StubProvider(LLMProvider):
+    """
+    Deterministic local backend for offline development and load tests.
+
+    Replays canned answers word by word after a fixed first-token latency
+    at a fixed tokens/sec, with no network. error_rate injects retryable
+    429/503 failures from a seeded generator, so runs are repeatable.
+    """
+
+    name = "stub"
+
+    def __init__(self, model: str = "stub", latency: float = LLM_STUB_LATENCY,
+                 tokens_per_second: float = LLM_STUB_TOKENS_PER_SECOND,
+                 error_rate: float = LLM_STUB_ERROR_RATE, seed: int = LLM_STUB_SEED,
+                 responses: Optional[Dict[str, str]] = None):
+        super().__init__(model)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.responses = responses or STUB_RESPONSES
+        self.calls = 0
+
+    def _pick(self, messages: Messages) -> str:
+        system = messages[0]["content"].lower() if messages else ""
+        for keyword, text in self.responses.items():
+            if keyword in system:
+                return text
+        return next(iter(self.responses.values()))
+
+    async def _begin(self):
+        self.calls += 1
+        if self.error_rate and self.random.random() < self.error_rate:
+            status = self.random.choice((429, 503))
+            raise ProviderError(f"Stub upstream error {status}", http_status=status, retry_after=0.0 if status == 429 else None)
+        await asyncio.sleep(self.latency)
+
+    @staticmethod
+    def _tokens(text: str) -> List[str]:
+        words = text.split(" ")
+        return [word + " " for word in words[:-1]] + [words[-1]]
+
+    async def stream_chat(self, messages: Messages) -> AsyncIterator[str]:
+        await self._begin()
+        return self._replay(self._pick(messages))
+
+    async def _replay(self, text: str) -> AsyncIterator[str]:
+        delay = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        for token in self._tokens(text):
+            if delay:
+                await asyncio.sleep(delay)
+            yield token
+
+    async def _complete(self, text: str) -> ChatResult:
+        await self._begin()
+        tokens = len(self._tokens(text))
+        if self.tokens_per_second > 0:
+            await asyncio.sleep(tokens / self.tokens_per_second)
+        return ChatResult(text, tokens)
+
+    async def chat(self, messages: Messages) -> ChatResult:
+        return await self._complete(self._pick(messages))
+
+    async def chat_json(self, messages: Messages) -> ChatResult:
+        return await self._complete(json.dumps(STUB_PARTS))
+
+    async def stream_chat_json(self, messages: Messages) -> AsyncIterator[str]:
+        await self._begin()
+        return self._replay(json.dumps(STUB_PARTS))
+
+
+def create_provider(name: str = LLM_PROVIDER) -> LLMProvider:
+    if name == "openai":
+        return OpenAIProvider()
+    if name == "stub":
+        return StubProvider()
+    raise ValueError(f"Unsupported LLM_PROVIDER: {name}")
+
+
+_provider: Optional[LLMProvider] = None
+
+
+def get_llm_provider() -> LLMProvider:
+    global _provider
+    if _provider is None:
+        _provider = create_provider()
+    return _provider
+
+
+def set_llm_provider(provider: LLMProvider):
+    """Swap the backend, e.g. to a StubProvider in benchmarks."""
+    global _provider
+    _provider = provider
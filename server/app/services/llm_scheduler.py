@@ -0,0 +1,378 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import time
+import threading
+from typing import Any, AsyncGenerator, Awaitable, AsyncIterator, Callable, Optional
+
+from app.metrics import registry, TOKEN_BUCKETS
+
+logger = logging.getLogger("app.services.llm_scheduler")
+
+# Upstream limits; set these to the provider account's quotas
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+LLM_COMPLETION_TOKEN_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKEN_ESTIMATE", "600"))
+
+# Retries on 429/5xx
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "20"))
+
+# Priority classes: lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch"}
+
+
+# Per-function upstream metrics for /metrics
+llm_upstream_seconds = registry.histogram(
+    "llm_upstream_duration_seconds", "Upstream model call duration per attempt", ("function",))
+llm_tokens = registry.counter(
+    "llm_tokens_total", "Tokens used by upstream model calls, as reported or estimated", ("function",))
+llm_call_tokens = registry.histogram(
+    "llm_call_tokens", "Tokens per successful upstream model call", ("function",), TOKEN_BUCKETS)
+llm_upstream_errors = registry.counter(
+    "llm_upstream_errors_total", "Failed upstream model call attempts", ("function",))
+llm_admission_wait_seconds = registry.histogram(
+    "llm_admission_wait_seconds", "Time queued in the scheduler before an upstream call", ("priority",))
+
+
+class UpstreamError(Exception):
+    """The upstream model could not produce an answer, after any retries."""
+
+
+def is_retryable(error: BaseException) -> bool:
+    # Providers raise ProviderError; an explicit retryable flag wins over the status code
+    retryable = getattr(error, "retryable", None)
+    if retryable is not None:
+        return retryable
+    status = getattr(error, "http_status", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def estimate_tokens(messages) -> int:
+    """Rough prompt size (about 4 characters per token) plus the expected completion."""
+    chars = sum(len(message.get("content") or "") for message in messages)
+    return chars // 4 + LLM_COMPLETION_TOKEN_ESTIMATE
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    return getattr(error, "retry_after", None)
+
+
+class TokenBucket:
+    """Continuously refilled bucket holding up to one minute of budget."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until amount can be taken; 0 if it can be taken now."""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill()
+        # A single request larger than the whole bucket waits for a full bucket
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        if self.capacity > 0:
+            self._refill()
+            self.level -= min(amount, self.capacity)
+
+    def credit(self, amount: float):
+        """Return (or, if negative, charge) the difference between an estimate and actual usage."""
+        if self.capacity > 0:
+            self._refill()
+            self.level = min(self.capacity, self.level + amount)
+
+
+class SchedulerMetrics:
+    """Queue depth, wait time and retry counters per priority class."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.peak_queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.admitted = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.wait_total = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.wait_max = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.wait_histograms = {name: llm_admission_wait_seconds.labels(name) for name in PRIORITY_NAMES.values()}
+
+    def record_enqueue(self, name: str):
+        with self._lock:
+            self.queued[name] += 1
+            self.peak_queued[name] = max(self.peak_queued[name], self.queued[name])
+
+    def record_dequeue(self, name: str, waited: float, admitted: bool):
+        with self._lock:
+            self.queued[name] -= 1
+            if admitted:
+                self.wait_histograms[name].observe(waited)
+                self.admitted[name] += 1
+                self.wait_total[name] += waited
+                self.wait_max[name] = max(self.wait_max[name], waited)
+
+    def record_retry(self, rate_limited: bool):
+        with self._lock:
+            self.retries += 1
+            self.rate_limited += rate_limited
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": dict(self.queued),
+                "peak_queue_depth": dict(self.peak_queued),
+                "admitted": dict(self.admitted),
+                "wait_avg_ms": {
+                    name: round(self.wait_total[name] / self.admitted[name] * 1000, 3) if self.admitted[name] else 0.0
+                    for name in self.admitted
+                },
+                "wait_max_ms": {name: round(value * 1000, 3) for name, value in self.wait_max.items()},
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "failures": self.failures,
+            }
+
+
+class LLMScheduler:
+    """
+    Central admission control for upstream model calls.
+
+    Backend-agnostic: failures are classified from the retryable,
+    http_status and retry_after attributes that ProviderError carries.
+
+    A call is admitted when a concurrency slot is free and both the
+    requests/min and tokens/min buckets can cover it. Waiting calls are
+    admitted strictly by priority class, then arrival order, so interactive
+    diagnostics overtake queued batch work. Retryable failures (429, 5xx,
+    timeouts) release the slot and are re-queued after a jittered
+    exponential backoff; a 429 also pauses admission for its Retry-After.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = LLM_TOKENS_PER_MINUTE,
+        max_retries: int = LLM_MAX_RETRIES,
+        base_delay: float = LLM_RETRY_BASE_DELAY,
+        max_delay: float = LLM_RETRY_MAX_DELAY
+    ):
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.metrics = SchedulerMetrics()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    async def _acquire(self, priority: int, tokens: int):
+        name = PRIORITY_NAMES[priority]
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future, tokens))
+        self.metrics.record_enqueue(name)
+        started = time.perf_counter()
+        admitted = False
+        try:
+            self._dispatch()
+            await future
+            admitted = True
+        except asyncio.CancelledError:
+            # Admitted in the same tick we were cancelled: hand the slot back
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        finally:
+            self.metrics.record_dequeue(name, time.perf_counter() - started, admitted)
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._waiters:
+            priority, _, future, tokens = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self.in_flight >= self.max_concurrency:
+                return
+            delay = max(
+                self.paused_until - time.monotonic(),
+                self.requests.delay(1),
+                self.tokens.delay(tokens)
+            )
+            if delay > 0:
+                self._wake_in(delay)
+                return
+            heapq.heappop(self._waiters)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _wake_in(self, delay: float):
+        loop = asyncio.get_running_loop()
+        when = loop.time() + delay
+        if self._wakeup is not None and not self._wakeup.cancelled() and self._wakeup.when() <= when:
+            return
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._wakeup = loop.call_at(when, self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
+
+    def _backoff(self, attempt: int, error: BaseException) -> float:
+        # Full jitter keeps retrying clients from synchronizing
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        return delay
+
+    async def _retry_or_raise(self, attempt: int, error: BaseException, label: str):
+        if not is_retryable(error) or attempt >= self.max_retries:
+            self.metrics.record_failure()
+            raise UpstreamError(f"{label} failed: {error}") from error
+        self.metrics.record_retry(getattr(error, "http_status", None) == 429)
+        delay = self._backoff(attempt, error)
+        logger.warning("%s attempt %d failed (%s); retrying in %.2fs", label, attempt + 1, error, delay)
+        await asyncio.sleep(delay)
+
+    async def complete(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        priority: int = PRIORITY_BATCH,
+        estimated_tokens: int = LLM_COMPLETION_TOKEN_ESTIMATE,
+        label: str = "completion"
+    ) -> Any:
+        """Run a non-streaming upstream call under the limits, retrying transient failures."""
+        duration, errors = llm_upstream_seconds.labels(label), llm_upstream_errors.labels(label)
+        attempt = 0
+        while True:
+            await self._acquire(priority, estimated_tokens)
+            started = time.perf_counter()
+            try:
+                response = await call()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+                errors.inc()
+            else:
+                used = getattr(response, "total_tokens", None) or estimated_tokens
+                self.tokens.credit(estimated_tokens - used)
+                self._record_tokens(label, used)
+                return response
+            finally:
+                duration.observe(time.perf_counter() - started)
+                self._release()
+            await self._retry_or_raise(attempt, error, label)
+            attempt += 1
+
+    async def stream(
+        self,
+        call: Callable[[], Awaitable[AsyncIterator[Any]]],
+        priority: int = PRIORITY_INTERACTIVE,
+        estimated_tokens: int = LLM_COMPLETION_TOKEN_ESTIMATE,
+        label: str = "stream"
+    ) -> AsyncGenerator[Any, None]:
+        """
+        Run a streaming upstream call under the limits and yield its chunks.
+
+        The slot is held until the stream ends. Opening the stream is
+        retried; once a chunk has been yielded a failure is raised as
+        UpstreamError, since the caller has already forwarded output.
+        """
+        duration, errors = llm_upstream_seconds.labels(label), llm_upstream_errors.labels(label)
+        prompt_tokens = max(estimated_tokens - LLM_COMPLETION_TOKEN_ESTIMATE, 0)
+        attempt = 0
+        while True:
+            await self._acquire(priority, estimated_tokens)
+            started = time.perf_counter()
+            received = 0
+            completed = False
+            response = None
+            try:
+                response = await call()
+                async for chunk in response:
+                    received += 1
+                    yield chunk
+                completed = True
+                return
+            except asyncio.CancelledError:
+                raise
+            except GeneratorExit:
+                raise
+            except Exception as e:
+                error = e
+                errors.inc()
+            finally:
+                if response is not None and not completed and hasattr(response, "aclose"):
+                    # Abandoned by the consumer: close the upstream connection now
+                    try:
+                        await response.aclose()
+                    except Exception as e:
+                        logger.debug("Error closing abandoned %s stream: %s", label, e)
+                # Streamed deltas are roughly one token each; the prompt share comes from the estimate
+                used = prompt_tokens + received
+                self.tokens.credit(estimated_tokens - used)
+                if completed:
+                    self._record_tokens(label, used)
+                elif received:
+                    llm_tokens.labels(label).inc(used)
+                duration.observe(time.perf_counter() - started)
+                self._release()
+            if received:
+                self.metrics.record_failure()
+                raise UpstreamError(f"{label} interrupted: {error}") from error
+            await self._retry_or_raise(attempt, error, label)
+            attempt += 1
+
+    @staticmethod
+    def _record_tokens(label: str, used: int):
+        llm_tokens.labels(label).inc(used)
+        llm_call_tokens.labels(label).observe(used)
+
+    def stats(self) -> dict:
+        data = self.metrics.snapshot()
+        data.update({
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "requests_available": round(self.requests.level, 1),
+            "tokens_available": round(self.tokens.level, 1),
+            "paused_ms": max(0.0, round((self.paused_until - time.monotonic()) * 1000, 1)),
+        })
+        return data
+
+
+llm_scheduler = LLMScheduler()
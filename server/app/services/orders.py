@@ -0,0 +1,313 @@
+import asyncio
+import os
+import uuid
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import delete, func, insert, or_, select, update
+
+from app.database import AsyncSessionLocal
+from app.metrics import registry
+from app.models import Session as DiagnosticSession, DiagnosticResult, PartPrediction, RepairNote, RepairSummary
+from app.services.ai_service import (
+    predict_parts, stream_parts, generate_repair_summary, parts_input_hash, summary_input_hash
+)
+from app.services.connections import connection_manager
+from app.services.diagnostic_results import STATUS_COMPLETE
+from app.services.similar_cases import similar_cases
+from app.services.single_flight import SingleFlight
+
+# Parts prediction and repair summaries, shared by the HTTP endpoints and the job queue.
+# DB sessions are opened per step and never held across the LLM round trip.
+
+# Stream predicted parts to the user's clients one by one as the model produces them
+PARTS_STREAMING = os.getenv("PARTS_STREAMING", "1") == "1"
+# Streamed parts are inserted in batches of this many rows
+PARTS_INSERT_BATCH = int(os.getenv("PARTS_INSERT_BATCH", "5"))
+# input_hash of streamed batches until the whole prediction is stored
+PENDING_PARTS_PREFIX = "pending:"
+
+# Stored results are keyed by a hash of their prompt; repeat calls are served from the table
+memoized_lookups = registry.counter(
+    "order_results_memoized_total", "Parts and summary requests by whether the stored result was reused",
+    ("kind", "outcome"))
+result_flights = SingleFlight()
+
+
+async def _load_diagnostic_result(db, user_id: int, session_id: int) -> DiagnosticResult:
+    result = await db.execute(
+        select(DiagnosticSession.id).where(
+            DiagnosticSession.id == session_id,
+            DiagnosticSession.user_id == user_id
+        )
+    )
+    if result.scalar() is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    result = await db.execute(
+        select(DiagnosticResult).where(
+            DiagnosticResult.session_id == session_id,
+            DiagnosticResult.status == STATUS_COMPLETE
+        )
+    )
+    diagnostic_result = result.scalars().first()
+
+    if not diagnostic_result:
+        raise HTTPException(status_code=404, detail="Diagnostic result not found")
+    return diagnostic_result
+
+
+# Excludes batches of a prediction that is still streaming
+_stored_part = or_(PartPrediction.input_hash.is_(None), ~PartPrediction.input_hash.startswith(PENDING_PARTS_PREFIX))
+
+
+async def _parts_inputs(db, user_id: int, session_id: int):
+    diagnostic_result = await _load_diagnostic_result(db, user_id, session_id)
+    return diagnostic_result, parts_input_hash(diagnostic_result.output_text)
+
+
+async def _summary_inputs(db, user_id: int, session_id: int, notes: Optional[str]):
+    diagnostic_result = await _load_diagnostic_result(db, user_id, session_id)
+    result = await db.execute(
+        select(PartPrediction.part_name)
+        .where(PartPrediction.session_id == session_id, _stored_part)
+        .order_by(PartPrediction.id)
+    )
+    parts_list = list(result.scalars().all())
+    return diagnostic_result, parts_list, summary_input_hash(diagnostic_result.output_text, parts_list, notes)
+
+
+async def parts_input_hash_for(user_id: int, session_id: int) -> str:
+    """Hash of the inputs a parts prediction for the session would be generated from now."""
+    async with AsyncSessionLocal() as db:
+        return (await _parts_inputs(db, user_id, session_id))[1]
+
+
+async def summary_input_hash_for(user_id: int, session_id: int, notes: Optional[str] = None) -> str:
+    """Hash of the inputs a repair summary for the session would be generated from now."""
+    async with AsyncSessionLocal() as db:
+        return (await _summary_inputs(db, user_id, session_id, notes))[2]
+
+
+def _part_dict(row: PartPrediction) -> Dict[str, Any]:
+    return {
+        "name": row.part_name,
+        "confidence": row.confidence_score,
+        "price": row.price_estimate,
+        "id": row.id
+    }
+
+
+def _summary_dict(row: RepairSummary) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "session_id": row.session_id,
+        "summary_text": row.summary_text,
+        "created_at": row.created_at
+    }
+
+
+async def _upsert_parts(db, session_id: int, parts: List[Dict[str, Any]], input_hash: str,
+                        update_existing: bool = True):
+    """
+    Upsert predicted parts and give each part its row id.
+
+    A part the session already has (by name) keeps its row, and with it
+    its id and selection; the rest are inserted with one statement.
+    """
+    result = await db.execute(
+        select(PartPrediction.part_name, func.min(PartPrediction.id))
+        .where(
+            PartPrediction.session_id == session_id,
+            PartPrediction.part_name.in_([part["name"] for part in parts])
+        )
+        .group_by(PartPrediction.part_name)
+    )
+    existing = dict(result.all())
+
+    updates, new_parts = [], []
+    for part in parts:
+        values = {
+            "session_id": session_id,
+            "part_name": part["name"],
+            "confidence_score": part["confidence"],
+            "price_estimate": part["price"],
+            "input_hash": input_hash
+        }
+        if part["name"] in existing:
+            part["id"] = values["id"] = existing[part["name"]]
+            updates.append(values)
+        else:
+            new_parts.append((part, values))
+
+    if updates and update_existing:
+        await db.execute(update(PartPrediction), updates)
+    if new_parts:
+        result = await db.execute(
+            insert(PartPrediction).returning(PartPrediction.id, sort_by_parameter_order=True),
+            [values for _, values in new_parts]
+        )
+        for (part, _), part_id in zip(new_parts, result.scalars().all()):
+            part["id"] = part_id
+
+
+async def _save_pending_parts(session_id: int, parts: List[Dict[str, Any]], marker: str):
+    """Insert a streamed batch under a pending marker; the session's stored parts are left as they are."""
+    async with AsyncSessionLocal() as db:
+        await _upsert_parts(db, session_id, parts, marker, update_existing=False)
+        await db.commit()
+
+
+async def _finish_parts(session_id: int, parts: List[Dict[str, Any]], input_hash: str):
+    """Store the full prediction under its input hash and drop every other part of the session, in one transaction."""
+    async with AsyncSessionLocal() as db:
+        await _upsert_parts(db, session_id, parts, input_hash)
+        await db.execute(
+            delete(PartPrediction).where(
+                PartPrediction.session_id == session_id,
+                PartPrediction.id.notin_([part["id"] for part in parts])
+            )
+        )
+        await db.commit()
+
+
+async def _discard_pending_parts(session_id: int, marker: str):
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            delete(PartPrediction).where(PartPrediction.session_id == session_id, PartPrediction.input_hash == marker)
+        )
+        await db.commit()
+
+
+async def predict_session_parts(user_id: int, session_id: int, force: bool = False) -> List[Dict[str, Any]]:
+    """
+    Predict parts for a session's diagnostic, persist them and push them to the user's clients.
+
+    A prediction for the same prompt is served from the stored rows unless force is set.
+    """
+    async with AsyncSessionLocal() as db:
+        diagnostic_result, input_hash = await _parts_inputs(db, user_id, session_id)
+
+        if not force:
+            result = await db.execute(
+                select(PartPrediction)
+                .where(PartPrediction.session_id == session_id, PartPrediction.input_hash == input_hash)
+                .order_by(PartPrediction.id)
+            )
+            stored = result.scalars().all()
+            if stored:
+                memoized_lookups.labels("predict_parts", "hit").inc()
+                return [_part_dict(row) for row in stored]
+
+    memoized_lookups.labels("predict_parts", "forced" if force else "miss").inc()
+    # Concurrent identical requests in this worker share one prediction
+    return await result_flights.do(
+        f"predict_parts:{session_id}:{input_hash}",
+        lambda: _predict_and_save_parts(user_id, session_id, diagnostic_result.output_text, input_hash)
+    )
+
+
+async def _predict_and_save_parts(user_id: int, session_id: int, diagnostic_text: str,
+                                  input_hash: str) -> List[Dict[str, Any]]:
+    # Streamed batches are marked pending, so a lookup never takes a partial list for a stored one
+    marker = f"{PENDING_PARTS_PREFIX}{uuid.uuid4().hex}"
+    try:
+        if not PARTS_STREAMING:
+            parts = await predict_parts(diagnostic_text)
+        else:
+            # Each part is pushed as soon as it has streamed in and saved in batches;
+            # until its batch is written it carries the model's id rather than a row id
+            parts, pending = [], []
+            async for part in stream_parts(diagnostic_text):
+                await connection_manager.send_to_user(user_id, {
+                    "type": "part",
+                    "session_id": session_id,
+                    "index": len(parts),
+                    "part": dict(part)
+                })
+                parts.append(part)
+                pending.append(part)
+                if len(pending) >= PARTS_INSERT_BATCH:
+                    await _save_pending_parts(session_id, pending, marker)
+                    pending = []
+        if parts:
+            await _finish_parts(session_id, parts, input_hash)
+    except BaseException:
+        # The session keeps the parts it had before this prediction
+        await asyncio.shield(_discard_pending_parts(session_id, marker))
+        raise
+    if parts:
+        similar_cases.refresh_session(session_id)
+
+    await connection_manager.send_to_user(user_id, {
+        "type": "parts",
+        "session_id": session_id,
+        "parts": parts
+    })
+
+    return parts
+
+
+async def summarize_session_order(user_id: int, session_id: int, notes: Optional[str] = None,
+                                  force: bool = False) -> Dict[str, Any]:
+    """
+    Generate and persist a repair summary for a session and push it to the user's clients.
+
+    A summary of the same diagnostic, parts and notes is served from its stored
+    row unless force is set, in which case that row is regenerated in place.
+    """
+    async with AsyncSessionLocal() as db:
+        diagnostic_result, parts_list, input_hash = await _summary_inputs(db, user_id, session_id, notes)
+
+        result = await db.execute(
+            select(RepairSummary)
+            .where(RepairSummary.session_id == session_id, RepairSummary.input_hash == input_hash)
+            .order_by(RepairSummary.id.desc())
+        )
+        stored = result.scalars().first()
+        if stored is not None and not force:
+            memoized_lookups.labels("summarize_order", "hit").inc()
+            return _summary_dict(stored)
+
+        # Save notes if provided and not already on the session
+        if notes:
+            result = await db.execute(
+                select(RepairNote.id).where(RepairNote.session_id == session_id, RepairNote.note_text == notes)
+            )
+            if result.first() is None:
+                db.add(RepairNote(session_id=session_id, note_text=notes))
+                await db.commit()
+
+    memoized_lookups.labels("summarize_order", "forced" if force else "miss").inc()
+    return await result_flights.do(
+        f"summarize_order:{session_id}:{input_hash}",
+        lambda: _summarize_and_save(
+            user_id, session_id, diagnostic_result.output_text, parts_list, notes, input_hash,
+            stored.id if stored is not None else None
+        )
+    )
+
+
+async def _summarize_and_save(user_id: int, session_id: int, diagnostic_text: str, parts_list: List[str],
+                              notes: Optional[str], input_hash: str, summary_id: Optional[int]) -> Dict[str, Any]:
+    # Generate summary
+    summary_text = await generate_repair_summary(diagnostic_text, parts_list, notes)
+
+    # Save summary, replacing the stored one for these inputs when regenerating
+    async with AsyncSessionLocal() as db:
+        summary = await db.get(RepairSummary, summary_id) if summary_id is not None else None
+        if summary is None:
+            summary = RepairSummary(session_id=session_id, input_hash=input_hash)
+            db.add(summary)
+        summary.summary_text = summary_text
+        await db.commit()
+        await db.refresh(summary)
+
+    await connection_manager.send_to_user(user_id, {
+        "type": "summary",
+        "session_id": session_id,
+        "summary_id": summary.id,
+        "summary_text": summary.summary_text
+    })
+
+    return _summary_dict(summary)
@@ -0,0 +1,127 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class PartsArrayParser:
+    """
+    Picks complete part objects out of a JSON answer while it is still streaming.
+
+    Accepts {"parts": [...]} (JSON mode) or a bare array, with or without a
+    Markdown code fence around it. Every character is scanned once, chunk
+    by chunk, tracking string/escape state and nesting depth, and each
+    object directly inside the parts array is decoded as soon as its
+    closing brace arrives. Only the pieces of the object (or key) still
+    open are carried between chunks; the full answer is joined on demand.
+    Objects that do not decode are kept in `malformed` for the repair pass.
+    """
+
+    def __init__(self):
+        self.malformed: List[str] = []
+        # The parts array has been opened / closed
+        self.found = False
+        self.closed = False
+        self._chunks: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        # Last key read in the top-level object, to find "parts" among other keys
+        self._key: Optional[str] = None
+        self._array_depth: Optional[int] = None
+        # Pieces of the key or object still open, and where it starts in the current chunk
+        self._key_pieces: Optional[List[str]] = None
+        self._key_start = 0
+        self._object_pieces: Optional[List[str]] = None
+        self._object_start = 0
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Add streamed text; returns the objects it completed."""
+        self._chunks.append(chunk)
+        completed = []
+        for pos, char in enumerate(chunk):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._key_pieces is not None:
+                        self._key = "".join(self._key_pieces) + chunk[self._key_start:pos]
+                        self._key_pieces = None
+                continue
+            if self.closed:
+                break
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._array_depth is None:
+                    self._key_pieces = []
+                    self._key_start = pos + 1
+            elif char in "{[":
+                if self._array_depth is None and char == "[" and (
+                        self._depth == 0 or (self._depth == 1 and self._key == "parts")):
+                    self._array_depth = self._depth + 1
+                    self.found = True
+                elif self._depth == self._array_depth and char == "{":
+                    self._object_pieces = []
+                    self._object_start = pos
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == self._array_depth and self._object_pieces is not None:
+                    completed.extend(self._decode("".join(self._object_pieces) + chunk[self._object_start:pos + 1]))
+                    self._object_pieces = None
+                elif self._array_depth is not None and self._depth == self._array_depth - 1:
+                    self.closed = True
+        # Whatever is still open continues into the next chunk
+        if self._key_pieces is not None:
+            self._key_pieces.append(chunk[self._key_start:])
+            self._key_start = 0
+        if self._object_pieces is not None:
+            self._object_pieces.append(chunk[self._object_start:])
+            self._object_start = 0
+        return completed
+
+    def _decode(self, raw: str) -> List[Any]:
+        try:
+            return [json.loads(raw)]
+        except ValueError:
+            self.malformed.append(raw)
+            return []
+
+    @property
+    def unfinished(self) -> str:
+        """Text of an object that was cut off when the stream ended."""
+        return "".join(self._object_pieces) if self._object_pieces is not None else ""
+
+
+def validate_part(item: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Check one predicted part against the schema. Returns (part, None) or (None, reason)."""
+    if not isinstance(item, dict):
+        return None, "expected an object"
+    name = item.get("name")
+    if not isinstance(name, str) or not name.strip():
+        return None, "name must be a non-empty string"
+    confidence = item.get("confidence")
+    if isinstance(confidence, str):
+        try:
+            confidence = float(confidence)
+        except ValueError:
+            pass
+    if isinstance(confidence, bool) or not isinstance(confidence, (int, float)) or not 0 <= confidence <= 1:
+        return None, "confidence must be a number between 0 and 1"
+    price = item.get("price")
+    if isinstance(price, (int, float)) and not isinstance(price, bool):
+        price = f"${price}"
+    if not isinstance(price, str) or not price.strip():
+        return None, "price must be a string with a price range"
+    part = {"name": name.strip(), "confidence": float(confidence), "price": price.strip()}
+    if item.get("id") is not None:
+        part["id"] = str(item["id"])
+    return part, None
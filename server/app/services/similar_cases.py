@@ -0,0 +1,801 @@
+"""
+Similar past cases, retrieved in-process with no network.
+
+Every completed diagnostic result is a case: its input, the session's
+predicted part names and the start of its output. Cases are turned into
+vectors locally. Tokens, word pairs and OBD codes (plus their code
+family) are hashed into a fixed feature space and weighted by TF-IDF.
+The weighted features are then projected onto a few hundred dimensions
+by a fixed random sign hash and L2-normalized, so a dot product is the
+cosine similarity.
+
+The index has two segments:
+
+- base: built offline, a float32 matrix in a .npy file that is
+  memory-mapped. Large bases are split into clusters by spherical
+  k-means and stored sorted by cluster, so a query scores the centroids
+  and then scans only the nearest SIMILAR_PROBES contiguous slices.
+  Small bases are scanned whole.
+- delta: results saved since the base was built, kept in memory and
+  scanned whole. The diagnostic socket adds each result as it completes,
+  and part predictions refresh their session's cases. Results written
+  by other workers are picked up by reading rows newer than the last one
+  seen, at most every SIMILAR_REFRESH_INTERVAL seconds.
+
+Queries are batched: any number of query vectors are scored against each
+slice with one matrix product. The base is (re)built in the background
+on first use when missing, or ahead of time with:
+
+    python -m app.services.similar_cases
+"""
+import asyncio
+import contextlib
+import fcntl
+import functools
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import time
+import zlib
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+
+from app.database import AsyncSessionLocal, SessionLocal
+from app.metrics import registry
+from app.models import DiagnosticResult, PartPrediction, Session as DiagnosticSession
+from app.services.diagnostic_cache import extract_obd_codes
+from app.services.diagnostic_results import STATUS_COMPLETE, STATUS_STREAMING
+from app.services.dtc_index import DATA_DIR
+
+logger = logging.getLogger("app.services.similar_cases")
+
+SIMILAR_CASES_ENABLED = os.getenv("SIMILAR_CASES_ENABLED", "1") == "1"
+SIMILAR_INDEX_DIR = os.getenv("SIMILAR_INDEX_DIR", os.path.join(DATA_DIR, "similar"))
+# Build the base in the background when none exists yet
+SIMILAR_AUTO_BUILD = os.getenv("SIMILAR_AUTO_BUILD", "1") == "1"
+SIMILAR_DIMENSIONS = int(os.getenv("SIMILAR_DIMENSIONS", "256"))
+# Cases returned per query, and the least cosine similarity worth showing
+SIMILAR_TOP_K = int(os.getenv("SIMILAR_TOP_K", "5"))
+SIMILAR_MIN_SCORE = float(os.getenv("SIMILAR_MIN_SCORE", "0.1"))
+# Clusters scanned per query; bases up to SIMILAR_EXACT_MAX_ROWS rows are scanned whole
+SIMILAR_PROBES = int(os.getenv("SIMILAR_PROBES", "8"))
+SIMILAR_EXACT_MAX_ROWS = int(os.getenv("SIMILAR_EXACT_MAX_ROWS", "20000"))
+SIMILAR_REFRESH_INTERVAL = float(os.getenv("SIMILAR_REFRESH_INTERVAL", "5"))
+# "user": only the asking user's sessions; "all": every session on the server
+SIMILAR_SCOPE = os.getenv("SIMILAR_SCOPE", "user")
+# Cases added to the diagnostic prompt as grounding (0 disables)
+SIMILAR_PROMPT_CASES = int(os.getenv("SIMILAR_PROMPT_CASES", "3"))
+
+SCOPES = ("user", "all")
+
+# Hashed feature space (IDF is kept per feature) and the fixed projection from it
+FEATURE_BITS = 18
+FEATURE_SPACE = 1 << FEATURE_BITS
+PROJECTION_SEED = 20240611
+# Characters of the diagnostic output that go into a case; its opening names the likely causes
+OUTPUT_CHARS = 1000
+# Relative weight of each part of a case; diagnoses share a lot of boilerplate, so the output counts least
+FIELD_WEIGHTS = {"input": 2.0, "parts": 1.5, "output": 0.25}
+CODE_WEIGHT = 3.0
+
+SCAN_CHUNK_ROWS = 65536
+BUILD_BATCH_ROWS = 1000
+KMEANS_ITERATIONS = 8
+
+_WORDS = re.compile(r"[a-z0-9]+")
+_SUFFIXES = ("ing", "ed", "es", "s")
+STOPWORDS = frozenset(
+    "a an and are as at be but by can car for from has have i if in is it its my of on or so "
+    "that the there this to was when while with".split()
+)
+
+similar_search_seconds = registry.histogram(
+    "similar_case_search_seconds", "Time to vectorize a query and find its nearest cases",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+
+
+def _hash(token: str) -> int:
+    return zlib.crc32(token.encode("utf-8")) & (FEATURE_SPACE - 1)
+
+
+def _stem(word: str) -> str:
+    """Strip one common suffix, so "squealing", "squeals" and "squeal" share a feature."""
+    if len(word) > 4 and not word[-1].isdigit():
+        for suffix in _SUFFIXES:
+            if word.endswith(suffix) and not word.endswith("ss"):
+                return word[:-len(suffix)]
+    return word
+
+
+def extract_features(text: str) -> Counter:
+    """Hashed feature counts: words, adjacent word pairs, OBD codes and code families."""
+    counts = Counter()
+    if not text:
+        return counts
+    words = [_stem(word) for word in _WORDS.findall(text.lower()) if word not in STOPWORDS and len(word) > 1]
+    for word in words:
+        counts[_hash(word)] += 1
+    for first, second in zip(words, words[1:]):
+        counts[_hash(first + " " + second)] += 1
+    for code in extract_obd_codes(text):
+        # The code itself, and its family (P042x), so related codes still match
+        counts[_hash("code:" + code)] += CODE_WEIGHT
+        counts[_hash("family:" + code[:4])] += 1
+    return counts
+
+
+class HashingVectorizer:
+    """TF-IDF over hashed features, projected to `dimensions` and L2-normalized."""
+
+    def __init__(self, dimensions: int = SIMILAR_DIMENSIONS, idf: Optional[np.ndarray] = None):
+        self.dimensions = dimensions
+        self.idf = idf if idf is not None else np.ones(FEATURE_SPACE, dtype=np.float32)
+        rng = np.random.default_rng(PROJECTION_SEED)
+        self._bucket = rng.integers(0, dimensions, FEATURE_SPACE, dtype=np.int32)
+        self._sign = rng.choice(np.array([-1.0, 1.0], dtype=np.float32), FEATURE_SPACE)
+
+    @staticmethod
+    def fit_idf(document_frequencies: np.ndarray, documents: int) -> np.ndarray:
+        return (np.log((1.0 + documents) / (1.0 + document_frequencies)) + 1.0).astype(np.float32)
+
+    def transform(self, fields: Iterable[Tuple[Counter, float]]) -> Optional[np.ndarray]:
+        """One vector from weighted feature counts, or None if there are no features."""
+        weights: Dict[int, float] = {}
+        for counts, field_weight in fields:
+            for feature, count in counts.items():
+                weights[feature] = weights.get(feature, 0.0) + (1.0 + math.log(count)) * field_weight
+        if not weights:
+            return None
+        features = np.fromiter(weights.keys(), dtype=np.int64, count=len(weights))
+        values = np.fromiter(weights.values(), dtype=np.float32, count=len(weights)) * self.idf[features]
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        np.add.at(vector, self._bucket[features], self._sign[features] * values)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else None
+
+    def query(self, text: str) -> Optional[np.ndarray]:
+        return self.transform([(extract_features(text), FIELD_WEIGHTS["input"])])
+
+
+class Case:
+    """The text of one completed result, as read from the database."""
+
+    __slots__ = ("result_id", "session_id", "user_id", "input_message", "output_text", "parts")
+
+    def __init__(self, result_id: int, session_id: int, user_id: int, input_message: Optional[str],
+                 output_text: Optional[str], parts: Sequence[str] = ()):
+        self.result_id = result_id
+        self.session_id = session_id
+        self.user_id = user_id
+        self.input_message = input_message or ""
+        self.output_text = output_text or ""
+        self.parts = list(parts)
+
+    def fields(self) -> List[Tuple[Counter, float]]:
+        return [
+            (extract_features(self.input_message), FIELD_WEIGHTS["input"]),
+            (extract_features("\n".join(self.parts)), FIELD_WEIGHTS["parts"]),
+            (extract_features(self.output_text), FIELD_WEIGHTS["output"]),
+        ]
+
+
+def _case_query():
+    return (
+        select(
+            DiagnosticResult.id,
+            DiagnosticResult.session_id,
+            DiagnosticSession.user_id,
+            DiagnosticResult.input_message,
+            func.substr(DiagnosticResult.output_text, 1, OUTPUT_CHARS).label("output_text"),
+        )
+        .join(DiagnosticSession, DiagnosticSession.id == DiagnosticResult.session_id)
+        .where(func.coalesce(DiagnosticResult.status, STATUS_COMPLETE) == STATUS_COMPLETE)
+    )
+
+
+def _parts_query(session_ids: Iterable[int]):
+    return (
+        select(PartPrediction.session_id, PartPrediction.part_name)
+        .where(PartPrediction.session_id.in_(set(session_ids)))
+        .order_by(PartPrediction.id)
+    )
+
+
+def _cases_from_rows(rows, part_rows) -> List[Case]:
+    parts: Dict[int, List[str]] = {}
+    for session_id, part_name in part_rows:
+        parts.setdefault(session_id, []).append(part_name)
+    return [Case(row.id, row.session_id, row.user_id, row.input_message, row.output_text,
+                 parts.get(row.session_id, ())) for row in rows]
+
+
+def snapshot_results() -> Tuple[int, List[int]]:
+    """Highest result id, and the results up to it that are still streaming."""
+    with SessionLocal() as db:
+        last_id = db.execute(select(func.max(DiagnosticResult.id))).scalar() or 0
+        streaming = db.execute(
+            select(DiagnosticResult.id).where(DiagnosticResult.id <= last_id,
+                                              DiagnosticResult.status == STATUS_STREAMING)
+        ).scalars().all()
+    return last_id, list(streaming)
+
+
+def iter_all_cases(batch: int = BUILD_BATCH_ROWS, max_id: Optional[int] = None) -> Iterator[Case]:
+    """Every completed result in id order (up to max_id), read in batches on the sync engine."""
+    last_id = 0
+    with SessionLocal() as db:
+        while True:
+            condition = DiagnosticResult.id > last_id
+            if max_id is not None:
+                condition = condition & (DiagnosticResult.id <= max_id)
+            rows = db.execute(
+                _case_query().where(condition).order_by(DiagnosticResult.id).limit(batch)
+            ).all()
+            if not rows:
+                return
+            part_rows = db.execute(_parts_query(row.session_id for row in rows)).all()
+            yield from _cases_from_rows(rows, part_rows)
+            last_id = rows[-1].id
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, best first."""
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def _mask(scores: np.ndarray, user_ids: np.ndarray, user_id: Optional[int],
+          session_ids: np.ndarray, exclude_sessions: Sequence[int]):
+    """Rule out rows of other users and of excluded sessions, in place."""
+    if user_id is not None:
+        scores[user_ids != user_id] = -np.inf
+    if len(exclude_sessions):
+        scores[np.isin(session_ids, exclude_sessions)] = -np.inf
+
+
+def _merge(parts: List[Tuple[np.ndarray, np.ndarray]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """The k best of several (positions, scores) candidate lists, ruled-out rows dropped."""
+    if not parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    positions = np.concatenate([p for p, _ in parts])
+    scores = np.concatenate([s for _, s in parts])
+    best = _top_k(scores, k)
+    best = best[np.isfinite(scores[best])]
+    return positions[best], scores[best]
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), SCAN_CHUNK_ROWS):
+        chunk = np.asarray(vectors[start:start + SCAN_CHUNK_ROWS])
+        assignment[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignment
+
+
+def train_centroids(vectors: np.ndarray, clusters: int, seed: int = 0,
+                    iterations: int = KMEANS_ITERATIONS) -> np.ndarray:
+    """Spherical k-means on a sample of the rows."""
+    rng = np.random.default_rng(seed)
+    size = min(len(vectors), max(clusters * 40, 10000))
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), size, replace=False))])
+    centroids = sample[rng.choice(size, clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        counts = np.bincount(assignment, minlength=clusters)
+        order = np.argsort(assignment, kind="stable")
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        centroids[filled] = np.add.reduceat(sample[order], starts, axis=0)
+        # Reseed clusters that lost all their rows
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(size, len(empty), replace=False)]
+        centroids = _normalize_rows(centroids)
+    return centroids.astype(np.float32)
+
+
+class BaseSegment:
+    """Read-only, memory-mapped segment written by build_index."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            self.meta = json.load(meta_file)
+        self.path = path
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.result_ids = np.load(os.path.join(path, "result_ids.npy"))
+        self.session_ids = np.load(os.path.join(path, "session_ids.npy"))
+        self.user_ids = np.load(os.path.join(path, "user_ids.npy"))
+        self.centroids = np.load(os.path.join(path, "centroids.npy"))
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.idf = np.load(os.path.join(path, "idf.npy"))
+        self.last_id = int(self.meta["last_id"])
+        # Results up to last_id that were still streaming when the segment was built
+        self.pending = set(self.meta.get("pending", ()))
+
+    def __len__(self) -> int:
+        return len(self.result_ids)
+
+    def search(self, queries: np.ndarray, k: int, probes: int = SIMILAR_PROBES, user_id: Optional[int] = None,
+               exclude_sessions: Sequence[int] = ()) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Per query, (row positions, scores) of its k best rows among the probed clusters."""
+        candidates: List[List[Tuple[np.ndarray, np.ndarray]]] = [[] for _ in range(len(queries))]
+        clusters = len(self.centroids)
+        if clusters <= 1:
+            slices = {0: list(range(len(queries)))}
+        else:
+            # Every query picks its nearest clusters; each picked cluster is scored once for all its queries
+            nearest = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :min(probes, clusters)]
+            slices: Dict[int, List[int]] = {}
+            for query, picks in enumerate(nearest):
+                for cluster in picks:
+                    slices.setdefault(int(cluster), []).append(query)
+        for cluster, members in slices.items():
+            begin, end = int(self.offsets[cluster]), int(self.offsets[cluster + 1])
+            for start in range(begin, end, SCAN_CHUNK_ROWS):
+                stop = min(start + SCAN_CHUNK_ROWS, end)
+                scores = np.asarray(self.vectors[start:stop]) @ queries[members].T
+                _mask(scores, self.user_ids[start:stop], user_id, self.session_ids[start:stop], exclude_sessions)
+                for column, query in enumerate(members):
+                    best = _top_k(scores[:, column], k)
+                    candidates[query].append((best + start, scores[best, column]))
+        return [_merge(parts, k) for parts in candidates]
+
+
+class DeltaSegment:
+    """Cases added since the base was built, in a growable in-memory matrix."""
+
+    def __init__(self, dimensions: int):
+        self.vectors = np.zeros((0, dimensions), dtype=np.float32)
+        self.count = 0
+        self.result_ids: List[int] = []
+        self.session_ids: List[int] = []
+        self.user_ids: List[int] = []
+        self.positions: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def put(self, case: Case, vector: np.ndarray):
+        position = self.positions.get(case.result_id)
+        if position is None:
+            if self.count == len(self.vectors):
+                grown = np.zeros((max(64, 2 * len(self.vectors)), self.vectors.shape[1]), dtype=np.float32)
+                grown[:self.count] = self.vectors[:self.count]
+                self.vectors = grown
+            position = self.count
+            self.count += 1
+            self.positions[case.result_id] = position
+            self.result_ids.append(case.result_id)
+            self.session_ids.append(case.session_id)
+            self.user_ids.append(case.user_id)
+        self.vectors[position] = vector
+
+    def search(self, queries: np.ndarray, k: int, user_id: Optional[int] = None,
+               exclude_sessions: Sequence[int] = ()) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Per query, (row positions, scores) of its k best rows, by exact scan."""
+        scores = self.vectors[:self.count] @ queries.T
+        _mask(scores, np.asarray(self.user_ids), user_id, np.asarray(self.session_ids), exclude_sessions)
+        results = []
+        for column in scores.T:
+            best = _top_k(column, k)
+            best = best[np.isfinite(column[best])]
+            results.append((best, column[best]))
+        return results
+
+
+@contextlib.contextmanager
+def _build_lock(directory: str):
+    """Hold the directory's build lock, so workers sharing it build one version at a time."""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "build.lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _versions(directory: str) -> Dict[int, str]:
+    """Version directories by their number, in which newer versions sort higher."""
+    versions = {}
+    for name in os.listdir(directory):
+        match = re.fullmatch(r"base-(\d+)", name)
+        if match:
+            versions[int(match.group(1))] = name
+    return versions
+
+
+def _new_version(directory: str) -> str:
+    # Called under the build lock, so numbers only grow even if the clock steps back
+    number = max([int(time.time() * 1000)] + [existing + 1 for existing in _versions(directory)])
+    version = os.path.join(directory, f"base-{number}")
+    os.makedirs(version)
+    return version
+
+
+def _make_current(directory: str, version: str):
+    # Point CURRENT at the new version in one rename; open maps of older versions stay valid
+    pointer = os.path.join(directory, "CURRENT")
+    with open(pointer + ".tmp", "w") as pointer_file:
+        pointer_file.write(os.path.basename(version))
+    os.replace(pointer + ".tmp", pointer)
+    current = int(os.path.basename(version)[len("base-"):])
+    for number, name in _versions(directory).items():
+        if number < current:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def _write_version(version: str, unsorted: np.ndarray, result_ids: Sequence[int], session_ids: Sequence[int],
+                   user_ids: Sequence[int], idf: np.ndarray, exact_max_rows: int,
+                   last_id: Optional[int] = None, pending: Sequence[int] = ()):
+    """Cluster the rows if there are many, and save them sorted by cluster with their ids."""
+    rows, dimensions = len(result_ids), unsorted.shape[1]
+    clusters = 1 if rows <= exact_max_rows else max(2, int(math.sqrt(rows)))
+    if clusters > 1:
+        centroids = train_centroids(unsorted[:rows], clusters)
+        assignment = _assign(unsorted[:rows], centroids)
+    else:
+        centroids = np.zeros((1, dimensions), dtype=np.float32)
+        assignment = np.zeros(rows, dtype=np.int32)
+    order = np.argsort(assignment, kind="stable")
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=clusters)))).astype(np.int64)
+
+    vectors = np.lib.format.open_memmap(os.path.join(version, "vectors.npy"), mode="w+",
+                                        dtype=np.float32, shape=(rows, dimensions))
+    for start in range(0, rows, SCAN_CHUNK_ROWS):
+        # Read each chunk in file order, then put it back in cluster order
+        chunk = order[start:start + SCAN_CHUNK_ROWS]
+        ascending = np.argsort(chunk)
+        block = np.empty((len(chunk), dimensions), dtype=np.float32)
+        block[ascending] = unsorted[chunk[ascending]]
+        vectors[start:start + len(chunk)] = block
+    vectors.flush()
+    del vectors
+
+    np.save(os.path.join(version, "result_ids.npy"), np.asarray(result_ids, dtype=np.int64)[order])
+    np.save(os.path.join(version, "session_ids.npy"), np.asarray(session_ids, dtype=np.int64)[order])
+    np.save(os.path.join(version, "user_ids.npy"), np.asarray(user_ids, dtype=np.int64)[order])
+    np.save(os.path.join(version, "centroids.npy"), centroids)
+    np.save(os.path.join(version, "offsets.npy"), offsets)
+    np.save(os.path.join(version, "idf.npy"), idf)
+    with open(os.path.join(version, "meta.json"), "w") as meta_file:
+        json.dump({
+            "rows": rows,
+            "dimensions": dimensions,
+            "clusters": clusters,
+            "last_id": int(last_id if last_id is not None else max(result_ids, default=0)),
+            "pending": sorted(int(result_id) for result_id in pending),
+            "built_at": time.time(),
+        }, meta_file)
+
+
+def build_index(directory: str = SIMILAR_INDEX_DIR, dimensions: int = SIMILAR_DIMENSIONS,
+                cases: Optional[Callable[[], Iterable[Case]]] = None,
+                exact_max_rows: int = SIMILAR_EXACT_MAX_ROWS, if_missing: bool = False) -> str:
+    """
+    Build a base segment from every completed result and make it current. Returns its path.
+
+    Two passes over cases(): document frequencies first, then vectors
+    written straight to a memory-mapped file, which is then clustered
+    and rewritten sorted by cluster. By default the cases are the results
+    up to the current highest id; the ones still streaming then are
+    recorded, so whoever loads the segment picks them up once final.
+
+    Builds into one directory take turns. With if_missing, a readable
+    current base of the same dimensions (e.g. one another worker built
+    while this one waited) is returned instead of building again.
+    """
+    with _build_lock(directory):
+        if if_missing:
+            try:
+                base = load_base(directory)
+            except (OSError, ValueError, KeyError):
+                base = None
+            if base is not None and base.meta["dimensions"] == dimensions:
+                return base.path
+        return _build_version(directory, dimensions, cases, exact_max_rows)
+
+
+def _build_version(directory: str, dimensions: int, cases: Optional[Callable[[], Iterable[Case]]],
+                   exact_max_rows: int) -> str:
+    last_id, pending = None, ()
+    if cases is None:
+        last_id, pending = snapshot_results()
+        cases = functools.partial(iter_all_cases, max_id=last_id)
+    version = _new_version(directory)
+    try:
+        frequencies = np.zeros(FEATURE_SPACE, dtype=np.int64)
+        documents = 0
+        for case in cases():
+            features = set()
+            for counts, _ in case.fields():
+                features.update(counts)
+            if features:
+                frequencies[np.fromiter(features, dtype=np.int64, count=len(features))] += 1
+                documents += 1
+        idf = HashingVectorizer.fit_idf(frequencies, documents)
+        vectorizer = HashingVectorizer(dimensions, idf)
+
+        unsorted_path = os.path.join(version, "unsorted.npy")
+        unsorted = np.lib.format.open_memmap(unsorted_path, mode="w+", dtype=np.float32,
+                                             shape=(documents, dimensions))
+        result_ids, session_ids, user_ids = [], [], []
+        for case in cases():
+            # Rows saved since the first pass are left to the delta
+            if len(result_ids) == documents:
+                break
+            vector = vectorizer.transform(case.fields())
+            if vector is None:
+                continue
+            unsorted[len(result_ids)] = vector
+            result_ids.append(case.result_id)
+            session_ids.append(case.session_id)
+            user_ids.append(case.user_id)
+        _write_version(version, unsorted, result_ids, session_ids, user_ids, idf, exact_max_rows, last_id, pending)
+        del unsorted
+        os.unlink(unsorted_path)
+    except BaseException:
+        shutil.rmtree(version, ignore_errors=True)
+        raise
+    _make_current(directory, version)
+    return version
+
+
+def write_segment(directory: str, vectors: np.ndarray, result_ids: Sequence[int], session_ids: Sequence[int],
+                  user_ids: Sequence[int], idf: Optional[np.ndarray] = None,
+                  exact_max_rows: int = SIMILAR_EXACT_MAX_ROWS) -> str:
+    """Make a base segment of ready-made L2-normalized vectors current, e.g. for benchmarks. Returns its path."""
+    with _build_lock(directory):
+        version = _new_version(directory)
+        try:
+            _write_version(version, vectors, result_ids, session_ids, user_ids,
+                           idf if idf is not None else np.ones(FEATURE_SPACE, dtype=np.float32), exact_max_rows)
+        except BaseException:
+            shutil.rmtree(version, ignore_errors=True)
+            raise
+        _make_current(directory, version)
+        return version
+
+
+def load_base(directory: str = SIMILAR_INDEX_DIR) -> Optional[BaseSegment]:
+    try:
+        with open(os.path.join(directory, "CURRENT")) as pointer_file:
+            return BaseSegment(os.path.join(directory, pointer_file.read().strip()))
+    except FileNotFoundError:
+        return None
+
+
+class SimilarCaseIndex:
+    """
+    Nearest past cases to a symptom description.
+
+    All state is owned by the event loop; the base is built in a worker
+    thread and swapped in when ready, at which point the delta is
+    re-read against the new IDF.
+    """
+
+    def __init__(self, directory: str = SIMILAR_INDEX_DIR, dimensions: int = SIMILAR_DIMENSIONS,
+                 scope: str = SIMILAR_SCOPE, probes: int = SIMILAR_PROBES, enabled: bool = SIMILAR_CASES_ENABLED):
+        if scope not in SCOPES:
+            raise ValueError(f"Unsupported SIMILAR_SCOPE: {scope}")
+        self.directory = directory
+        self.dimensions = dimensions
+        self.scope = scope
+        self.probes = probes
+        self.enabled = enabled
+        self.base: Optional[BaseSegment] = None
+        self.vectorizer = HashingVectorizer(dimensions)
+        self.delta = DeltaSegment(dimensions)
+        # Highest result id read, and streaming rows below it to look at again
+        self.last_id = 0
+        self.pending: Set[int] = set()
+        self._loaded = False
+        self._refreshed_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+        self._building: Optional[asyncio.Task] = None
+        self._tasks = set()
+
+    def _load(self):
+        self._loaded = True
+        try:
+            base = load_base(self.directory)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Similar case index unreadable, rebuilding: %s", e)
+            base = None
+        if base is not None and base.meta["dimensions"] == self.dimensions:
+            self._use_base(base)
+        elif SIMILAR_AUTO_BUILD:
+            self._building = asyncio.ensure_future(self._build())
+
+    def _use_base(self, base: BaseSegment):
+        self.base = base
+        self.vectorizer = HashingVectorizer(self.dimensions, base.idf)
+        self.delta = DeltaSegment(self.dimensions)
+        self.last_id = base.last_id
+        self.pending = set(base.pending)
+        self._refreshed_at = 0.0
+        logger.info("Similar case base loaded: %d cases in %d clusters", len(base), len(base.centroids))
+
+    async def _build(self):
+        loop = asyncio.get_running_loop()
+        try:
+            # Workers sharing the directory wait for whichever one builds first, then load its base
+            build = functools.partial(build_index, self.directory, self.dimensions, if_missing=True)
+            path = await loop.run_in_executor(None, build)
+            base = await loop.run_in_executor(None, BaseSegment, path)
+        except Exception as e:
+            logger.warning("Similar case index build failed: %s", e)
+            return
+        self._use_base(base)
+
+    def _track(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _put(self, cases: Iterable[Case]):
+        for case in cases:
+            vector = self.vectorizer.transform(case.fields())
+            if vector is not None:
+                self.delta.put(case, vector)
+
+    async def refresh(self, force: bool = False):
+        """Read results completed since the last refresh, here or on other workers."""
+        # Until a base exists (e.g. while the first one builds) only results saved here are added
+        if self.base is None:
+            return
+        if not force and time.monotonic() - self._refreshed_at < SIMILAR_REFRESH_INTERVAL:
+            return
+        async with self._refresh_lock:
+            self._refreshed_at = time.monotonic()
+            async with AsyncSessionLocal() as db:
+                # Results still streaming past the last id are looked at again next time
+                seen = DiagnosticResult.id > self.last_id
+                if self.pending:
+                    seen = seen | DiagnosticResult.id.in_(self.pending)
+                streaming = (await db.execute(
+                    select(DiagnosticResult.id).where(seen, DiagnosticResult.status == STATUS_STREAMING)
+                )).scalars().all()
+                pending, self.pending = self.pending, set(streaming)
+                while True:
+                    condition = DiagnosticResult.id > self.last_id
+                    if pending:
+                        condition = condition | DiagnosticResult.id.in_(pending)
+                        pending = set()
+                    rows = (await db.execute(
+                        _case_query().where(condition).order_by(DiagnosticResult.id).limit(BUILD_BATCH_ROWS)
+                    )).all()
+                    if not rows:
+                        return
+                    part_rows = (await db.execute(_parts_query(row.session_id for row in rows))).all()
+                    self._put(_cases_from_rows(rows, part_rows))
+                    self.last_id = max(self.last_id, rows[-1].id)
+                    if len(rows) < BUILD_BATCH_ROWS:
+                        return
+
+    async def _load_cases(self, condition) -> List[Case]:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(_case_query().where(condition))).all()
+            part_rows = (await db.execute(_parts_query(row.session_id for row in rows))).all() if rows else []
+        return _cases_from_rows(rows, part_rows)
+
+    async def _add(self, condition):
+        try:
+            self._put(await self._load_cases(condition))
+        except Exception as e:
+            logger.warning("Could not add cases to the similar case index: %s", e)
+
+    def add_result(self, result_id: int):
+        """Index a result that was just saved as complete."""
+        if self.enabled and self._loaded:
+            self._track(self._add(DiagnosticResult.id == result_id))
+
+    def refresh_session(self, session_id: int):
+        """Re-index a session's results, e.g. after its parts changed."""
+        if self.enabled and self._loaded:
+            self._track(self._add(DiagnosticResult.session_id == session_id))
+
+    def search_vectors(self, queries: np.ndarray, k: int = SIMILAR_TOP_K, user_id: Optional[int] = None,
+                       exclude_sessions: Sequence[int] = ()) -> List[List[Tuple[int, int, float]]]:
+        """
+        Batched cosine top-k. queries is (n, dimensions) and L2-normalized; returns
+        [(result id, session id, score)] per query, best first.
+        """
+        results: List[Dict[int, Tuple[int, float]]] = [dict() for _ in range(len(queries))]
+        delta = self.delta
+        if len(delta):
+            for query, (positions, scores) in enumerate(delta.search(queries, k, user_id, exclude_sessions)):
+                for position, score in zip(positions, scores):
+                    results[query][delta.result_ids[position]] = (delta.session_ids[position], float(score))
+        base = self.base
+        if base is not None and len(base):
+            # Extra rows make up for base rows that a newer delta row replaces
+            found = base.search(queries, 2 * k, self.probes, user_id, exclude_sessions)
+            for query, (positions, scores) in enumerate(found):
+                for position, score in zip(positions, scores):
+                    result_id = int(base.result_ids[position])
+                    if result_id not in delta.positions:
+                        results[query][result_id] = (int(base.session_ids[position]), float(score))
+        return [
+            sorted(((result_id, session_id, score) for result_id, (session_id, score) in found.items()),
+                   key=lambda item: -item[2])[:k]
+            for found in results
+        ]
+
+    async def similar_to(self, text: str, user_id: int, k: int = SIMILAR_TOP_K,
+                         exclude_session: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Past cases most like text, with their input, parts and score. Empty when disabled or unmatched."""
+        if not self.enabled:
+            return []
+        if not self._loaded:
+            self._load()
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning("Similar case refresh failed: %s", e)
+        started = time.perf_counter()
+        vector = self.vectorizer.query(text)
+        if vector is None:
+            return []
+        found = self.search_vectors(
+            vector[None, :], k,
+            user_id=user_id if self.scope == "user" else None,
+            exclude_sessions=(exclude_session,) if exclude_session is not None else ()
+        )[0]
+        similar_search_seconds.observe(time.perf_counter() - started)
+        found = [item for item in found if item[2] >= SIMILAR_MIN_SCORE]
+        if not found:
+            return []
+
+        cases = {case.result_id: case for case in await self._load_cases(
+            DiagnosticResult.id.in_([result_id for result_id, _, _ in found]))}
+        return [{
+            "result_id": result_id,
+            "session_id": session_id,
+            "score": round(score, 4),
+            "input": cases[result_id].input_message,
+            "parts": cases[result_id].parts,
+        } for result_id, session_id, score in found if result_id in cases]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "base_rows": len(self.base) if self.base is not None else 0,
+            "base_clusters": len(self.base.centroids) if self.base is not None else 0,
+            "delta_rows": len(self.delta),
+            "last_id": self.last_id,
+            "building": self._building is not None and not self._building.done(),
+        }
+
+
+def format_cases(cases: List[Dict[str, Any]], limit: int = SIMILAR_PROMPT_CASES) -> str:
+    """Similar cases as prompt lines: what was reported and which parts were predicted."""
+    lines = []
+    for case in cases[:limit]:
+        reported = " ".join(case["input"].split())[:200]
+        parts = ", ".join(case["parts"]) if case["parts"] else "no parts recorded"
+        lines.append(f"- Reported: {reported} | Parts: {parts}")
+    return "\n".join(lines)
+
+
+similar_cases = SimilarCaseIndex()
+
+
+if __name__ == "__main__":
+    path = build_index()
+    print(f"Built similar case index at {path}: {json.dumps(BaseSegment(path).meta)}")
@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import json
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional
+
+
+def request_key(*parts: Any) -> str:
+    """Stable hash of the inputs that fully determine an upstream request."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Coalesce identical in-flight coroutine calls.
+
+    The first caller for a key starts the call; callers arriving while it
+    is running await the same task and receive the same result or error.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.joiners = 0
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.joiners += 1
+        # Shield so one caller giving up does not cancel the shared call
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "joiners": self.joiners}
+
+
+class _StreamFlight:
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.condition = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+class StreamFanout:
+    """
+    Share one upstream async generator between concurrent subscribers.
+
+    Late joiners first receive every chunk produced so far, then follow
+    the live stream. The upstream is cancelled if every subscriber leaves
+    before it finishes.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _StreamFlight] = {}
+        self.leaders = 0
+        self.joiners = 0
+
+    async def _produce(self, key: str, flight: _StreamFlight, factory: Callable[[], AsyncGenerator[str, None]]):
+        upstream = factory()
+        try:
+            async for chunk in upstream:
+                flight.chunks.append(chunk)
+                async with flight.condition:
+                    flight.condition.notify_all()
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+        except Exception as e:
+            flight.error = e
+        finally:
+            await upstream.aclose()
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            async with flight.condition:
+                flight.condition.notify_all()
+
+    async def stream(self, key: str, factory: Callable[[], AsyncGenerator[str, None]]) -> AsyncGenerator[str, None]:
+        flight = self._flights.get(key)
+        if flight is None:
+            self.leaders += 1
+            flight = _StreamFlight()
+            self._flights[key] = flight
+            flight.task = asyncio.ensure_future(self._produce(key, flight, factory))
+        else:
+            self.joiners += 1
+
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                if flight.done:
+                    break
+                async with flight.condition:
+                    await flight.condition.wait_for(lambda: index < len(flight.chunks) or flight.done)
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._flights), "leaders": self.leaders, "joiners": self.joiners}
@@ -0,0 +1,170 @@
+import asyncio
+import re
+import time
+from typing import AsyncGenerator, AsyncIterator, Mapping, Optional
+
+# Default frame size: matches the original "yield once the buffer passes 10 characters"
+DEFAULT_FLUSH_BYTES = 10
+DEFAULT_FLUSH_MS = 30
+
+# Split cached text back into word-sized tokens for replay
+TOKEN_PATTERN = re.compile(r"\S+\s*|\s+")
+SENTENCE_END = re.compile(r"[.!?:;\n]\s*$")
+
+
+class FlushPolicy:
+    """
+    Decides when buffered tokens are sent to the client as one frame.
+
+    should_flush is checked after every token; max_delay (seconds), when
+    set, also flushes a non-empty buffer once it has waited that long.
+    """
+
+    name = "base"
+    max_delay: Optional[float] = None
+
+    def should_flush(self, buffered_bytes: int, token: str) -> bool:
+        raise NotImplementedError
+
+
+class TokenFlush(FlushPolicy):
+    """One frame per upstream token: lowest latency, most frames."""
+
+    name = "token"
+
+    def should_flush(self, buffered_bytes: int, token: str) -> bool:
+        return True
+
+
+class ByteThresholdFlush(FlushPolicy):
+    """Flush once the buffer grows past a byte threshold."""
+
+    name = "bytes"
+
+    def __init__(self, threshold: int = DEFAULT_FLUSH_BYTES):
+        self.threshold = threshold
+
+    def should_flush(self, buffered_bytes: int, token: str) -> bool:
+        return buffered_bytes > self.threshold
+
+
+class TimeFlush(FlushPolicy):
+    """Flush whatever has accumulated every interval."""
+
+    name = "time"
+
+    def __init__(self, interval_ms: float = DEFAULT_FLUSH_MS):
+        self.max_delay = interval_ms / 1000
+
+    def should_flush(self, buffered_bytes: int, token: str) -> bool:
+        return False
+
+
+class SentenceFlush(FlushPolicy):
+    """Flush at sentence or line boundaries, with a byte cap for long run-ons."""
+
+    name = "sentence"
+
+    def __init__(self, max_bytes: int = 512):
+        self.max_bytes = max_bytes
+
+    def should_flush(self, buffered_bytes: int, token: str) -> bool:
+        return buffered_bytes >= self.max_bytes or bool(SENTENCE_END.search(token))
+
+
+def default_flush_policy() -> FlushPolicy:
+    return ByteThresholdFlush(DEFAULT_FLUSH_BYTES)
+
+
+def flush_policy_from_params(params: Mapping[str, str]) -> FlushPolicy:
+    """
+    Build a flush policy from WebSocket handshake query parameters.
+
+    flush=token|bytes|time|sentence, with flush_bytes / flush_ms to tune
+    the bytes and time policies. Raises ValueError on unknown values.
+    """
+    name = params.get("flush")
+    if not name:
+        return default_flush_policy()
+    try:
+        if name == "token":
+            return TokenFlush()
+        if name == "bytes":
+            return ByteThresholdFlush(int(params.get("flush_bytes", DEFAULT_FLUSH_BYTES)))
+        if name == "time":
+            return TimeFlush(float(params.get("flush_ms", DEFAULT_FLUSH_MS)))
+        if name == "sentence":
+            return SentenceFlush(int(params.get("flush_bytes", 512)))
+    except ValueError:
+        raise ValueError(f"Invalid flush parameters for policy '{name}'")
+    raise ValueError(f"Unknown flush policy '{name}'")
+
+
+def split_tokens(text: str):
+    """Split text into word-sized tokens so cached answers replay like a live stream."""
+    return TOKEN_PATTERN.findall(text)
+
+
+async def apply_flush_policy(tokens: AsyncIterator[str], policy: FlushPolicy) -> AsyncGenerator[str, None]:
+    """Group a token stream into frames according to policy."""
+    if policy.max_delay is not None:
+        async for frame in _apply_timed(tokens, policy):
+            yield frame
+        return
+
+    parts = []
+    buffered = 0
+    async for token in tokens:
+        parts.append(token)
+        buffered += len(token.encode("utf-8"))
+        if policy.should_flush(buffered, token):
+            yield "".join(parts)
+            parts = []
+            buffered = 0
+    if parts:
+        yield "".join(parts)
+
+
+_END = object()
+
+
+async def _apply_timed(tokens: AsyncIterator[str], policy: FlushPolicy) -> AsyncGenerator[str, None]:
+    # Tokens are pumped into a queue so the flush timer can fire between tokens
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for token in tokens:
+                queue.put_nowait(token)
+            queue.put_nowait(_END)
+        except Exception as e:
+            queue.put_nowait(e)
+
+    pump_task = asyncio.ensure_future(pump())
+    parts = []
+    buffered = 0
+    deadline = None
+    try:
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield "".join(parts)
+                parts, buffered, deadline = [], 0, None
+                continue
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if not parts:
+                deadline = time.monotonic() + policy.max_delay
+            parts.append(item)
+            buffered += len(item.encode("utf-8"))
+            if policy.should_flush(buffered, item):
+                yield "".join(parts)
+                parts, buffered, deadline = [], 0, None
+        if parts:
+            yield "".join(parts)
+    finally:
+        pump_task.cancel()
@@ -0,0 +1,66 @@
+"""
+Authentication overhead benchmark.
+
+Calls GET /auth/me repeatedly with the user cache disabled and enabled,
+reporting latency and statements executed per request.
+
+    python -m benchmarks.auth_overhead --requests 500
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import QueryCounter, ServerThread, percentiles
+
+import httpx
+
+import app.main as main
+from app.auth import user_cache
+
+EMAIL = "auth@example.com"
+
+
+async def measure(client: httpx.AsyncClient, headers: dict, counter: QueryCounter, requests: int) -> dict:
+    samples = []
+    queries_before = counter.count
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = await client.get("/auth/me", headers=headers)
+        samples.append(time.perf_counter() - started)
+        response.raise_for_status()
+    return {
+        "latency": percentiles(samples),
+        "statements_per_request": round((counter.count - queries_before) / requests, 3),
+    }
+
+
+async def run(args) -> dict:
+    counter = QueryCounter()
+    cache_size = user_cache.max_entries
+    results = {}
+    with ServerThread(main.app) as server:
+        async with httpx.AsyncClient(base_url=server.base_url) as client:
+            await client.post("/auth/register", json={"email": EMAIL, "password": "benchmark"})
+            response = await client.post("/auth/login", data={"username": EMAIL, "password": "benchmark"})
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+            user_cache.max_entries = 0
+            user_cache.clear()
+            results["cache_disabled"] = await measure(client, headers, counter, args.requests)
+
+            user_cache.max_entries = cache_size
+            results["cache_enabled"] = await measure(client, headers, counter, args.requests)
+
+    return {"benchmark": "auth_overhead", "config": vars(args), "results": results}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500, help="sequential requests per variant")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
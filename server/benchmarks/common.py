@@ -0,0 +1,279 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Point the app at a throwaway SQLite database before anything imports app.database
+_tmp_dir = tempfile.mkdtemp(prefix="detect_auto_bench_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp_dir}/bench.db")
+# Keep per-connection INFO logs off stdout so results stay machine-readable
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import uvicorn
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Summarize latency samples (seconds) as milliseconds."""
+    if not samples:
+        return {"count": 0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+        return round(ordered[index] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+async def fake_diagnostic(symptoms: str, stream: bool = True, chunks: int = 20, delay: float = 0.01):
+    """Stand-in for ai_service.generate_diagnostic that streams canned text."""
+    for i in range(chunks):
+        await asyncio.sleep(delay)
+        yield f"chunk {i} for {symptoms[:20]} "
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerThread:
+    """Run app.main:app with uvicorn on its own thread and event loop."""
+
+    def __init__(self, app, port: int = None):
+        self.port = port or free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.ws_url = f"ws://127.0.0.1:{self.port}"
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", lifespan="on")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.time() + 10
+        while not self.server.started:
+            if time.time() > deadline:
+                raise RuntimeError("Server did not start")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Server settings for offline runs: stub model, no upstream throttling, no response cache
+STUB_SERVER_ENV = {
+    "LLM_PROVIDER": "stub",
+    "LLM_MAX_CONCURRENCY": "100000",
+    "LLM_REQUESTS_PER_MINUTE": "0",
+    "LLM_TOKENS_PER_MINUTE": "0",
+    "DIAGNOSTIC_CACHE_SIZE": "0",
+    "LOG_LEVEL": "WARNING",
+}
+
+
+class ServerProcess:
+    """
+    Run app.main:app with uvicorn in a child process.
+
+    Unlike ServerThread the server's memory is its own, so rss_kb() can be
+    attributed to server-side connections. Configuration goes through env.
+    """
+
+    def __init__(self, env: Optional[Dict[str, str]] = None, port: int = None):
+        self.port = port or free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.ws_url = f"ws://127.0.0.1:{self.port}"
+        self.env = {**os.environ, **STUB_SERVER_ENV, **(env or {})}
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+             "--port", str(self.port), "--log-level", "warning"],
+            cwd=SERVER_DIR, env=self.env, stdout=subprocess.DEVNULL
+        )
+        deadline = time.time() + 30
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.2):
+                    return self
+            except OSError:
+                if time.time() > deadline:
+                    raise RuntimeError("Server did not start")
+                time.sleep(0.1)
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+    def rss_kb(self) -> Optional[int]:
+        """Resident set size of the server process (Linux /proc), or None if unavailable."""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except OSError:
+            return None
+        return None
+
+
+class _Delta(dict):
+    __getattr__ = dict.__getitem__
+
+
+class _Obj:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def install_fake_openai(tokens: int = 200, tokens_per_second: float = 200.0, first_token_delay: float = 0.2):
+    """Replace openai.ChatCompletion.acreate with a local upstream streaming canned tokens."""
+    import openai
+
+    words = ("Check the ignition coils, spark plugs and fuel injectors. "
+             "A misfire on cylinder one usually points to a failed coil pack. ").split(" ")
+
+    async def acreate(**kwargs):
+        if not kwargs.get("stream"):
+            await asyncio.sleep(first_token_delay)
+            text = " ".join(words[i % len(words)] for i in range(tokens))
+            return _Obj(choices=[_Obj(message=_Obj(content=text))])
+
+        async def generate():
+            await asyncio.sleep(first_token_delay)
+            for i in range(tokens):
+                await asyncio.sleep(1 / tokens_per_second)
+                yield _Obj(choices=[_Obj(delta=_Delta(content=words[i % len(words)] + " "))])
+
+        return generate()
+
+    openai.ChatCompletion.acreate = acreate
+
+
+def install_stub_provider(latency: float = 0.05, tokens_per_second: float = 200.0, error_rate: float = 0.0,
+                          seed: int = 0, unthrottled: bool = True):
+    """Answer every model call from the local StubProvider; optionally lift the scheduler's limits."""
+    from app.services.llm_providers import StubProvider, set_llm_provider
+    from app.services.llm_scheduler import TokenBucket, llm_scheduler
+
+    set_llm_provider(StubProvider(latency=latency, tokens_per_second=tokens_per_second, error_rate=error_rate, seed=seed))
+    if unthrottled:
+        llm_scheduler.max_concurrency = 10 ** 6
+        llm_scheduler.requests = TokenBucket(0)
+        llm_scheduler.tokens = TokenBucket(0)
+
+
+class QueryCounter:
+    """Count statements executed by the API's async engine."""
+
+    def __init__(self):
+        from sqlalchemy import event
+        from app.database import async_engine
+
+        self.count = 0
+        event.listen(async_engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def seed_session_history(email: str, turns: int, parts: int = 5, output_chars: int = 2000) -> int:
+    """Create a user-owned session with `turns` diagnostic results plus parts and a summary."""
+    from app.auth import get_password_hash
+    from app.database import SessionLocal, Base, engine
+    from app.models import User, Session as DiagnosticSession, DiagnosticResult, PartPrediction, RepairSummary
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.email == email).first()
+        if user is None:
+            user = User(email=email, hashed_password=get_password_hash("benchmark"))
+            db.add(user)
+            db.flush()
+        session = DiagnosticSession(user_id=user.id, input_text="P0300 random misfire")
+        db.add(session)
+        db.flush()
+        body = ("Cylinder misfire detected; inspect coils, plugs and injectors. " * (output_chars // 60 + 1))[:output_chars]
+        db.add_all(
+            DiagnosticResult(session_id=session.id, input_message=f"turn {i}", output_text=body)
+            for i in range(turns)
+        )
+        db.add_all(
+            PartPrediction(session_id=session.id, part_name=f"Part {i}", confidence_score=0.5, price_estimate="$10-$20")
+            for i in range(parts)
+        )
+        db.add(RepairSummary(session_id=session.id, summary_text="Replace ignition coil."))
+        db.commit()
+        return session.id
+    finally:
+        db.close()
+
+
+def seed_sessions(email: str, count: int, batch: int = 1000) -> int:
+    """Give a user `count` sessions (inputs only) for listing benchmarks; returns the user id."""
+    from app.auth import get_password_hash
+    from app.database import SessionLocal, Base, engine
+    from app.models import User, Session as DiagnosticSession
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.email == email).first()
+        if user is None:
+            user = User(email=email, hashed_password=get_password_hash("benchmark"))
+            db.add(user)
+            db.flush()
+        for start in range(0, count, batch):
+            db.bulk_insert_mappings(DiagnosticSession, [
+                {"user_id": user.id, "input_text": f"P0{300 + i % 9} misfire report {i}"}
+                for i in range(start, min(count, start + batch))
+            ])
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+
+def seed_users(prefix: str, count: int) -> List[Dict[str, object]]:
+    """Create `count` users sharing one password hash and mint their tokens locally, skipping bcrypt per user."""
+    from app.auth import create_access_token, get_password_hash
+    from app.database import SessionLocal, Base, engine
+    from app.models import User
+
+    Base.metadata.create_all(bind=engine)
+    hashed = get_password_hash("benchmark")
+    db = SessionLocal()
+    try:
+        users = [User(email=f"{prefix}{i}@example.com", hashed_password=hashed) for i in range(count)]
+        db.add_all(users)
+        db.commit()
+        return [
+            {"id": user.id, "email": user.email,
+             "token": create_access_token({"sub": user.email, "user_id": user.id})}
+            for user in users
+        ]
+    finally:
+        db.close()
@@ -0,0 +1,71 @@
+"""
+Compare two benchmark result files.
+
+Walks both JSON documents and lines up every latency percentile (p50_ms,
+p95_ms, p99_ms), throughput_per_s and rss_per_connection_kb value found
+at the same path. Prints each metric's change and exits non-zero if any
+metric regressed by more than the threshold. A regression is higher
+latency or memory, or lower throughput.
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Iterator, Tuple
+
+# Metric name -> True if a larger value is better
+METRICS = {
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "throughput_per_s": True,
+    "rss_per_connection_kb": False,
+}
+
+
+def flatten(node, path: str = "") -> Iterator[Tuple[str, float]]:
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "config":
+                continue
+            child = f"{path}.{key}" if path else key
+            if key in METRICS and isinstance(value, (int, float)):
+                yield child, float(value)
+            else:
+                yield from flatten(value, child)
+
+
+def compare(before: dict, after: dict, threshold: float) -> Dict[str, list]:
+    baseline = dict(flatten(before))
+    rows, regressions = [], []
+    for path, new in flatten(after):
+        old = baseline.get(path)
+        if old is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        higher_is_better = METRICS[path.rsplit(".", 1)[-1]]
+        worse = -change if higher_is_better else change
+        row = {"metric": path, "before": old, "after": new, "change_pct": round(change, 2)}
+        rows.append(row)
+        if worse > threshold:
+            regressions.append(row)
+    return {"metrics": rows, "regressions": regressions}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before", help="baseline results JSON")
+    parser.add_argument("after", help="candidate results JSON")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    with open(args.before) as before, open(args.after) as after:
+        result = compare(json.load(before), json.load(after), args.threshold)
+    result["threshold_pct"] = args.threshold
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if result["regressions"] else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
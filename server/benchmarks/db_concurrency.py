@@ -0,0 +1,135 @@
+"""
+Mixed REST + WebSocket concurrency benchmark.
+
+Runs the API against a temporary SQLite database with a canned diagnostic
+stream and reports REST latency and WebSocket inter-chunk gaps. A handler
+that blocks the event loop on the database shows up as p99 spikes in both.
+
+Run it on two commits to compare before/after:
+
+    python -m benchmarks.db_concurrency --duration 10 --ws 50 --rest 20 > after.json
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import ServerThread, fake_diagnostic, percentiles
+
+import httpx
+import websockets
+
+import app.main as main
+from app.services import diagnostic_socket
+
+
+async def login(client: httpx.AsyncClient, email: str, password: str = "benchmark") -> str:
+    await client.post("/auth/register", json={"email": email, "password": password})
+    response = await client.post("/auth/login", data={"username": email, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def rest_worker(client: httpx.AsyncClient, token: str, stop_at: float, samples: list, errors: list):
+    headers = {"Authorization": f"Bearer {token}"}
+    while time.perf_counter() < stop_at:
+        try:
+            started = time.perf_counter()
+            response = await client.post("/diagnostic/start", json={"input": "P0300 misfire"}, headers=headers)
+            samples.append(time.perf_counter() - started)
+            response.raise_for_status()
+            session_id = response.json()["session_id"]
+
+            started = time.perf_counter()
+            await client.get(f"/sessions/{session_id}", headers=headers)
+            samples.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await client.get("/sessions", headers=headers)
+            samples.append(time.perf_counter() - started)
+        except httpx.HTTPError as e:
+            # Counted rather than fatal: past a few dozen clients SQLite starts timing out on its write lock
+            errors.append(type(e).__name__)
+
+
+async def ws_worker(ws_url: str, token: str, stop_at: float, gaps: list, first_chunk: list, errors: list):
+    while time.perf_counter() < stop_at:
+        try:
+            await ws_session(ws_url, token, stop_at, gaps, first_chunk, errors)
+        except (websockets.exceptions.WebSocketException, OSError) as e:
+            # A refused or dropped socket is counted and reconnected
+            errors.append(type(e).__name__)
+
+
+async def ws_session(ws_url: str, token: str, stop_at: float, gaps: list, first_chunk: list, errors: list):
+    async with websockets.connect(f"{ws_url}/ws/diagnostics/0?token={token}") as socket:
+        await socket.recv()  # session info
+        while time.perf_counter() < stop_at:
+            await socket.send(json.dumps({"input": "P0420 catalyst efficiency below threshold"}))
+            sent = last = time.perf_counter()
+            first = True
+            while True:
+                message = json.loads(await socket.recv())
+                if "type" in message:
+                    continue  # pushed event from the connection manager
+                now = time.perf_counter()
+                if first:
+                    first_chunk.append(now - sent)
+                    first = False
+                else:
+                    gaps.append(now - last)
+                last = now
+                if "error" in message:
+                    errors.append(message["error"])
+                    break
+                if "complete" in message:
+                    break
+
+
+async def run(args) -> dict:
+    # DiagnosticSocket calls generate_diagnostic through its own module
+    diagnostic_socket.generate_diagnostic = lambda symptoms, stream=True, **kwargs: fake_diagnostic(
+        symptoms, stream, chunks=args.chunks, delay=args.chunk_delay
+    )
+
+    rest_samples, ws_gaps, ws_first, rest_errors, ws_errors = [], [], [], [], []
+    with ServerThread(main.app) as server:
+        limits = httpx.Limits(max_connections=args.rest * 2)
+        async with httpx.AsyncClient(base_url=server.base_url, limits=limits, timeout=60) as client:
+            tokens = [await login(client, f"bench{i}@example.com") for i in range(max(args.ws, args.rest))]
+            stop_at = time.perf_counter() + args.duration
+            started = time.perf_counter()
+            await asyncio.gather(
+                *(rest_worker(client, tokens[i], stop_at, rest_samples, rest_errors) for i in range(args.rest)),
+                *(ws_worker(server.ws_url, tokens[i], stop_at, ws_gaps, ws_first, ws_errors) for i in range(args.ws)),
+            )
+            elapsed = time.perf_counter() - started
+            db_pool = (await client.get("/metrics/db-pool")).json()
+
+    return {
+        "benchmark": "db_concurrency",
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 3),
+        "rest_latency": percentiles(rest_samples),
+        "rest_rps": round(len(rest_samples) / elapsed, 2),
+        "rest_errors": len(rest_errors),
+        "ws_first_chunk": percentiles(ws_first),
+        "ws_chunk_gap": percentiles(ws_gaps),
+        "ws_errors": len(ws_errors),
+        "db_pool": db_pool,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--ws", type=int, default=20, help="concurrent WebSocket streams")
+    parser.add_argument("--rest", type=int, default=10, help="concurrent REST clients")
+    parser.add_argument("--chunks", type=int, default=20, help="chunks per fake diagnostic")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="seconds between fake chunks")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
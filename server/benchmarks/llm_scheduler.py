@@ -0,0 +1,148 @@
+"""
+LLM scheduler benchmark.
+
+Drives a mix of interactive streams and batch completions through an
+LLMScheduler against a local fake upstream that enforces its own
+concurrency and requests/min quota, answering 429 (with Retry-After) or an
+occasional 503 when exceeded. Reports upstream errors seen, retries,
+failures and admission wait per priority class; interactive calls should
+wait far less than batch calls and no call should fail.
+
+    python -m benchmarks.llm_scheduler --interactive 40 --batch 120
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+
+from benchmarks.common import percentiles
+
+from app.services.llm_providers import ChatResult, ProviderError
+from app.services.llm_scheduler import LLMScheduler, UpstreamError, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+
+
+class FakeUpstream:
+    """Provider stand-in with a hard concurrency limit, a per-minute quota and random 5xx."""
+
+    def __init__(self, max_concurrency: int, requests_per_minute: float, latency: float, error_rate: float):
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.latency = latency
+        self.error_rate = error_rate
+        self.active = 0
+        self.calls = []
+        self.status_counts = {}
+
+    def _admit(self):
+        now = time.monotonic()
+        self.calls = [t for t in self.calls if now - t < 60]
+        if self.active >= self.max_concurrency or len(self.calls) >= self.requests_per_minute:
+            self._count(429)
+            raise ProviderError("Rate limit reached", http_status=429, retry_after=0.2)
+        if random.random() < self.error_rate:
+            self._count(503)
+            raise ProviderError("Overloaded", http_status=503)
+        self.calls.append(now)
+        self._count(200)
+
+    def _count(self, status: int):
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    async def complete(self):
+        self._admit()
+        self.active += 1
+        try:
+            await asyncio.sleep(self.latency)
+            return ChatResult("ok", total_tokens=50)
+        finally:
+            self.active -= 1
+
+    async def stream(self):
+        self._admit()
+        self.active += 1
+
+        async def generate():
+            try:
+                for _ in range(20):
+                    await asyncio.sleep(self.latency / 20)
+                    yield "tok "
+            finally:
+                self.active -= 1
+
+        return generate()
+
+
+async def run(args) -> dict:
+    # Retries are expected here; keep the per-retry warnings out of the JSON output
+    logging.getLogger("app.services.llm_scheduler").setLevel(logging.ERROR)
+    upstream = FakeUpstream(args.upstream_concurrency, args.upstream_rpm, args.latency, args.error_rate)
+    scheduler = LLMScheduler(
+        max_concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=0,
+        base_delay=0.05,
+        max_delay=1.0
+    )
+    totals = {"interactive": [], "batch": []}
+    failures = {"interactive": 0, "batch": 0}
+
+    async def interactive():
+        started = time.perf_counter()
+        try:
+            async for _ in scheduler.stream(upstream.stream, priority=PRIORITY_INTERACTIVE, estimated_tokens=20):
+                pass
+        except UpstreamError:
+            failures["interactive"] += 1
+        totals["interactive"].append(time.perf_counter() - started)
+
+    async def batch():
+        started = time.perf_counter()
+        try:
+            await scheduler.complete(upstream.complete, priority=PRIORITY_BATCH, estimated_tokens=50)
+        except UpstreamError:
+            failures["batch"] += 1
+        totals["batch"].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    # Batch work is queued first; interactive calls arrive while it is backed up
+    tasks = [asyncio.ensure_future(batch()) for _ in range(args.batch)]
+    await asyncio.sleep(0.05)
+    for _ in range(args.interactive):
+        tasks.append(asyncio.ensure_future(interactive()))
+        await asyncio.sleep(args.arrival_ms / 1000)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "benchmark": "llm_scheduler",
+        "config": vars(args),
+        "results": {
+            "elapsed_seconds": round(elapsed, 3),
+            "upstream_status_counts": upstream.status_counts,
+            "failures": failures,
+            "interactive_total": percentiles(totals["interactive"]),
+            "batch_total": percentiles(totals["batch"]),
+            "scheduler": scheduler.stats(),
+        },
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--interactive", type=int, default=40, help="interactive streaming calls")
+    parser.add_argument("--batch", type=int, default=120, help="batch completions queued up front")
+    parser.add_argument("--arrival-ms", type=float, default=10.0, help="gap between interactive arrivals")
+    parser.add_argument("--concurrency", type=int, default=8, help="scheduler concurrency cap")
+    parser.add_argument("--rpm", type=float, default=6000, help="scheduler requests/min")
+    parser.add_argument("--upstream-concurrency", type=int, default=6, help="fake upstream concurrency limit")
+    parser.add_argument("--upstream-rpm", type=float, default=10000, help="fake upstream requests/min quota")
+    parser.add_argument("--latency", type=float, default=0.1, help="fake upstream seconds per call")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="fake upstream 503 probability")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,105 @@
+"""
+Login storm benchmark.
+
+Keeps N diagnostic streams running against a local fake upstream, then
+fires a burst of concurrent logins. Reports WebSocket inter-chunk gaps
+while idle and during the storm, plus login latency and 503 rejections.
+Stream latency should stay flat when password hashing is off the loop.
+
+    python -m benchmarks.login_storm --streams 20 --logins 200
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from benchmarks.common import ServerThread, install_fake_openai, percentiles
+
+import httpx
+import websockets
+
+import app.main as main
+from app.services.diagnostic_cache import diagnostic_cache
+
+PASSWORD = "benchmark"
+
+
+async def stream_worker(url: str, stop: asyncio.Event, gaps: list, phase: dict):
+    async with websockets.connect(url) as socket:
+        await socket.recv()  # session info
+        while not stop.is_set():
+            await socket.send(json.dumps({"input": f"rough idle {uuid.uuid4().hex}"}))
+            last = time.perf_counter()
+            while True:
+                message = json.loads(await socket.recv())
+                if "type" in message:
+                    continue  # pushed event from the connection manager
+                now = time.perf_counter()
+                gaps.append((phase["name"], now - last))
+                last = now
+                if "complete" in message or "error" in message:
+                    break
+
+
+async def login(client: httpx.AsyncClient, email: str, samples: list, statuses: dict):
+    started = time.perf_counter()
+    response = await client.post("/auth/login", data={"username": email, "password": PASSWORD})
+    samples.append(time.perf_counter() - started)
+    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+async def run(args) -> dict:
+    install_fake_openai(tokens=args.tokens, tokens_per_second=args.tps, first_token_delay=0.05)
+    diagnostic_cache.memory.max_entries = 0
+    diagnostic_cache.disk = None
+
+    gaps, login_samples, statuses = [], [], {}
+    phase = {"name": "idle"}
+    with ServerThread(main.app) as server:
+        limits = httpx.Limits(max_connections=args.logins)
+        async with httpx.AsyncClient(base_url=server.base_url, limits=limits, timeout=120) as client:
+            emails = [f"storm{i}@example.com" for i in range(args.users)]
+            for email in emails:
+                await client.post("/auth/register", json={"email": email, "password": PASSWORD})
+            response = await client.post("/auth/login", data={"username": emails[0], "password": PASSWORD})
+            token = response.json()["access_token"]
+
+            stop = asyncio.Event()
+            url = f"{server.ws_url}/ws/diagnostics/0?token={token}&flush=token"
+            streams = [asyncio.ensure_future(stream_worker(url, stop, gaps, phase)) for _ in range(args.streams)]
+
+            await asyncio.sleep(args.idle_seconds)
+            phase["name"] = "storm"
+            storm_started = time.perf_counter()
+            await asyncio.gather(*(login(client, emails[i % len(emails)], login_samples, statuses) for i in range(args.logins)))
+            storm_seconds = time.perf_counter() - storm_started
+            phase["name"] = "after"
+            stop.set()
+            await asyncio.gather(*streams)
+
+    return {
+        "benchmark": "login_storm",
+        "config": vars(args),
+        "storm_seconds": round(storm_seconds, 3),
+        "chunk_gap_idle": percentiles([gap for name, gap in gaps if name == "idle"]),
+        "chunk_gap_storm": percentiles([gap for name, gap in gaps if name == "storm"]),
+        "login_latency": percentiles(login_samples),
+        "login_status_codes": statuses,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=20, help="concurrent diagnostic streams")
+    parser.add_argument("--logins", type=int, default=200, help="concurrent logins in the storm")
+    parser.add_argument("--users", type=int, default=10, help="distinct accounts logging in")
+    parser.add_argument("--idle-seconds", type=float, default=2.0, help="stream-only warmup before the storm")
+    parser.add_argument("--tokens", type=int, default=400, help="tokens per fake completion")
+    parser.add_argument("--tps", type=float, default=100.0, help="fake upstream tokens per second")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
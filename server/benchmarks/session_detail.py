@@ -0,0 +1,63 @@
+"""
+GET /sessions/{session_id} benchmark.
+
+Seeds sessions holding hundreds of diagnostic turns and reports latency
+and statements executed per request, with and without output bodies.
+
+    python -m benchmarks.session_detail --turns 500 --requests 200
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import QueryCounter, ServerThread, percentiles, seed_session_history
+
+import httpx
+
+import app.main as main
+
+EMAIL = "history@example.com"
+
+
+async def run(args) -> dict:
+    session_id = seed_session_history(EMAIL, args.turns, output_chars=args.output_chars)
+    counter = QueryCounter()
+
+    results = {}
+    with ServerThread(main.app) as server:
+        async with httpx.AsyncClient(base_url=server.base_url, timeout=60) as client:
+            response = await client.post("/auth/login", data={"username": EMAIL, "password": "benchmark"})
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+            for include_output in (True, False):
+                url = f"/sessions/{session_id}?include_output={str(include_output).lower()}"
+                samples = []
+                queries_before = counter.count
+                size = 0
+                for _ in range(args.requests):
+                    started = time.perf_counter()
+                    response = await client.get(url, headers=headers)
+                    samples.append(time.perf_counter() - started)
+                    size = len(response.content)
+                results[f"include_output={include_output}"] = {
+                    "latency": percentiles(samples),
+                    # includes the auth lookup in get_current_user
+                    "statements_per_request": round((counter.count - queries_before) / args.requests, 2),
+                    "response_bytes": size,
+                }
+
+    return {"benchmark": "session_detail", "config": vars(args), "results": results}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=500, help="diagnostic results in the seeded session")
+    parser.add_argument("--output-chars", type=int, default=2000, help="size of each seeded output_text")
+    parser.add_argument("--requests", type=int, default=100, help="sequential requests per variant")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
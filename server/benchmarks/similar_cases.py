@@ -0,0 +1,176 @@
+"""
+Similar case retrieval benchmark.
+
+Writes a base segment of synthetic, clustered case vectors (the shape real
+cases take: many reports of a few hundred common faults) and queries it
+through SimilarCaseIndex the way the diagnostic socket does, one query at
+a time and in batches, with and without the per-user filter. Recall@k is
+measured against an exact scan of the whole matrix. A smaller text corpus
+is also built through the real vectorizer to report indexing throughput.
+No database is used.
+
+    python -m benchmarks.similar_cases --rows 1000000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.common import percentiles
+
+from app.services.similar_cases import (
+    SCAN_CHUNK_ROWS, Case, SimilarCaseIndex, _top_k, build_index, load_base, write_segment
+)
+
+SYMPTOMS = [
+    "rough idle", "misfire", "check engine light", "rattling exhaust", "grinding brakes", "squealing belt",
+    "overheating", "coolant leak", "hard start", "stalls at stop", "AC blows warm", "battery drains overnight",
+    "transmission slips", "clunk over bumps", "steering wheel shakes", "burning oil smell", "poor fuel economy",
+]
+VEHICLES = ["Honda Civic", "Toyota Camry", "Ford F-150", "Chevy Silverado", "Nissan Altima", "Subaru Outback"]
+CODES = ["P0420", "P0300", "P0301", "P0171", "P0128", "P0442", "P0455", "P0700", "P0335", "P0011"]
+PARTS = ["Catalytic Converter", "Ignition Coil", "Spark Plug Set", "Oxygen Sensor", "Thermostat", "Brake Pads",
+         "Serpentine Belt", "Water Pump", "EVAP Purge Valve", "Crankshaft Position Sensor", "AC Compressor"]
+
+
+def synthetic_vectors(path: str, rows: int, dimensions: int, topics: int, noise: float, seed: int) -> np.ndarray:
+    """Rows scattered around `topics` random directions, written to a memory-mapped file."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((topics, dimensions)).astype(np.float32)
+    vectors = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(rows, dimensions))
+    for start in range(0, rows, SCAN_CHUNK_ROWS):
+        count = min(SCAN_CHUNK_ROWS, rows - start)
+        block = centers[rng.integers(0, topics, count)] + noise * rng.standard_normal((count, dimensions)).astype(np.float32)
+        vectors[start:start + count] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    vectors.flush()
+    return vectors
+
+
+def synthetic_cases(rows: int, seed: int):
+    rng = random.Random(seed)
+    for result_id in range(1, rows + 1):
+        text = f"{rng.choice(CODES)} {rng.choice(SYMPTOMS)} and {rng.choice(SYMPTOMS)} on a {rng.choice(VEHICLES)}"
+        yield Case(result_id, result_id, result_id % 100, text, "Likely causes: " + text, rng.sample(PARTS, 2))
+
+
+def exact_top_k(vectors: np.ndarray, query: np.ndarray, k: int):
+    positions, scores = [], []
+    for start in range(0, len(vectors), SCAN_CHUNK_ROWS):
+        block_scores = np.asarray(vectors[start:start + SCAN_CHUNK_ROWS]) @ query
+        best = _top_k(block_scores, k)
+        positions.append(best + start)
+        scores.append(block_scores[best])
+    positions, scores = np.concatenate(positions), np.concatenate(scores)
+    best = _top_k(scores, k)
+    return set(positions[best].tolist()), scores[best]
+
+
+def run(args) -> dict:
+    directory = tempfile.mkdtemp(prefix="similar-bench-")
+    try:
+        rng = np.random.default_rng(args.seed + 1)
+        started = time.perf_counter()
+        vectors = synthetic_vectors(os.path.join(directory, "synthetic.npy"), args.rows, args.dimensions,
+                                    args.topics, args.noise, args.seed)
+        generate_seconds = time.perf_counter() - started
+
+        result_ids = np.arange(1, args.rows + 1, dtype=np.int64)
+        user_ids = rng.integers(0, args.users, args.rows)
+        started = time.perf_counter()
+        write_segment(os.path.join(directory, "index"), vectors, result_ids, result_ids, user_ids,
+                      exact_max_rows=args.exact_max_rows)
+        segment_seconds = time.perf_counter() - started
+
+        index = SimilarCaseIndex(os.path.join(directory, "index"), args.dimensions, scope="all", probes=args.probes)
+        index.base = base = load_base(index.directory)
+
+        # Queries are perturbed copies of stored rows, like a new report of a known fault
+        sources = rng.integers(0, args.rows, args.queries)
+        queries = np.asarray(vectors[np.sort(sources)]) + args.noise * 0.5 * rng.standard_normal(
+            (args.queries, args.dimensions)).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        index.search_vectors(queries[:1], args.k)
+        single, per_user = [], []
+        for query in queries:
+            started = time.perf_counter()
+            index.search_vectors(query[None, :], args.k)
+            single.append(time.perf_counter() - started)
+        for query in queries:
+            started = time.perf_counter()
+            index.search_vectors(query[None, :], args.k, user_id=int(rng.integers(0, args.users)))
+            per_user.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        for start in range(0, len(queries), args.batch):
+            index.search_vectors(queries[start:start + args.batch], args.k)
+        batched_seconds = time.perf_counter() - started
+
+        # Many synthetic rows tie with the true neighbours, so also report how close the scores came
+        hits, score_ratios = 0, []
+        for query in queries[:args.recall_queries]:
+            expected, expected_scores = exact_top_k(vectors, query, args.k)
+            positions, scores = base.search(query[None, :], args.k, args.probes)[0]
+            # Compare result ids: the base stores rows in cluster order
+            hits += len(expected & {int(base.result_ids[position]) - 1 for position in positions})
+            score_ratios.append(float(scores.sum() / expected_scores.sum()))
+        recall = hits / (args.k * min(args.recall_queries, len(queries)))
+
+        started = time.perf_counter()
+        build_index(os.path.join(directory, "text"), args.dimensions,
+                    cases=lambda: synthetic_cases(args.text_rows, args.seed), exact_max_rows=args.exact_max_rows)
+        text_seconds = time.perf_counter() - started
+        text_index = SimilarCaseIndex(os.path.join(directory, "text"), args.dimensions, scope="all")
+        text_index.base = load_base(text_index.directory)
+        text_index.vectorizer.idf = text_index.base.idf
+        started = time.perf_counter()
+        for _ in range(200):
+            vector = text_index.vectorizer.query("P0300 rough idle and misfire on a Toyota Camry")
+        vectorize = (time.perf_counter() - started) / 200
+
+        return {
+            "benchmark": "similar_cases",
+            "config": vars(args),
+            "results": {
+                "clusters": len(base.centroids),
+                "generate_seconds": round(generate_seconds, 3),
+                "segment_build_seconds": round(segment_seconds, 3),
+                "query": percentiles(single),
+                "query_per_user": percentiles(per_user),
+                "batched_queries_per_second": round(len(queries) / batched_seconds, 1),
+                "recall_at_k": round(recall, 4),
+                "score_ratio_at_k": round(float(np.mean(score_ratios)), 4),
+                "vectorize_query_ms": round(vectorize * 1000, 3),
+                "text_build_cases_per_second": round(args.text_rows / text_seconds, 1),
+                "text_query_nonempty": bool(text_index.search_vectors(vector[None, :], args.k)[0]),
+            },
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000, help="cases in the synthetic base segment")
+    parser.add_argument("--dimensions", type=int, default=256, help="vector dimensions")
+    parser.add_argument("--topics", type=int, default=2000, help="distinct faults the synthetic cases scatter around")
+    parser.add_argument("--noise", type=float, default=0.5, help="per-dimension spread of cases around their fault")
+    parser.add_argument("--users", type=int, default=50, help="users the cases are spread over")
+    parser.add_argument("--queries", type=int, default=500, help="queries timed")
+    parser.add_argument("--batch", type=int, default=64, help="queries per batched search")
+    parser.add_argument("--k", type=int, default=5, help="cases returned per query")
+    parser.add_argument("--recall-queries", type=int, default=50, help="queries checked against an exact scan")
+    parser.add_argument("--probes", type=int, default=8, help="clusters scanned per query")
+    parser.add_argument("--exact-max-rows", type=int, default=20000, help="largest base scanned whole")
+    parser.add_argument("--text-rows", type=int, default=20000, help="cases built through the text vectorizer")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,89 @@
+"""
+Flush policy benchmark.
+
+Streams diagnostics over the WebSocket from a local fake upstream and
+reports time-to-first-chunk, frame count and frames per second for each
+flush policy, so time-to-first-byte can be traded against frame count.
+
+    python -m benchmarks.streaming --tokens 300 --tps 150
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from benchmarks.common import ServerThread, install_fake_openai, percentiles
+
+import httpx
+import websockets
+
+import app.main as main
+from app.services.diagnostic_cache import diagnostic_cache
+
+POLICIES = {
+    "token": "flush=token",
+    "bytes-10": "flush=bytes&flush_bytes=10",
+    "bytes-64": "flush=bytes&flush_bytes=64",
+    "time-30ms": "flush=time&flush_ms=30",
+    "sentence": "flush=sentence",
+}
+
+
+async def stream_once(url: str) -> dict:
+    async with websockets.connect(url) as socket:
+        await socket.recv()  # session info
+        await socket.send(json.dumps({"input": f"misfire {uuid.uuid4().hex}"}))
+        sent = time.perf_counter()
+        first_chunk = None
+        frames = 0
+        while True:
+            message = json.loads(await socket.recv())
+            if "chunk" in message:
+                frames += 1
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - sent
+            if "complete" in message or "error" in message:
+                break
+        elapsed = time.perf_counter() - sent
+    return {"first_chunk": first_chunk or elapsed, "frames": frames, "elapsed": elapsed}
+
+
+async def run(args) -> dict:
+    install_fake_openai(tokens=args.tokens, tokens_per_second=args.tps, first_token_delay=args.first_token_delay)
+    # Every request must reach the fake upstream
+    diagnostic_cache.memory.max_entries = 0
+    diagnostic_cache.disk = None
+
+    results = {}
+    with ServerThread(main.app) as server:
+        async with httpx.AsyncClient(base_url=server.base_url) as client:
+            await client.post("/auth/register", json={"email": "stream@example.com", "password": "benchmark"})
+            response = await client.post("/auth/login", data={"username": "stream@example.com", "password": "benchmark"})
+            token = response.json()["access_token"]
+
+        for name, query in POLICIES.items():
+            url = f"{server.ws_url}/ws/diagnostics/0?token={token}&{query}"
+            runs = await asyncio.gather(*(stream_once(url) for _ in range(args.streams)))
+            frames = sum(r["frames"] for r in runs)
+            results[name] = {
+                "first_chunk": percentiles([r["first_chunk"] for r in runs]),
+                "frames_per_stream": round(frames / len(runs), 1),
+                "frames_per_second": round(sum(r["frames"] / r["elapsed"] for r in runs) / len(runs), 1),
+            }
+
+    return {"benchmark": "streaming", "config": vars(args), "policies": results}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=10, help="concurrent streams per policy")
+    parser.add_argument("--tokens", type=int, default=200, help="tokens per fake completion")
+    parser.add_argument("--tps", type=float, default=200.0, help="fake upstream tokens per second")
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="fake upstream time to first token")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
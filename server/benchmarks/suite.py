@@ -0,0 +1,297 @@
+"""
+End-to-end benchmark suite.
+
+Starts app.main:app with uvicorn in a child process. The model provider is
+the local stub (LLM_PROVIDER=stub), so runs need no network. The suite
+drives these mixes:
+
+  login_burst      concurrent registrations, then concurrent logins
+  ws_streams       N WebSocket diagnostic streams at once
+  session_listing  paging through a large session history, plus session detail
+  orders           POST /predict-parts and POST /summarize-order
+
+It reports throughput, p50/p95/p99 latency, time to first chunk and server
+memory per open WebSocket. By default the database is a throwaway SQLite
+file. Pass --database-url to run against Postgres or a Postgres-compatible
+server; that database should be empty and disposable.
+
+Write results to a file and compare two runs with benchmarks.compare:
+
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --output after.json
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import time
+import uuid
+
+from benchmarks.common import ServerProcess, percentiles, seed_session_history, seed_sessions, seed_users
+
+import httpx
+import websockets
+
+SCENARIOS = ("login_burst", "ws_streams", "session_listing", "orders")
+
+
+def throughput(count: int, elapsed: float) -> float:
+    return round(count / elapsed, 2) if elapsed > 0 else 0.0
+
+
+async def login_burst(server: ServerProcess, args) -> dict:
+    run_id = uuid.uuid4().hex[:8]
+    emails = [f"burst-{run_id}-{i}@example.com" for i in range(args.logins)]
+    limits = httpx.Limits(max_connections=args.logins)
+    results = {}
+    async with httpx.AsyncClient(base_url=server.base_url, limits=limits, timeout=120) as client:
+        for phase, request in (
+            ("register", lambda email: client.post("/auth/register", json={"email": email, "password": "benchmark"})),
+            ("login", lambda email: client.post("/auth/login", data={"username": email, "password": "benchmark"})),
+        ):
+            samples, statuses = [], {}
+
+            async def call(email):
+                started = time.perf_counter()
+                response = await request(email)
+                samples.append(time.perf_counter() - started)
+                statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(call(email) for email in emails))
+            elapsed = time.perf_counter() - started
+            results[phase] = {
+                "latency": percentiles(samples),
+                "throughput_per_s": throughput(statuses.get("200", 0), elapsed),
+                "statuses": statuses,
+            }
+    return results
+
+
+async def ws_streams(server: ServerProcess, args) -> dict:
+    users = seed_users(f"stream-{uuid.uuid4().hex[:8]}-", args.streams)
+    rss_idle = server.rss_kb()
+
+    sockets = [
+        await websockets.connect(f"{server.ws_url}/ws/diagnostics/0?token={user['token']}", max_queue=None)
+        for user in users
+    ]
+    try:
+        for socket in sockets:
+            await socket.recv()  # session info
+        await asyncio.sleep(0.5)
+        rss_connected = server.rss_kb()
+
+        first_chunk, gaps, totals, errors = [], [], [], []
+        rss_peak = [rss_connected or 0]
+
+        async def sample_rss(stop: asyncio.Event):
+            while not stop.is_set():
+                rss_peak[0] = max(rss_peak[0], server.rss_kb() or 0)
+                await asyncio.sleep(0.05)
+
+        async def stream(socket):
+            sent = last = time.perf_counter()
+            first = True
+            await socket.send(json.dumps({"input": f"P0300 misfire {uuid.uuid4().hex}"}))
+            while True:
+                message = json.loads(await socket.recv())
+                if "type" in message:
+                    continue  # pushed event from the connection manager
+                now = time.perf_counter()
+                if "error" in message:
+                    errors.append(message["error"])
+                    return
+                if "complete" in message:
+                    totals.append(now - sent)
+                    return
+                if first:
+                    first_chunk.append(now - sent)
+                    first = False
+                else:
+                    gaps.append(now - last)
+                last = now
+
+        stop = asyncio.Event()
+        sampler = asyncio.ensure_future(sample_rss(stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(stream(socket) for socket in sockets))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await sampler
+    finally:
+        await asyncio.gather(*(socket.close() for socket in sockets), return_exceptions=True)
+
+    per_connection = None
+    if rss_idle is not None and rss_connected is not None:
+        per_connection = round((rss_connected - rss_idle) / len(sockets), 2)
+    return {
+        "streams": len(sockets),
+        "time_to_first_chunk": percentiles(first_chunk),
+        "chunk_gap": percentiles(gaps),
+        "stream_total": percentiles(totals),
+        "throughput_per_s": throughput(len(totals), elapsed),
+        "errors": len(errors),
+        "rss_idle_kb": rss_idle,
+        "rss_connected_kb": rss_connected,
+        "rss_peak_kb": rss_peak[0] or None,
+        "rss_per_connection_kb": per_connection,
+    }
+
+
+async def session_listing(server: ServerProcess, args) -> dict:
+    email = f"history-{uuid.uuid4().hex[:8]}@example.com"
+    seed_sessions(email, args.history)
+    detail_id = seed_session_history(email, args.turns)
+
+    page_samples, detail_samples = [], []
+    async with httpx.AsyncClient(base_url=server.base_url, timeout=120) as client:
+        response = await client.post("/auth/login", data={"username": email, "password": "benchmark"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        async def page_through():
+            cursor = None
+            while True:
+                url = "/sessions?limit=50" + (f"&cursor={cursor}" if cursor else "")
+                started = time.perf_counter()
+                response = await client.get(url, headers=headers)
+                page_samples.append(time.perf_counter() - started)
+                cursor = response.headers.get("X-Next-Cursor")
+                if not cursor:
+                    return
+
+        async def details():
+            for _ in range(args.detail_requests):
+                started = time.perf_counter()
+                await client.get(f"/sessions/{detail_id}", headers=headers)
+                detail_samples.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(page_through() for _ in range(args.readers)), details())
+        elapsed = time.perf_counter() - started
+
+    return {
+        "history_sessions": args.history + 1,
+        "detail_turns": args.turns,
+        "page": percentiles(page_samples),
+        "detail": percentiles(detail_samples),
+        "throughput_per_s": throughput(len(page_samples) + len(detail_samples), elapsed),
+    }
+
+
+async def orders(server: ServerProcess, args) -> dict:
+    email = f"orders-{uuid.uuid4().hex[:8]}@example.com"
+    session_ids = [seed_session_history(email, 1, parts=0) for _ in range(args.orders)]
+
+    samples = {"predict_parts": [], "summarize_order": []}
+    failures = 0
+    limits = httpx.Limits(max_connections=args.orders * 2)
+    async with httpx.AsyncClient(base_url=server.base_url, limits=limits, timeout=120) as client:
+        response = await client.post("/auth/login", data={"username": email, "password": "benchmark"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        async def order(session_id):
+            nonlocal failures
+            for step, url in (
+                ("predict_parts", f"/predict-parts?session_id={session_id}"),
+                ("summarize_order", f"/summarize-order?session_id={session_id}&notes=order-{session_id}"),
+            ):
+                started = time.perf_counter()
+                response = await client.post(url, headers=headers)
+                samples[step].append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(order(session_id) for session_id in session_ids))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "predict_parts": percentiles(samples["predict_parts"]),
+        "summarize_order": percentiles(samples["summarize_order"]),
+        "throughput_per_s": throughput(len(session_ids), elapsed),
+        "failures": failures,
+    }
+
+
+def environment(database_url: str) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        # Scheme only; never record credentials
+        "database": database_url.split(":", 1)[0],
+    }
+
+
+async def run(args) -> dict:
+    server_env = {
+        "DATABASE_URL": os.environ["DATABASE_URL"],
+        "LLM_STUB_LATENCY": str(args.latency),
+        "LLM_STUB_TOKENS_PER_SECOND": str(args.tps),
+        "LLM_STUB_ERROR_RATE": str(args.error_rate),
+    }
+    # Create the schema before the server and seeders race to do it
+    from app.database import Base, engine
+    import app.models  # noqa: F401
+    Base.metadata.create_all(bind=engine)
+
+    results = {}
+    with ServerProcess(server_env) as server:
+        for name in args.scenarios:
+            started = time.perf_counter()
+            results[name] = await globals()[name](server, args)
+            results[name]["elapsed_s"] = round(time.perf_counter() - started, 3)
+
+    return {
+        "benchmark": "suite",
+        "config": {key: value for key, value in vars(args).items() if key != "database_url"},
+        "environment": environment(os.environ["DATABASE_URL"]),
+        "scenarios": results,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=list(SCENARIOS),
+                        help=f"comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--database-url", help="run against this database instead of a temporary SQLite file")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    parser.add_argument("--logins", type=int, default=50, help="concurrent registrations/logins in the burst")
+    parser.add_argument("--streams", type=int, default=50, help="concurrent WebSocket diagnostic streams")
+    parser.add_argument("--history", type=int, default=5000, help="sessions in the listed history")
+    parser.add_argument("--turns", type=int, default=300, help="diagnostic results in the detail session")
+    parser.add_argument("--readers", type=int, default=4, help="concurrent clients paging the history")
+    parser.add_argument("--detail-requests", type=int, default=50, help="sequential session detail requests")
+    parser.add_argument("--orders", type=int, default=30, help="concurrent predict-parts + summary flows")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub first-token latency in seconds")
+    parser.add_argument("--tps", type=float, default=200.0, help="stub tokens per second")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="stub retryable error probability")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.database_url:
+        # Must happen before anything imports app.database
+        os.environ["DATABASE_URL"] = args.database_url
+
+    results = asyncio.run(run(args))
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,115 @@
+"""
+Offline throughput benchmark.
+
+Answers every model call from the local StubProvider, so no network or API
+key is needed, and drives the full order flow concurrently: a diagnostic
+over the WebSocket, then POST /predict-parts and POST /summarize-order for
+the same session. Reports per-step latency and completed flows per second.
+With a fixed stub latency and tokens/sec the difference between commits is
+our own overhead.
+
+    python -m benchmarks.throughput --users 20 --duration 10 --latency 0.05 --tps 200
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import ServerThread, install_stub_provider, percentiles
+
+import httpx
+import websockets
+
+import app.main as main
+from app.services.diagnostic_cache import diagnostic_cache
+
+
+async def login(client: httpx.AsyncClient, email: str, password: str = "benchmark") -> str:
+    await client.post("/auth/register", json={"email": email, "password": password})
+    response = await client.post("/auth/login", data={"username": email, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def diagnose(ws_url: str, token: str, turn: int) -> int:
+    async with websockets.connect(f"{ws_url}/ws/diagnostics/0?token={token}") as socket:
+        session_id = json.loads(await socket.recv())["session_id"]
+        await socket.send(json.dumps({"input": f"P0300 random misfire, turn {turn}"}))
+        while True:
+            message = json.loads(await socket.recv())
+            if "type" in message:
+                continue  # pushed event from the connection manager
+            if "error" in message:
+                raise RuntimeError(message["error"])
+            if "complete" in message:
+                return session_id
+
+
+async def user_flow(client: httpx.AsyncClient, ws_url: str, token: str, stop_at: float, samples: dict, errors: list):
+    headers = {"Authorization": f"Bearer {token}"}
+    turn = 0
+    while time.perf_counter() < stop_at:
+        turn += 1
+        try:
+            started = time.perf_counter()
+            session_id = await diagnose(ws_url, token, turn)
+            samples["diagnostic"].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            response = await client.post(f"/predict-parts?session_id={session_id}", headers=headers)
+            response.raise_for_status()
+            samples["predict_parts"].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            response = await client.post(f"/summarize-order?session_id={session_id}", headers=headers)
+            response.raise_for_status()
+            samples["summarize_order"].append(time.perf_counter() - started)
+        except Exception as e:
+            errors.append(str(e))
+
+
+async def run(args) -> dict:
+    install_stub_provider(latency=args.latency, tokens_per_second=args.tps, error_rate=args.error_rate)
+    if not args.cache:
+        diagnostic_cache.memory.max_entries = 0
+        diagnostic_cache.disk = None
+
+    samples = {"diagnostic": [], "predict_parts": [], "summarize_order": []}
+    errors = []
+    with ServerThread(main.app) as server:
+        limits = httpx.Limits(max_connections=args.users * 2)
+        async with httpx.AsyncClient(base_url=server.base_url, limits=limits, timeout=120) as client:
+            tokens = [await login(client, f"throughput{i}@example.com") for i in range(args.users)]
+            stop_at = time.perf_counter() + args.duration
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                user_flow(client, server.ws_url, token, stop_at, samples, errors) for token in tokens
+            ))
+            elapsed = time.perf_counter() - started
+            scheduler = (await client.get("/metrics/llm-scheduler")).json()
+
+    return {
+        "benchmark": "throughput",
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 3),
+        "flows_per_s": round(len(samples["summarize_order"]) / elapsed, 2),
+        "latency": {step: percentiles(values) for step, values in samples.items()},
+        "errors": len(errors),
+        "llm_scheduler": scheduler,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="concurrent users running the order flow")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to keep starting flows")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub first-token latency in seconds")
+    parser.add_argument("--tps", type=float, default=200.0, help="stub tokens per second")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="stub retryable error probability")
+    parser.add_argument("--cache", action="store_true", help="keep the diagnostic cache enabled")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
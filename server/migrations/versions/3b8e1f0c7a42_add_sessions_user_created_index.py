@@ -0,0 +1,30 @@
+"""add sessions user_id created_at index
+
+Revision ID: 3b8e1f0c7a42
+Revises: f34465c89edd
+Create Date: 2026-10-18 16:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e1f0c7a42'
+down_revision = 'f34465c89edd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Keyset pagination for GET /sessions: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+    op.create_index(
+        'ix_sessions_user_id_created_at',
+        'sessions',
+        ['user_id', sa.text('created_at DESC'), sa.text('id DESC')],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_sessions_user_id_created_at', table_name='sessions')
@@ -0,0 +1,31 @@
+"""add session_id indexes on child tables
+
+Revision ID: 7d2c9a4e5b13
+Revises: 3b8e1f0c7a42
+Create Date: 2026-10-18 16:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2c9a4e5b13'
+down_revision = '3b8e1f0c7a42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Every session view, parts prediction and summary looks children up by session_id
+    op.create_index('ix_diagnostic_results_session_id_created_at', 'diagnostic_results', ['session_id', 'created_at'], unique=False)
+    op.create_index(op.f('ix_part_predictions_session_id'), 'part_predictions', ['session_id'], unique=False)
+    op.create_index(op.f('ix_repair_notes_session_id'), 'repair_notes', ['session_id'], unique=False)
+    op.create_index('ix_repair_summaries_session_id_created_at', 'repair_summaries', ['session_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_repair_summaries_session_id_created_at', table_name='repair_summaries')
+    op.drop_index(op.f('ix_repair_notes_session_id'), table_name='repair_notes')
+    op.drop_index(op.f('ix_part_predictions_session_id'), table_name='part_predictions')
+    op.drop_index('ix_diagnostic_results_session_id_created_at', table_name='diagnostic_results')
@@ -0,0 +1,27 @@
+"""add owner and heartbeat to jobs
+
+Revision ID: b7f2d9e4c160
+Revises: e2c4a7b91f36
+Create Date: 2026-10-18 23:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7f2d9e4c160'
+down_revision = 'e2c4a7b91f36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing jobs have no heartbeat and are judged by updated_at
+    op.add_column('jobs', sa.Column('owner', sa.String(), nullable=True))
+    op.add_column('jobs', sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('jobs', 'heartbeat_at')
+    op.drop_column('jobs', 'owner')
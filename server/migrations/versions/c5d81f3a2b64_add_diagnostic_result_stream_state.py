@@ -0,0 +1,29 @@
+"""add streaming state to diagnostic results
+
+Revision ID: c5d81f3a2b64
+Revises: a41c6e2d9f07
+Create Date: 2026-10-18 19:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d81f3a2b64'
+down_revision = 'a41c6e2d9f07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing rows were written in one piece at the end of the stream
+    op.add_column('diagnostic_results', sa.Column('status', sa.String(), server_default='complete', nullable=True))
+    op.add_column('diagnostic_results', sa.Column('output_length', sa.Integer(), nullable=True))
+    op.add_column('diagnostic_results', sa.Column('output_hash', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('diagnostic_results', 'output_hash')
+    op.drop_column('diagnostic_results', 'output_length')
+    op.drop_column('diagnostic_results', 'status')
@@ -0,0 +1,25 @@
+"""add updated_at to diagnostic results
+
+Revision ID: d9a5c3e71b28
+Revises: b7f2d9e4c160
+Create Date: 2026-10-19 00:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9a5c3e71b28'
+down_revision = 'b7f2d9e4c160'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing rows have no checkpoint time and are judged by created_at
+    op.add_column('diagnostic_results', sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('diagnostic_results', 'updated_at')
@@ -0,0 +1,181 @@
+"""add full-text search index
+
+Revision ID: e2c4a7b91f36
+Revises: e8b3f61d0a95
+Create Date: 2026-10-18 22:30:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2c4a7b91f36'
+down_revision = 'e8b3f61d0a95'
+branch_labels = None
+depends_on = None
+
+
+# A copy of the index as app/search_index.py defined it at this revision, so later changes
+# there do not change what this migration does
+
+# Documents for the sessions matching {where}
+SQLITE_INSERT = """
+    INSERT INTO search_documents (rowid, input_text, results, parts, summary)
+    SELECT s.id, s.input_text,
+        (SELECT group_concat(coalesce(r.input_message, '') || char(10) || coalesce(r.output_text, ''), char(10) || char(10))
+         FROM diagnostic_results r WHERE r.session_id = s.id AND coalesce(r.status, 'complete') = 'complete'),
+        (SELECT group_concat(p.part_name, char(10)) FROM part_predictions p WHERE p.session_id = s.id),
+        (SELECT group_concat(m.summary_text, char(10) || char(10)) FROM repair_summaries m WHERE m.session_id = s.id)
+    FROM sessions s WHERE {where}
+"""
+
+# (name, event, table, WHEN condition, session id expressions to refresh)
+SQLITE_TRIGGERS = [
+    ("search_sessions_insert", "AFTER INSERT", "sessions", None, ("new.id",)),
+    ("search_sessions_update", "AFTER UPDATE OF input_text", "sessions", None, ("new.id",)),
+    ("search_results_insert", "AFTER INSERT", "diagnostic_results",
+     "coalesce(new.status, 'complete') != 'streaming'", ("new.session_id",)),
+    ("search_results_update", "AFTER UPDATE OF input_message, output_text, status", "diagnostic_results",
+     "coalesce(new.status, 'complete') != 'streaming'", ("new.session_id",)),
+    ("search_results_delete", "AFTER DELETE", "diagnostic_results", None, ("old.session_id",)),
+    ("search_parts_insert", "AFTER INSERT", "part_predictions", None, ("new.session_id",)),
+    ("search_parts_update", "AFTER UPDATE OF part_name, session_id", "part_predictions", None,
+     ("old.session_id", "new.session_id")),
+    ("search_parts_delete", "AFTER DELETE", "part_predictions", None, ("old.session_id",)),
+    ("search_summaries_insert", "AFTER INSERT", "repair_summaries", None, ("new.session_id",)),
+    ("search_summaries_update", "AFTER UPDATE OF summary_text", "repair_summaries", None, ("new.session_id",)),
+    ("search_summaries_delete", "AFTER DELETE", "repair_summaries", None, ("old.session_id",)),
+]
+
+POSTGRES_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS search_documents (
+        session_id integer PRIMARY KEY,
+        input_text text,
+        results text,
+        parts text,
+        summary text,
+        document tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(input_text, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(parts, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(results, '')), 'C') ||
+            setweight(to_tsvector('english', coalesce(summary, '')), 'D')
+        ) STORED
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_search_documents_document ON search_documents USING GIN (document)",
+    """
+    CREATE OR REPLACE FUNCTION search_documents_refresh(target integer) RETURNS void AS $$
+        INSERT INTO search_documents (session_id, input_text, results, parts, summary)
+        SELECT s.id, s.input_text,
+            (SELECT string_agg(concat_ws(E'\\n', r.input_message, r.output_text), E'\\n\\n' ORDER BY r.id)
+             FROM diagnostic_results r WHERE r.session_id = s.id AND coalesce(r.status, 'complete') = 'complete'),
+            (SELECT string_agg(p.part_name, E'\\n' ORDER BY p.id) FROM part_predictions p WHERE p.session_id = s.id),
+            (SELECT string_agg(m.summary_text, E'\\n\\n' ORDER BY m.id) FROM repair_summaries m WHERE m.session_id = s.id)
+        FROM sessions s WHERE s.id = target
+        ON CONFLICT (session_id) DO UPDATE SET
+            input_text = EXCLUDED.input_text,
+            results = EXCLUDED.results,
+            parts = EXCLUDED.parts,
+            summary = EXCLUDED.summary
+    $$ LANGUAGE sql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION search_documents_sync() RETURNS trigger AS $$
+    BEGIN
+        IF TG_TABLE_NAME = 'sessions' THEN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM search_documents WHERE session_id = OLD.id;
+            ELSE
+                PERFORM search_documents_refresh(NEW.id);
+            END IF;
+        ELSE
+            IF TG_OP <> 'INSERT' THEN
+                PERFORM search_documents_refresh(OLD.session_id);
+            END IF;
+            IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.session_id IS DISTINCT FROM OLD.session_id) THEN
+                PERFORM search_documents_refresh(NEW.session_id);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+]
+
+# (name, events, table, WHEN condition)
+POSTGRES_TRIGGERS = [
+    ("search_sync", "INSERT OR UPDATE OF input_text OR DELETE", "sessions", None),
+    ("search_sync_insert", "INSERT", "diagnostic_results", "NEW.status IS DISTINCT FROM 'streaming'"),
+    ("search_sync_update", "UPDATE OF input_message, output_text, status", "diagnostic_results",
+     "NEW.status IS DISTINCT FROM 'streaming'"),
+    ("search_sync_delete", "DELETE", "diagnostic_results", None),
+    ("search_sync", "INSERT OR UPDATE OF part_name, session_id OR DELETE", "part_predictions", None),
+    ("search_sync", "INSERT OR UPDATE OF summary_text OR DELETE", "repair_summaries", None),
+]
+
+
+def sqlite_upgrade():
+    statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_documents USING fts5("
+        "input_text, results, parts, summary, tokenize = 'porter unicode61')",
+        "CREATE TRIGGER IF NOT EXISTS search_sessions_delete AFTER DELETE ON sessions "
+        "BEGIN DELETE FROM search_documents WHERE rowid = old.id; END",
+    ]
+    for name, when, table, condition, ids in SQLITE_TRIGGERS:
+        body = "".join(
+            f"DELETE FROM search_documents WHERE rowid = {session_id}; "
+            + SQLITE_INSERT.format(where=f"s.id = {session_id}") + "; "
+            for session_id in ids
+        )
+        guard = f" WHEN {condition}" if condition else ""
+        statements.append(f"CREATE TRIGGER IF NOT EXISTS {name} {when} ON {table}{guard} BEGIN {body} END")
+    # Backfill every existing session
+    statements.append(SQLITE_INSERT.format(where="s.id NOT IN (SELECT rowid FROM search_documents)"))
+    return statements
+
+
+def postgres_upgrade():
+    statements = list(POSTGRES_DDL)
+    for name, events, table, condition in POSTGRES_TRIGGERS:
+        guard = f" WHEN ({condition})" if condition else ""
+        statements.append(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+        statements.append(
+            f"CREATE TRIGGER {name} AFTER {events} ON {table} FOR EACH ROW{guard} "
+            "EXECUTE FUNCTION search_documents_sync()"
+        )
+    statements.append(
+        "SELECT search_documents_refresh(s.id) FROM sessions s "
+        "WHERE NOT EXISTS (SELECT 1 FROM search_documents d WHERE d.session_id = s.id)"
+    )
+    return statements
+
+
+def upgrade() -> None:
+    # Index table, sync triggers and a backfill of existing sessions (SQLite FTS5 or Postgres tsvector/GIN)
+    dialect = op.get_context().dialect.name
+    if dialect == "sqlite":
+        statements = sqlite_upgrade()
+    elif dialect == "postgresql":
+        statements = postgres_upgrade()
+    else:
+        statements = []
+    for statement in statements:
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    dialect = op.get_context().dialect.name
+    if dialect == "sqlite":
+        names = ["search_sessions_delete"] + [name for name, *_ in SQLITE_TRIGGERS]
+        statements = [f"DROP TRIGGER IF EXISTS {name}" for name in names] + ["DROP TABLE IF EXISTS search_documents"]
+    elif dialect == "postgresql":
+        statements = [f"DROP TRIGGER IF EXISTS {name} ON {table}" for name, _, table, _ in POSTGRES_TRIGGERS] + [
+            "DROP FUNCTION IF EXISTS search_documents_sync()",
+            "DROP FUNCTION IF EXISTS search_documents_refresh(integer)",
+            "DROP TABLE IF EXISTS search_documents",
+        ]
+    else:
+        statements = []
+    for statement in statements:
+        op.execute(statement)
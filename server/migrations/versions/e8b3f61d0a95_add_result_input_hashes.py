@@ -0,0 +1,34 @@
+"""add input hashes to part predictions and repair summaries
+
+Revision ID: e8b3f61d0a95
+Revises: c5d81f3a2b64
+Create Date: 2026-10-18 21:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b3f61d0a95'
+down_revision = 'c5d81f3a2b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Rows written before this have no hash and are regenerated once on their next call
+    op.add_column('part_predictions', sa.Column('input_hash', sa.String(), nullable=True))
+    op.add_column('repair_summaries', sa.Column('input_hash', sa.String(), nullable=True))
+    op.create_index('ix_part_predictions_session_id_input_hash', 'part_predictions', ['session_id', 'input_hash'], unique=False)
+    op.create_index('ix_repair_summaries_session_id_input_hash', 'repair_summaries', ['session_id', 'input_hash'], unique=False)
+    # The (session_id, input_hash) index serves session_id lookups on its own
+    op.drop_index('ix_part_predictions_session_id', table_name='part_predictions')
+
+
+def downgrade() -> None:
+    op.create_index('ix_part_predictions_session_id', 'part_predictions', ['session_id'], unique=False)
+    op.drop_index('ix_repair_summaries_session_id_input_hash', table_name='repair_summaries')
+    op.drop_index('ix_part_predictions_session_id_input_hash', table_name='part_predictions')
+    op.drop_column('repair_summaries', 'input_hash')
+    op.drop_column('part_predictions', 'input_hash')
@@ -0,0 +1,99 @@
+"""
+Diagnostic cache keys match the same codes and symptoms however they are
+written, and the memory and SQLite tiers expire, evict and share entries.
+"""
+import asyncio
+import time
+
+import pytest
+
+from app.services.diagnostic_cache import (
+    DiagnosticCache, LRUCache, cache_key, extract_obd_codes, normalize_symptoms
+)
+
+
+def test_extract_obd_codes():
+    assert extract_obd_codes("p0300 then P0420, P0300 again and u0100") == ["P0300", "P0420", "U0100"]
+    # Not codes: wrong letter, too short, part of a longer word, non-hex digits
+    assert extract_obd_codes("X0300 P030 P04200 AP0420 P0G00") == []
+    assert extract_obd_codes(None) == []
+
+
+def test_normalize_symptoms():
+    assert normalize_symptoms("P0420 p0300  Rough idle.") == (["P0300", "P0420"], "rough idle")
+    assert normalize_symptoms("p0300, P0420 rough idle") == (["P0300", "P0420"], "rough idle")
+    assert normalize_symptoms("  Squeal -- on COLD start!! ") == ([], "squeal on cold start")
+    assert normalize_symptoms("") == ([], "")
+
+
+@pytest.mark.parametrize("text", [
+    "P0420 p0300 Rough idle.",
+    "p0300, P0420 rough idle",
+    "ROUGH IDLE p0420 P0300 p0420",
+    "rough\n\tidle; P0300/P0420",
+])
+def test_equivalent_inputs_share_a_key(text):
+    assert cache_key(text) == cache_key("P0300 P0420 rough idle")
+
+
+@pytest.mark.parametrize("text", [
+    "P0300 rough idle",
+    "P0300 P0420 rough idle at speed",
+    "P0300 P0421 rough idle",
+    "P0300 P0420 idle rough",
+])
+def test_different_inputs_get_different_keys(text):
+    assert cache_key(text) != cache_key("P0300 P0420 rough idle")
+
+
+def test_namespace_and_cases_are_part_of_the_key():
+    base = cache_key("P0420 rough idle")
+    assert cache_key("P0420 rough idle", namespace="parts") != base
+    # No cases is the ungrounded key; a case set matches in any order
+    assert cache_key("P0420 rough idle", cases=[]) == base
+    assert cache_key("p0420 Rough idle", cases=[7, 3]) == cache_key("P0420 rough idle", cases=[3, 7])
+    assert cache_key("P0420 rough idle", cases=[3, 7]) not in {base, cache_key("P0420 rough idle", cases=[3, 8])}
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_lru_expires_entries(monkeypatch):
+    cache = LRUCache(max_entries=4, ttl=10)
+    cache.set("a", 1)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_disk_tier_is_shared_and_counts_saved_latency(tmp_path):
+    path = str(tmp_path / "cache.db")
+
+    async def run():
+        first = DiagnosticCache(max_entries=8, ttl=60, path=path)
+        await first.set("key", "answer", 2.5)
+        # Another worker sees the entry through the disk tier, then from memory
+        second = DiagnosticCache(max_entries=8, ttl=60, path=path)
+        hits = [await second.get("key"), await second.get("key"), await second.get("other")]
+        return hits, second.stats()
+
+    hits, stats = asyncio.run(run())
+    assert hits == ["answer", "answer", None]
+    assert stats["hits"] == 2
+    assert stats["disk_hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["saved_latency_seconds"] == 5.0
+
+
+def test_disabled_without_memory_or_disk():
+    assert not DiagnosticCache(max_entries=0, path=None).enabled
+    assert DiagnosticCache(max_entries=1, path=None).enabled
@@ -0,0 +1,202 @@
+"""
+LLMScheduler against a local fake upstream: priority admission, the
+requests/tokens buckets, and retries on 429 and 5xx.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+import pytest
+
+from app.services.llm_providers import ChatResult, ProviderError
+from app.services.llm_scheduler import (
+    LLMScheduler, PRIORITY_BATCH, PRIORITY_INTERACTIVE, TokenBucket, UpstreamError
+)
+from benchmarks import llm_scheduler as benchmark
+
+
+@pytest.fixture(autouse=True)
+def quiet_retries():
+    # Retries are expected in these tests
+    logging.getLogger("app.services.llm_scheduler").setLevel(logging.ERROR)
+    random.seed(0)
+
+
+def scheduler(**overrides) -> LLMScheduler:
+    options = dict(max_concurrency=4, requests_per_minute=0, tokens_per_minute=0,
+                   max_retries=4, base_delay=0.01, max_delay=0.05)
+    options.update(overrides)
+    return LLMScheduler(**options)
+
+
+def test_interactive_calls_overtake_queued_batch_calls():
+    async def run():
+        limiter = scheduler(max_concurrency=1)
+        order = []
+
+        def call(name):
+            async def answer():
+                order.append(name)
+                await asyncio.sleep(0.01)
+                return ChatResult("ok")
+            return answer
+
+        batch = [asyncio.ensure_future(limiter.complete(call(f"batch-{i}"), priority=PRIORITY_BATCH))
+                 for i in range(5)]
+        await asyncio.sleep(0.005)
+        interactive = asyncio.ensure_future(limiter.complete(call("interactive"), priority=PRIORITY_INTERACTIVE))
+        await asyncio.gather(interactive, *batch)
+        return order
+
+    order = asyncio.run(run())
+    # The first batch call was already running; the interactive one goes next
+    assert order[:2] == ["batch-0", "interactive"]
+
+
+def test_interactive_waits_less_than_batch_under_load():
+    args = argparse.Namespace(
+        interactive=10, batch=40, arrival_ms=5.0, concurrency=4, rpm=6000,
+        upstream_concurrency=3, upstream_rpm=10000, latency=0.02, error_rate=0.05,
+    )
+    results = asyncio.run(benchmark.run(args))["results"]
+
+    assert results["failures"] == {"interactive": 0, "batch": 0}
+    waits = results["scheduler"]["wait_avg_ms"]
+    assert waits["interactive"] < waits["batch"]
+    # The fake pushed back, and every push-back was retried
+    rejected = sum(count for status, count in results["upstream_status_counts"].items() if status != 200)
+    assert rejected > 0
+    assert results["scheduler"]["retries"] == rejected
+
+
+def test_token_bucket_delay_and_credit():
+    bucket = TokenBucket(per_minute=6000)
+    assert bucket.delay(100) == 0.0
+    bucket.take(6000)
+    # 100 tokens/s refill
+    assert bucket.delay(50) == pytest.approx(0.5, abs=0.02)
+    bucket.credit(50)
+    assert bucket.delay(50) == 0.0
+    # A request larger than the bucket waits for a full bucket, not forever
+    assert TokenBucket(per_minute=60).delay(1000) == 0.0
+
+
+def test_tokens_per_minute_limit_delays_admission():
+    async def run():
+        limiter = scheduler(tokens_per_minute=6000)
+        limiter.tokens.level = 0
+
+        async def answer():
+            return ChatResult("ok", total_tokens=30)
+
+        started = time.monotonic()
+        await limiter.complete(answer, estimated_tokens=30)
+        return time.monotonic() - started
+
+    # 30 tokens at 100 tokens/s
+    assert asyncio.run(run()) == pytest.approx(0.3, abs=0.1)
+
+
+def test_requests_per_minute_limit_delays_admission():
+    async def run():
+        limiter = scheduler(requests_per_minute=600)
+        limiter.requests.level = 0
+
+        async def answer():
+            return ChatResult("ok")
+
+        started = time.monotonic()
+        await asyncio.gather(*(limiter.complete(answer) for _ in range(3)))
+        return time.monotonic() - started
+
+    # 3 requests at 10 requests/s
+    assert asyncio.run(run()) == pytest.approx(0.3, abs=0.1)
+
+
+def test_retries_after_429_and_honours_retry_after():
+    async def run():
+        limiter = scheduler()
+        calls = []
+
+        async def answer():
+            calls.append(time.monotonic())
+            if len(calls) <= 2:
+                raise ProviderError("Rate limit reached", http_status=429, retry_after=0.1)
+            return ChatResult("ok")
+
+        result = await limiter.complete(answer)
+        return result, calls, limiter.stats()
+
+    result, calls, stats = asyncio.run(run())
+    assert result.text == "ok"
+    assert len(calls) == 3
+    assert all(later - earlier >= 0.09 for earlier, later in zip(calls, calls[1:]))
+    assert stats["retries"] == 2
+    assert stats["rate_limited"] == 2
+    assert stats["failures"] == 0
+    assert stats["in_flight"] == 0
+
+
+def test_non_retryable_error_fails_at_once():
+    async def run():
+        limiter = scheduler()
+        calls = []
+
+        async def answer():
+            calls.append(1)
+            raise ProviderError("Bad request", http_status=400)
+
+        with pytest.raises(UpstreamError):
+            await limiter.complete(answer)
+        return calls, limiter.stats()
+
+    calls, stats = asyncio.run(run())
+    assert len(calls) == 1
+    assert stats["retries"] == 0
+    assert stats["failures"] == 1
+
+
+def test_gives_up_after_max_retries():
+    async def run():
+        limiter = scheduler(max_retries=2)
+        calls = []
+
+        async def answer():
+            calls.append(1)
+            raise ProviderError("Overloaded", http_status=503)
+
+        with pytest.raises(UpstreamError):
+            await limiter.complete(answer)
+        return calls, limiter.stats()
+
+    calls, stats = asyncio.run(run())
+    assert len(calls) == 3
+    assert stats["failures"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_stream_open_is_retried_after_429():
+    async def run():
+        limiter = scheduler()
+        opened = []
+
+        async def open_stream():
+            opened.append(1)
+            if len(opened) == 1:
+                raise ProviderError("Rate limit reached", http_status=429, retry_after=0.05)
+
+            async def tokens():
+                for token in ("a", "b", "c"):
+                    yield token
+            return tokens()
+
+        chunks = [chunk async for chunk in limiter.stream(open_stream)]
+        return chunks, opened, limiter.stats()
+
+    chunks, opened, stats = asyncio.run(run())
+    assert chunks == ["a", "b", "c"]
+    assert len(opened) == 2
+    assert stats["rate_limited"] == 1
+    assert stats["failures"] == 0
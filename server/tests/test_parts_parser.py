@@ -0,0 +1,107 @@
+"""
+PartsArrayParser on streamed answers: objects split across chunks at any
+point, escapes and brackets inside strings, and what is left for repair.
+"""
+import json
+import random
+
+import pytest
+
+from app.services.parts_parser import PartsArrayParser, validate_part
+
+PARTS = [
+    {"id": "p1", "name": "Ignition Coil {cyl 3}", "confidence": 0.9, "price": "$40-$80"},
+    {"id": "p2", "name": "Spark Plug \"Iridium\" [set]", "confidence": 0.7, "price": "$30-$60"},
+    {"id": "p3", "name": "Back\\slash \\\"Sensor\\\"", "confidence": 0.4, "price": "$10-$20"},
+]
+
+ANSWER = json.dumps({"notes": ["[not parts]", {"x": "}"}], "parts": PARTS, "after": [{"name": "ignored"}]})
+
+
+def feed_all(chunks):
+    parser = PartsArrayParser()
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    return parser, items
+
+
+def split_at(text, cuts):
+    bounds = [0] + sorted(cuts) + [len(text)]
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+def test_whole_answer():
+    parser, items = feed_all([ANSWER])
+    assert items == PARTS
+    assert parser.found and parser.closed
+    assert parser.malformed == []
+    assert parser.text == ANSWER
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_fixed_size_chunks(size):
+    parser, items = feed_all([ANSWER[i:i + size] for i in range(0, len(ANSWER), size)])
+    assert items == PARTS
+    assert parser.closed
+    assert parser.text == ANSWER
+
+
+def test_random_splits():
+    rng = random.Random(0)
+    for _ in range(200):
+        cuts = rng.sample(range(1, len(ANSWER)), rng.randint(1, 20))
+        parser, items = feed_all(split_at(ANSWER, cuts))
+        assert items == PARTS, cuts
+
+
+def test_every_split_inside_an_escape():
+    # Cut right after each backslash, so the escaped character starts the next chunk
+    for cut in [i + 1 for i, char in enumerate(ANSWER) if char == "\\"]:
+        _, items = feed_all(split_at(ANSWER, [cut]))
+        assert items == PARTS, cut
+
+
+def test_parts_key_split_across_chunks():
+    answer = '{"pa' + 'rts": [{"name": "Thermostat", "confidence": 0.5, "price": "$20"}]}'
+    cut = answer.index("rts")
+    _, items = feed_all([answer[:cut], answer[cut:]])
+    assert [item["name"] for item in items] == ["Thermostat"]
+
+
+def test_fenced_bare_array():
+    answer = "Here you go:\n```json\n" + json.dumps(PARTS) + "\n```\nLet me know."
+    parser, items = feed_all(split_at(answer, [5, 30, 31, 90]))
+    assert items == PARTS
+    assert parser.closed
+
+
+def test_objects_are_returned_as_soon_as_they_close():
+    parser = PartsArrayParser()
+    first = json.dumps(PARTS[0])
+    assert parser.feed('{"parts": [' + first[:-1]) == []
+    assert parser.feed(first[-1] + ", ") == [PARTS[0]]
+
+
+def test_malformed_and_unfinished_objects():
+    answer = '{"parts": [{"name": "Good", "confidence": 0.5, "price": "$5"}, {"name": bad}, {"name": "Cut'
+    parser, items = feed_all(split_at(answer, [20, 70]))
+    assert [item["name"] for item in items] == ["Good"]
+    assert parser.malformed == ['{"name": bad}']
+    assert parser.found and not parser.closed
+    assert parser.unfinished == '{"name": "Cut'
+
+
+def test_no_parts_array():
+    parser, items = feed_all(['{"answer": "none"}'])
+    assert items == []
+    assert not parser.found
+
+
+def test_validate_part():
+    assert validate_part({"name": " Belt ", "confidence": "0.5", "price": 25}) == (
+        {"name": "Belt", "confidence": 0.5, "price": "$25"}, None)
+    assert validate_part({"name": "", "confidence": 0.5, "price": "$5"})[1] == "name must be a non-empty string"
+    assert validate_part({"name": "Belt", "confidence": 2, "price": "$5"})[1] == \
+        "confidence must be a number between 0 and 1"
+    assert validate_part(["Belt"])[1] == "expected an object"
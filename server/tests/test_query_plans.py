@@ -0,0 +1,34 @@
+"""
+The lookups the API issues on every request must keep using their index.
+
+Runs on SQLite; set PLAN_CHECK_POSTGRES_URL to a disposable database to
+also check Postgres.
+"""
+import os
+
+import pytest
+from sqlalchemy import create_engine
+
+from app.database import Base
+from benchmarks.query_plans import CHECKS, explain
+
+DIALECT_URLS = [pytest.param("sqlite", id="sqlite")]
+if os.getenv("PLAN_CHECK_POSTGRES_URL"):
+    DIALECT_URLS.append(pytest.param(os.environ["PLAN_CHECK_POSTGRES_URL"], id="postgres"))
+
+
+@pytest.fixture(scope="module", params=DIALECT_URLS)
+def engine(request, tmp_path_factory):
+    url = request.param
+    if url == "sqlite":
+        url = f"sqlite:///{tmp_path_factory.mktemp('plans')}/plans.db"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.mark.parametrize("name, statement, index", CHECKS, ids=[check[0] for check in CHECKS])
+def test_lookup_uses_index(engine, name, statement, index):
+    plan = explain(engine, statement)
+    assert index in plan, f"{name}: expected {index} in plan:\n{plan}"
@@ -0,0 +1,196 @@
+"""
+The full-text index follows inserts, updates and deletes on the four source
+tables through its triggers, and search_sessions ranks a user's sessions.
+
+Runs on SQLite (FTS5); set PLAN_CHECK_POSTGRES_URL to a disposable database
+to also check the Postgres tsvector triggers.
+"""
+import asyncio
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session
+
+from app.database import Base, to_async_url
+from app.models import DiagnosticResult, PartPrediction, RepairSummary, Session as DiagnosticSession, User
+from app.search_index import search_sessions
+
+DIALECT_URLS = [pytest.param("sqlite", id="sqlite")]
+if os.getenv("PLAN_CHECK_POSTGRES_URL"):
+    DIALECT_URLS.append(pytest.param(os.environ["PLAN_CHECK_POSTGRES_URL"], id="postgres"))
+
+
+@pytest.fixture(scope="module", params=DIALECT_URLS)
+def engine(request, tmp_path_factory):
+    url = request.param
+    if url == "sqlite":
+        url = f"sqlite:///{tmp_path_factory.mktemp('search')}/search.db"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite" and conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'search_documents'")).scalar() is None:
+            pytest.skip("SQLite build without FTS5")
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    with Session(engine) as session:
+        yield session
+
+
+def document(db, session_id):
+    """The indexed fields of a session, or None when it has no document."""
+    key = "rowid" if db.get_bind().dialect.name == "sqlite" else "session_id"
+    row = db.execute(text(f"SELECT input_text, results, parts, summary FROM search_documents WHERE {key} = :id"),
+                     {"id": session_id}).first()
+    return row._asdict() if row is not None else None
+
+
+def matches(db, session_id, query):
+    if db.get_bind().dialect.name == "sqlite":
+        statement = "SELECT rowid FROM search_documents WHERE search_documents MATCH :query AND rowid = :id"
+    else:
+        statement = ("SELECT session_id FROM search_documents "
+                     "WHERE document @@ websearch_to_tsquery('english', :query) AND session_id = :id")
+    return db.execute(text(statement), {"query": query, "id": session_id}).first() is not None
+
+
+def new_session(db, email, input_text="Honda Civic rattles at idle"):
+    user = User(email=email, hashed_password="x")
+    db.add(user)
+    db.flush()
+    session = DiagnosticSession(user_id=user.id, input_text=input_text)
+    db.add(session)
+    db.commit()
+    return user, session
+
+
+def test_insert_indexes_every_field(db):
+    _, session = new_session(db, "insert@example.com")
+    db.add_all([
+        DiagnosticResult(session_id=session.id, input_message="P0420 code", output_text="Failing catalytic converter"),
+        PartPrediction(session_id=session.id, part_name="Oxygen Sensor", confidence_score=0.8, price_estimate="$50"),
+        RepairSummary(session_id=session.id, summary_text="Replaced the downstream sensor"),
+    ])
+    db.commit()
+
+    doc = document(db, session.id)
+    assert doc["input_text"] == "Honda Civic rattles at idle"
+    assert "P0420 code" in doc["results"] and "catalytic converter" in doc["results"]
+    assert doc["parts"] == "Oxygen Sensor"
+    assert doc["summary"] == "Replaced the downstream sensor"
+    assert matches(db, session.id, "civic catalytic")
+
+
+def test_streaming_results_are_indexed_once_final(db):
+    _, session = new_session(db, "streaming@example.com")
+    result = DiagnosticResult(session_id=session.id, input_message="misfire", output_text="Worn ignition",
+                              status="streaming")
+    db.add(result)
+    db.commit()
+    assert not document(db, session.id)["results"]
+
+    result.output_text = "Worn ignition coil on cylinder three"
+    db.commit()
+    assert not document(db, session.id)["results"]
+
+    result.status = "complete"
+    db.commit()
+    assert "cylinder three" in document(db, session.id)["results"]
+    assert matches(db, session.id, "cylinder")
+
+
+def test_updates_replace_old_terms(db):
+    _, session = new_session(db, "update@example.com")
+    result = DiagnosticResult(session_id=session.id, input_message="noise", output_text="Loose heat shield")
+    part = PartPrediction(session_id=session.id, part_name="Heat Shield Clamp", confidence_score=0.6, price_estimate="$10")
+    summary = RepairSummary(session_id=session.id, summary_text="Tightened the shield")
+    db.add_all([result, part, summary])
+    db.commit()
+
+    session.input_text = "Toyota Camry squeals on cold start"
+    result.output_text = "Glazed serpentine belt"
+    part.part_name = "Serpentine Belt"
+    summary.summary_text = "Replaced the belt"
+    db.commit()
+
+    doc = document(db, session.id)
+    assert doc["input_text"] == "Toyota Camry squeals on cold start"
+    assert "serpentine" in doc["results"] and "heat shield" not in doc["results"].lower()
+    assert doc["parts"] == "Serpentine Belt"
+    assert doc["summary"] == "Replaced the belt"
+    assert matches(db, session.id, "camry serpentine")
+    assert not matches(db, session.id, "civic")
+    assert not matches(db, session.id, "clamp")
+
+
+def test_part_moved_to_another_session_updates_both(db):
+    user, first = new_session(db, "move@example.com")
+    second = DiagnosticSession(user_id=user.id, input_text="Second visit")
+    db.add(second)
+    part = PartPrediction(session_id=first.id, part_name="Water Pump", confidence_score=0.7, price_estimate="$120")
+    db.add(part)
+    db.commit()
+    assert document(db, first.id)["parts"] == "Water Pump"
+
+    part.session_id = second.id
+    db.commit()
+    assert not document(db, first.id)["parts"]
+    assert document(db, second.id)["parts"] == "Water Pump"
+
+
+def test_deletes_remove_terms_and_documents(db):
+    _, session = new_session(db, "delete@example.com")
+    result = DiagnosticResult(session_id=session.id, input_message="leak", output_text="Cracked radiator")
+    part = PartPrediction(session_id=session.id, part_name="Radiator Hose", confidence_score=0.5, price_estimate="$30")
+    summary = RepairSummary(session_id=session.id, summary_text="Pressure tested the radiator")
+    db.add_all([result, part, summary])
+    db.commit()
+
+    db.delete(part)
+    db.commit()
+    assert not document(db, session.id)["parts"]
+    db.delete(result)
+    db.commit()
+    assert not document(db, session.id)["results"]
+    db.delete(summary)
+    db.commit()
+    assert not document(db, session.id)["summary"]
+    assert not matches(db, session.id, "radiator")
+
+    db.delete(session)
+    db.commit()
+    assert document(db, session.id) is None
+
+
+def test_search_sessions_is_scoped_to_the_user_and_ranked(engine, db):
+    user, exact = new_session(db, "search@example.com", input_text="P0300 misfire on a Subaru Outback")
+    other = DiagnosticSession(user_id=user.id, input_text="Brake noise")
+    db.add(other)
+    db.flush()
+    db.add(DiagnosticResult(session_id=other.id, input_message="grinding", output_text="Possible misfire as well"))
+    _, stranger = new_session(db, "stranger@example.com", input_text="P0300 misfire on a Subaru Outback")
+    db.commit()
+
+    async def search(query):
+        async_engine = create_async_engine(to_async_url(str(engine.url.render_as_string(hide_password=False))))
+        try:
+            async with AsyncSession(async_engine) as session:
+                return await search_sessions(session, user.id, query, limit=10)
+        finally:
+            await async_engine.dispose()
+
+    results, more = asyncio.run(search("misfire"))
+    assert [result["session_id"] for result in results] == [exact.id, other.id]
+    assert stranger.id not in {result["session_id"] for result in results}
+    assert not more
+    assert "<mark>" in results[0]["snippet"]
+
+    # The last term also matches as a prefix while typing
+    results, _ = asyncio.run(search("subaru outb"))
+    assert [result["session_id"] for result in results] == [exact.id]
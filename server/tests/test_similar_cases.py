@@ -0,0 +1,163 @@
+"""
+The similar-case index without a database: building a base from cases,
+searching it (per user, clustered or whole), the delta overriding base
+rows, and rebuilds that take turns and keep only the newest version.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app.services.similar_cases import (
+    Case, SimilarCaseIndex, _normalize_rows, build_index, load_base, write_segment
+)
+
+DIMENSIONS = 64
+
+CASES = [
+    Case(1, 10, 1, "P0420 catalyst efficiency below threshold", "Failing catalytic converter",
+         ["Catalytic Converter", "Oxygen Sensor"]),
+    Case(2, 11, 1, "Squeal from the engine bay on cold start", "Glazed serpentine belt", ["Serpentine Belt"]),
+    Case(3, 12, 2, "P0420 code after a new exhaust", "Downstream oxygen sensor reading lean", ["Oxygen Sensor"]),
+    Case(4, 13, 2, "Brakes grind when stopping", "Pads worn to the backing plate", ["Brake Pads", "Rotors"]),
+]
+
+
+def index_for(directory, scope="all", probes=8):
+    index = SimilarCaseIndex(directory, DIMENSIONS, scope=scope, probes=probes)
+    index._use_base(load_base(directory))
+    return index
+
+
+def search(index, text, k=5, user_id=None, exclude_sessions=()):
+    found = index.search_vectors(index.vectorizer.query(text)[None, :], k, user_id, exclude_sessions)[0]
+    return [result_id for result_id, _, _ in found]
+
+
+def test_build_and_search(tmp_path):
+    path = build_index(str(tmp_path), DIMENSIONS, cases=lambda: iter(CASES))
+    base = load_base(str(tmp_path))
+    assert base.path == path
+    assert len(base) == 4
+    assert base.last_id == 4
+    assert base.meta["clusters"] == 1
+
+    index = index_for(str(tmp_path))
+    assert search(index, "P0420 catalytic converter")[0] == 1
+    assert search(index, "belt squeal")[0] == 2
+    # Scores come back best first
+    scores = [score for _, _, score in index.search_vectors(index.vectorizer.query("P0420")[None, :], 4)[0]]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_user_filter_and_excluded_sessions(tmp_path):
+    build_index(str(tmp_path), DIMENSIONS, cases=lambda: iter(CASES))
+    index = index_for(str(tmp_path))
+    assert set(search(index, "P0420 oxygen sensor", k=2)) == {1, 3}
+    assert search(index, "P0420 oxygen sensor", k=2, user_id=2)[0] == 3
+    assert 1 not in search(index, "P0420 oxygen sensor", user_id=2)
+    assert 3 not in search(index, "P0420 oxygen sensor", exclude_sessions=(12,))
+
+
+def test_clustered_base_finds_the_exact_top_k(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = _normalize_rows(rng.standard_normal((400, DIMENSIONS)).astype(np.float32))
+    ids = np.arange(1, 401)
+    write_segment(str(tmp_path), vectors, ids, ids, ids % 3, exact_max_rows=50)
+    base = load_base(str(tmp_path))
+    assert len(base.centroids) > 1
+
+    # Probing every cluster is an exact scan, whatever order the rows were stored in
+    index = SimilarCaseIndex(str(tmp_path), DIMENSIONS, scope="all", probes=len(base.centroids))
+    index.base = base
+    queries = vectors[:5]
+    for query, found in zip(queries, index.search_vectors(queries, 5)):
+        expected = ids[np.argsort(-(vectors @ query))[:5]]
+        assert [result_id for result_id, _, _ in found] == list(expected)
+
+    for query, found in zip(queries, index.search_vectors(queries, 5, user_id=1)):
+        assert all(result_id % 3 == 1 for result_id, _, _ in found)
+
+
+def test_delta_rows_replace_base_rows(tmp_path):
+    build_index(str(tmp_path), DIMENSIONS, cases=lambda: iter(CASES))
+    index = index_for(str(tmp_path))
+    # Result 4 was re-read after its parts changed; a new result 5 completed since the build
+    index._put([
+        Case(4, 13, 2, "Brakes grind when stopping", "Seized caliper", ["Brake Caliper"]),
+        Case(5, 14, 1, "Brake caliper sticks after a wash", "Corroded slide pins", ["Brake Caliper"]),
+    ])
+    found = index.search_vectors(index.vectorizer.query("brake caliper")[None, :], 5)[0]
+    result_ids = [result_id for result_id, _, _ in found]
+    assert sorted(result_ids[:2]) == [4, 5]
+    assert len(result_ids) == len(set(result_ids))
+
+
+def test_rebuild_keeps_only_newer_versions(tmp_path):
+    directory = str(tmp_path)
+    first = build_index(directory, DIMENSIONS, cases=lambda: iter(CASES[:2]))
+    second = build_index(directory, DIMENSIONS, cases=lambda: iter(CASES))
+    assert second != first
+    assert load_base(directory).path == second
+    assert len(load_base(directory)) == 4
+    assert not os.path.exists(first)
+
+    # Left by a build that was killed, numbered past CURRENT (e.g. after a clock step);
+    # the next build is numbered after it and removes it
+    abandoned = os.path.join(directory, f"base-{int(time.time() * 1000) + 60000}")
+    os.makedirs(abandoned)
+    third = build_index(directory, DIMENSIONS, cases=lambda: iter(CASES))
+    assert os.path.basename(third) > os.path.basename(abandoned)
+    assert not os.path.exists(abandoned)
+    assert not os.path.exists(second)
+
+
+def test_if_missing_reuses_the_current_base(tmp_path):
+    directory = str(tmp_path)
+    path = build_index(directory, DIMENSIONS, cases=lambda: iter(CASES))
+
+    def unexpected():
+        raise AssertionError("rebuilt a usable base")
+
+    assert build_index(directory, DIMENSIONS, cases=unexpected, if_missing=True) == path
+    # A base of other dimensions is not usable
+    rebuilt = build_index(directory, 32, cases=lambda: iter(CASES), if_missing=True)
+    assert rebuilt != path
+    assert load_base(directory).meta["dimensions"] == 32
+
+
+def test_concurrent_builds_take_turns(tmp_path):
+    directory = str(tmp_path)
+    building, overlaps, paths = [], [], []
+
+    def cases():
+        building.append(1)
+        if len(building) > 1:
+            overlaps.append(1)
+        time.sleep(0.05)
+        building.pop()
+        return iter(CASES)
+
+    def build():
+        paths.append(build_index(directory, DIMENSIONS, cases=cases, if_missing=True))
+
+    threads = [threading.Thread(target=build) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not overlaps
+    # One worker built; the others waited and loaded its base
+    assert len(set(paths)) == 1
+    assert [name for name in os.listdir(directory) if name.startswith("base-")] == [os.path.basename(paths[0])]
+
+
+@pytest.mark.parametrize("rows", [0, 1])
+def test_tiny_bases(tmp_path, rows):
+    build_index(str(tmp_path), DIMENSIONS, cases=lambda: iter(CASES[:rows]))
+    index = index_for(str(tmp_path))
+    assert len(index.base) == rows
+    assert search(index, "P0420 catalyst") == [1][:rows]
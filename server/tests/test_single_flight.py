@@ -0,0 +1,170 @@
+"""
+SingleFlight and StreamFanout: identical concurrent requests share one
+upstream call, errors reach every caller, and a failed or abandoned call
+is not reused by the next request.
+"""
+import asyncio
+
+import pytest
+
+from app.services.single_flight import SingleFlight, StreamFanout, request_key
+
+
+class UpstreamFailed(Exception):
+    pass
+
+
+def test_request_key_is_stable():
+    assert request_key("diagnostic", "P0420", [{"b": 1, "a": 2}]) == \
+        request_key("diagnostic", "P0420", [{"a": 2, "b": 1}])
+    assert request_key("diagnostic", "P0420") != request_key("diagnostic", "P0421")
+
+
+def test_concurrent_calls_share_one_result():
+    async def run():
+        flights = SingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"answer": 42}
+
+        results = await asyncio.gather(*(flights.do("key", call) for _ in range(5)))
+        return results, calls, flights.stats()
+
+    results, calls, stats = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert stats == {"in_flight": 0, "leaders": 1, "joiners": 4}
+
+
+def test_error_reaches_every_caller_and_is_not_reused():
+    async def run():
+        flights = SingleFlight()
+        calls = []
+
+        async def failing():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise UpstreamFailed("upstream down")
+
+        results = await asyncio.gather(*(flights.do("key", failing) for _ in range(3)), return_exceptions=True)
+
+        async def working():
+            calls.append(1)
+            return "ok"
+
+        # The failed call is gone, so the next request calls upstream again
+        retried = await flights.do("key", working)
+        return results, retried, calls, flights.stats()
+
+    results, retried, calls, stats = asyncio.run(run())
+    assert all(isinstance(result, UpstreamFailed) for result in results)
+    assert retried == "ok"
+    assert len(calls) == 2
+    assert stats["in_flight"] == 0
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    async def run():
+        flights = SingleFlight()
+
+        async def call():
+            await asyncio.sleep(0.05)
+            return "ok"
+
+        leaver = asyncio.ensure_future(flights.do("key", call))
+        stayer = asyncio.ensure_future(flights.do("key", call))
+        await asyncio.sleep(0.01)
+        leaver.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leaver
+        return await stayer
+
+    assert asyncio.run(run()) == "ok"
+
+
+def chunks(*items, delay=0.005, error=None, produced=None, closed=None):
+    """Factory for an upstream that yields items, then optionally raises."""
+    async def upstream():
+        try:
+            for item in items:
+                await asyncio.sleep(delay)
+                if produced is not None:
+                    produced.append(item)
+                yield item
+            if error is not None:
+                raise error
+        finally:
+            if closed is not None:
+                closed.append(True)
+    return upstream
+
+
+async def collect(stream):
+    received = []
+    try:
+        async for chunk in stream:
+            received.append(chunk)
+    except Exception as e:
+        return received, e
+    return received, None
+
+
+def test_late_joiner_gets_earlier_chunks_then_the_live_stream():
+    async def run():
+        fanout = StreamFanout()
+        factory = chunks("a", "b", "c", "d")
+        first = asyncio.ensure_future(collect(fanout.stream("key", factory)))
+        await asyncio.sleep(0.012)
+        second = asyncio.ensure_future(collect(fanout.stream("key", factory)))
+        return await first, await second, fanout.stats()
+
+    first, second, stats = asyncio.run(run())
+    assert first == (["a", "b", "c", "d"], None)
+    assert second == (["a", "b", "c", "d"], None)
+    assert stats == {"in_flight": 0, "leaders": 1, "joiners": 1}
+
+
+def test_upstream_error_reaches_every_subscriber_after_its_chunks():
+    async def run():
+        fanout = StreamFanout()
+        produced = []
+        factory = chunks("a", "b", error=UpstreamFailed("stream broke"), produced=produced)
+        results = await asyncio.gather(*(collect(fanout.stream("key", factory)) for _ in range(3)))
+
+        # A new request after the failure opens a new upstream
+        retried = await collect(fanout.stream("key", chunks("ok")))
+        return results, produced, retried, fanout.stats()
+
+    results, produced, retried, stats = asyncio.run(run())
+    for received, error in results:
+        assert received == ["a", "b"]
+        assert isinstance(error, UpstreamFailed)
+    assert produced == ["a", "b"]
+    assert retried == (["ok"], None)
+    assert stats == {"in_flight": 0, "leaders": 2, "joiners": 2}
+
+
+def test_upstream_is_cancelled_when_every_subscriber_leaves():
+    async def run():
+        fanout = StreamFanout()
+        produced, closed = [], []
+        factory = chunks(*"abcdefgh", delay=0.01, produced=produced, closed=closed)
+
+        first = fanout.stream("key", factory)
+        second = fanout.stream("key", factory)
+        assert await first.__anext__() == "a"
+        assert await second.__anext__() == "a"
+        # One subscriber leaving keeps the upstream going for the other
+        await first.aclose()
+        assert await second.__anext__() == "b"
+        await second.aclose()
+        await asyncio.sleep(0.05)
+        return produced, closed, fanout.stats()
+
+    produced, closed, stats = asyncio.run(run())
+    assert closed == [True]
+    assert len(produced) < 8
+    assert stats["in_flight"] == 0
@@ -0,0 +1,104 @@
+"""
+Flush policies group streamed tokens into frames: per token, by bytes,
+at sentence ends or on a timer, always without losing or reordering text.
+"""
+import asyncio
+
+import pytest
+
+from app.services.streaming import (
+    ByteThresholdFlush, SentenceFlush, TimeFlush, TokenFlush, apply_flush_policy, default_flush_policy,
+    flush_policy_from_params, split_tokens
+)
+
+TEXT = "Likely a worn coil. Check cylinder 3 first!\nThen replace the plugs — all of them."
+
+
+async def token_stream(tokens, delays=None):
+    for index, token in enumerate(tokens):
+        if delays is not None:
+            await asyncio.sleep(delays[index])
+        yield token
+
+
+def frames(policy, tokens, delays=None):
+    async def run():
+        return [frame async for frame in apply_flush_policy(token_stream(tokens, delays), policy)]
+    return asyncio.run(run())
+
+
+def test_split_tokens_round_trips():
+    tokens = split_tokens(TEXT)
+    assert "".join(tokens) == TEXT
+    assert tokens[:3] == ["Likely ", "a ", "worn "]
+    assert split_tokens("") == []
+
+
+@pytest.mark.parametrize("policy", [
+    TokenFlush(), ByteThresholdFlush(10), ByteThresholdFlush(1000), SentenceFlush(), SentenceFlush(16), TimeFlush(1),
+], ids=lambda policy: f"{policy.name}")
+def test_every_policy_keeps_the_text(policy):
+    assert "".join(frames(policy, split_tokens(TEXT))) == TEXT
+
+
+def test_token_flush_sends_each_token():
+    tokens = split_tokens(TEXT)
+    assert frames(TokenFlush(), tokens) == tokens
+
+
+def test_byte_threshold_counts_utf8_bytes():
+    # "é" is two bytes, so three of them pass a 5-byte threshold
+    assert frames(ByteThresholdFlush(5), ["é", "é", "é", "x"]) == ["ééé", "x"]
+    assert frames(ByteThresholdFlush(5), ["ab", "cd", "ef", "g"]) == ["abcdef", "g"]
+    assert frames(default_flush_policy(), ["0123456789", "a", "b"]) == ["0123456789a", "b"]
+
+
+def test_sentence_flush_at_boundaries_and_cap():
+    assert frames(SentenceFlush(), split_tokens(TEXT)) == [
+        "Likely a worn coil. ",
+        "Check cylinder 3 first!\n",
+        "Then replace the plugs — all of them.",
+    ]
+    # A run-on sentence is cut once it reaches max_bytes
+    assert frames(SentenceFlush(8), ["abcd ", "efgh ", "ij."]) == ["abcd efgh ", "ij."]
+
+
+def test_time_flush_groups_tokens_by_interval():
+    # Two bursts 150 ms apart with a 50 ms window
+    tokens = ["a", "b", "c", "d", "e"]
+    delays = [0, 0.001, 0.001, 0.15, 0.001]
+    assert frames(TimeFlush(50), tokens, delays) == ["abc", "de"]
+
+
+def test_time_flush_sends_the_tail_and_nothing_empty():
+    assert frames(TimeFlush(1000), ["a", "b"]) == ["ab"]
+    assert frames(TimeFlush(10), []) == []
+
+
+def test_time_flush_raises_upstream_errors_after_earlier_frames():
+    async def failing():
+        yield "a"
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream broke")
+
+    async def run():
+        received = []
+        with pytest.raises(RuntimeError, match="upstream broke"):
+            async for frame in apply_flush_policy(failing(), TimeFlush(10)):
+                received.append(frame)
+        return received
+
+    assert asyncio.run(run()) == ["a"]
+
+
+def test_flush_policy_from_params():
+    assert isinstance(flush_policy_from_params({}), ByteThresholdFlush)
+    assert isinstance(flush_policy_from_params({"flush": "token"}), TokenFlush)
+    assert flush_policy_from_params({"flush": "bytes", "flush_bytes": "64"}).threshold == 64
+    assert flush_policy_from_params({"flush": "time", "flush_ms": "250"}).max_delay == 0.25
+    assert flush_policy_from_params({"flush": "sentence", "flush_bytes": "100"}).max_bytes == 100
+
+    with pytest.raises(ValueError, match="Unknown flush policy"):
+        flush_policy_from_params({"flush": "paragraph"})
+    with pytest.raises(ValueError, match="Invalid flush parameters"):
+        flush_policy_from_params({"flush": "bytes", "flush_bytes": "many"})